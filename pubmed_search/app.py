@@ -1,37 +1,245 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import (Flask, render_template, request, jsonify, session, redirect, url_for,
+                   Response, make_response, stream_with_context)
 from flask_session import Session
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import json
 from datetime import datetime
 import uuid
-import threading
 import time
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+from datetime import timezone
+from itertools import groupby
 try:
     from .pubmed_search_core import (
-        init_database, generate_pubmed_query_with_ai, generate_inclusive_fallback_query,
-        search_pubmed, fetch_article_details, assign_scores_by_if, filter_articles,
-        filter_articles_by_type, save_search_to_database, get_search_history,
-        get_search_by_id, fetch_article_details_with_progress
+        generate_pubmed_query_with_ai, generate_inclusive_fallback_query,
+        stream_pubmed_query_with_ai, build_search_term, count_pubmed,
+        search_pubmed, refine_pubmed, fetch_article_details, assign_scores_by_if, filter_articles,
+        filter_articles_by_type, get_search_by_id, fetch_article_details_with_progress, reserve_search_id,
+        release_search_id, get_search_history_page, get_search_info, iter_search_articles,
+        iter_search_article_rows, iter_articles_for_searches, get_search_infos,
+        get_search_versions, get_search_trace, SearchCancelled, raise_if_cancelled,
+        year_or_none
     )
+    from .retention import start_retention_worker
+    from .write_queue import search_write_queue
+    from .job_store import JobStore
+    from .result_store import ResultStore, RESULT_PURGE_INTERVAL_SECONDS
+    from .exporters import EXPORT_FORMATS, BULK_FORMATS, export_chunks, zip_export_chunks
+    from .search_executor import SearchExecutor, SearchQueueFull
+    from .result_index import ResultIndex, CARD_COLUMNS
+    from .ncbi_scheduler import ncbi_user, ncbi_scheduler
+    from .metrics import REGISTRY, STAGE_SECONDS, CACHE_REQUESTS, SEARCHES, gauge
+    from .search_trace import SearchTrace, profile_mode
+    from .query_cache import AIQueryCache, BackgroundQueryGenerator
+    from .coalescing_cache import CoalescingCache
+    from .query_parser import QuerySyntaxError, canonical_query
 except ImportError:
     from pubmed_search_core import (
-        init_database, generate_pubmed_query_with_ai, generate_inclusive_fallback_query,
-        search_pubmed, fetch_article_details, assign_scores_by_if, filter_articles,
-        filter_articles_by_type, save_search_to_database, get_search_history,
-        get_search_by_id,
-        fetch_article_details_with_progress
+        generate_pubmed_query_with_ai, generate_inclusive_fallback_query,
+        stream_pubmed_query_with_ai, build_search_term, count_pubmed,
+        search_pubmed, refine_pubmed, fetch_article_details, assign_scores_by_if, filter_articles,
+        filter_articles_by_type, get_search_by_id,
+        fetch_article_details_with_progress, reserve_search_id, release_search_id,
+        get_search_history_page, get_search_info, iter_search_articles,
+        iter_search_article_rows, iter_articles_for_searches, get_search_infos,
+        get_search_versions, get_search_trace, SearchCancelled, raise_if_cancelled,
+        year_or_none
     )
+    from retention import start_retention_worker
+    from write_queue import search_write_queue
+    from job_store import JobStore
+    from result_store import ResultStore, RESULT_PURGE_INTERVAL_SECONDS
+    from exporters import EXPORT_FORMATS, BULK_FORMATS, export_chunks, zip_export_chunks
+    from search_executor import SearchExecutor, SearchQueueFull
+    from result_index import ResultIndex, CARD_COLUMNS
+    from ncbi_scheduler import ncbi_user, ncbi_scheduler
+    from metrics import REGISTRY, STAGE_SECONDS, CACHE_REQUESTS, SEARCHES, gauge
+    from search_trace import SearchTrace, profile_mode
+    from query_cache import AIQueryCache, BackgroundQueryGenerator
+    from coalescing_cache import CoalescingCache
+    from query_parser import QuerySyntaxError, canonical_query
 
 app = Flask(__name__)
+# 前面的反向代理层数（Render为1）：remote_addr取代理追加的X-Forwarded-For条目，
+# 客户端自己填写的条目不会被采信；直接对外提供服务时设为0
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "1"))
+if TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 app.config['SESSION_TYPE'] = 'filesystem'
 Session(app)
 
-# 初始化数据库
-init_database()
+# 数据库在第一次使用时才初始化（get_db_connection），worker启动时不执行DDL
+
+# ---- HTTP缓存 ----
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+def _compute_build_id():
+    """代码、模板、静态文件内容的摘要：部署新版本后历史页面和导出的ETag随之变化"""
+    digest = hashlib.sha1()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(package_dir, name) for name in os.listdir(package_dir) if name.endswith('.py')]
+    for folder in (app.template_folder, app.static_folder):
+        for root, _, names in os.walk(os.path.join(package_dir, folder)):
+            paths.extend(os.path.join(root, name) for name in names)
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:10]
+
+BUILD_ID = _compute_build_id()
+_static_fingerprints = {}
+
+def static_fingerprint(filename):
+    """静态文件内容摘要（按修改时间缓存），文件不存在时返回None"""
+    path = os.path.join(app.static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    fingerprint = _static_fingerprints.get(key)
+    if fingerprint is None:
+        with open(path, 'rb') as f:
+            fingerprint = hashlib.md5(f.read()).hexdigest()[:12]
+        _static_fingerprints[key] = fingerprint
+    return fingerprint
+
+@app.url_defaults
+def add_static_fingerprint(endpoint, values):
+    """url_for('static', ...) 自动带上内容摘要 ?v=..."""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        fingerprint = static_fingerprint(values['filename'])
+        if fingerprint:
+            values['v'] = fingerprint
+
+@app.after_request
+def cache_fingerprinted_static(response):
+    """摘要匹配的静态文件URL内容不会变化，允许浏览器长期缓存"""
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        version = request.args.get('v')
+        if version and version == static_fingerprint(request.view_args.get('filename', '')):
+            response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    return response
+
+def _parse_db_timestamp(value):
+    """SQLite CURRENT_TIMESTAMP（UTC）转为datetime"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+def history_validators(search_ids, variant=''):
+    """
+    历史搜索的ETag和Last-Modified，由搜索ID和写入版本决定
+
+    Returns:
+        (etag, last_modified)，任一搜索不存在或尚未保存时返回None
+    """
+    versions = get_search_versions(search_ids)
+    if len(versions) != len(set(search_ids)):
+        return None
+    digest = hashlib.sha1(repr(sorted(versions.items())).encode('utf-8')).hexdigest()[:16]
+    timestamps = [_parse_db_timestamp(updated_at) for _, updated_at in versions.values()]
+    timestamps = [timestamp for timestamp in timestamps if timestamp]
+    last_modified = max(timestamps) if timestamps else None
+    return f'{digest}-{BUILD_ID}{variant}', last_modified
+
+def is_not_modified(validators):
+    """按If-None-Match（优先）或If-Modified-Since判断客户端缓存是否仍然有效"""
+    if validators is None:
+        return False
+    etag, last_modified = validators
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+def with_validators(response, validators):
+    """附加ETag/Last-Modified，要求每次使用前向服务器校验（未变化时返回304）"""
+    if validators is not None:
+        etag, last_modified = validators
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified_response(validators):
+    return with_validators(Response(status=304), validators)
+
+# 后台定期清理过期搜索历史并回收数据库空间
+start_retention_worker()
+
+# 搜索进度和结果保存在共享的SQLite中，任一worker都能响应进度查询和结果页
+search_progress = JobStore()
+
+# 完成的结果集按search_session_id保存，页面和导出按切片读取；session中只保存ID
+search_results = ResultStore()
+# AI生成的查询按主题缓存，所有worker共用
+ai_query_cache = AIQueryCache()
+# 请求线程最多等待AI_QUERY_BUDGET_SECONDS，超时后先返回fallback查询，AI结果在后台完成后写入缓存
+ai_query_generator = BackgroundQueryGenerator(ai_query_cache, generate_pubmed_query_with_ai,
+                                              stream_pubmed_query_with_ai)
+_last_purge = 0.0
+
+def purge_expired_search_state():
+    """清理过期的结果集和任务状态（每个worker最多每RESULT_PURGE_INTERVAL_SECONDS执行一次）"""
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < RESULT_PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    try:
+        purged_results = search_results.purge_expired()
+        purged_jobs = search_progress.purge_expired(search_results.ttl_seconds)
+        if purged_results or purged_jobs:
+            app.logger.info(f"Purged {purged_results} result sets and {purged_jobs} job states")
+    except Exception as e:
+        app.logger.error(f"Purging expired search state failed: {e}")
+
+def publish_queue_positions(snapshot):
+    """
+    把本worker中排队任务的位置和预计开始时间写入任务状态
+
+    快照在执行器的锁外发布，可能已经过时：只更新状态仍为queued的任务，
+    不会把已开始执行或已取消的任务改回排队
+    """
+    for search_session_id, position, wait_seconds in snapshot:
+        search_progress.update_if_status(search_session_id, 'queued', {
+            'queue_position': position,
+            'estimated_start_seconds': wait_seconds,
+            'message': f'排队中，前面还有 {position - 1} 个搜索，预计 {wait_seconds} 秒后开始...'
+        })
+
+# 固定并发的搜索执行器（SEARCH_CONCURRENCY / SEARCH_QUEUE_SIZE），队列满时拒绝新搜索
+search_executor = SearchExecutor(on_queue_change=publish_queue_positions)
+
+# 抓取时读取的当前状态
+gauge('pubmed_search_queue_depth', '本worker中排队等待执行的搜索数',
+      callback=lambda: search_executor.stats()['queued'])
+gauge('pubmed_search_active_jobs', '本worker中正在执行的搜索数',
+      callback=lambda: search_executor.stats()['running'])
+gauge('pubmed_write_queue_pending', '等待写入历史数据库的搜索数',
+      callback=lambda: search_write_queue.qsize())
+gauge('pubmed_ncbi_waiting_requests', '等待NCBI请求机会的请求数', ('priority',),
+      callback=lambda: {(priority,): ncbi_scheduler.stats()[f'waiting_{priority}']
+                        for priority in ('interactive', 'bulk')})
 
-# 添加进度存储
-search_progress = {}
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")   # 设置后 /metrics 需要 Authorization: Bearer <token>
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus文本格式的指标（本worker进程）"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-store'})
 
 @app.route('/')
 def index():
@@ -40,18 +248,184 @@ def index():
 
 @app.route('/search')
 def search_page():
-    """搜索页面"""
-    return render_template('search.html')
+    """搜索页面；?refine=<search_session_id>时预填该次搜索的条件，提交后在其结果上缩小范围"""
+    refine = None
+    refine_from = request.args.get('refine', '').strip()
+    meta = search_results.get_meta(refine_from) if refine_from else None
+    if meta and meta['search_params'].get('ncbi_history'):
+        history = meta['search_params']['ncbi_history']
+        refine = {
+            'search_session_id': refine_from,
+            'user_topic': meta['search_params'].get('user_topic', ''),
+            'query': history['query'],
+            'journal_filter': history['journal'] or '',
+            'min_year': history['min_year'] or '',
+            'max_year': history['max_year'] or '',
+            'min_score': meta['search_params'].get('min_score', 0)
+        }
+    return render_template('search.html', refine=refine)
+
+HISTORY_FILTER_ARGS = ('q', 'min_year', 'max_year', 'min_results', 'max_results')
+
+def _history_query_from_args(args):
+    """从请求参数中读取历史列表的筛选和分页条件"""
+    return {
+        'limit': args.get('limit', 20, type=int),
+        'cursor': args.get('cursor') or None,
+        'text': args.get('q', '').strip() or None,
+        'min_year': args.get('min_year', type=int),
+        'max_year': args.get('max_year', type=int),
+        'min_results': args.get('min_results', type=int),
+        'max_results': args.get('max_results', type=int)
+    }
 
 @app.route('/history')
 def history_page():
     """历史记录页面"""
-    history = get_search_history(limit=20)
-    return render_template('history.html', history=history)
+    filters = {key: request.args.get(key, '') for key in HISTORY_FILTER_ARGS}
+    try:
+        page = get_search_history_page(**_history_query_from_args(request.args))
+    except ValueError as e:
+        return render_template('history.html', history=[], next_cursor=None, filters=filters, error=str(e)), 400
+    except Exception as e:
+        app.logger.error(f"Loading search history failed: {e}", exc_info=True)
+        return render_template('history.html', history=[], next_cursor=None, filters=filters,
+                               error='获取搜索历史失败，请稍后重试'), 500
+    return render_template('history.html',
+                         history=page['items'],
+                         next_cursor=page['next_cursor'],
+                         filters=filters)
+
+@app.route('/api/history')
+def api_history():
+    """搜索历史API - 支持游标分页和筛选"""
+    try:
+        page = get_search_history_page(**_history_query_from_args(request.args))
+        return jsonify({
+            'success': True,
+            'items': page['items'],
+            'next_cursor': page['next_cursor']
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Loading search history failed: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': f'获取搜索历史失败: {e}'}), 500
+
+# 历史搜索的卡片索引按 (搜索ID, 写入版本) 缓存，结果被重写时自动失效
+HISTORY_INDEX_CACHE_SIZE = 32
+_history_indexes = OrderedDict()
+_history_indexes_lock = threading.Lock()
+
+def history_result_index(search_id):
+    """历史搜索的ResultIndex，搜索不存在或尚未保存时返回None"""
+    versions = get_search_versions([search_id])
+    if search_id not in versions:
+        return None
+    key = (search_id, versions[search_id][0])
+    with _history_indexes_lock:
+        index = _history_indexes.get(key)
+        if index is not None:
+            _history_indexes.move_to_end(key)
+    CACHE_REQUESTS.inc(cache='history_index', result='miss' if index is None else 'hit')
+    if index is not None:
+        return index
+    
+    index = ResultIndex.from_articles(iter_search_article_rows(search_id, columns=CARD_COLUMNS))
+    with _history_indexes_lock:
+        _history_indexes[key] = index
+        while len(_history_indexes) > HISTORY_INDEX_CACHE_SIZE:
+            _history_indexes.popitem(last=False)
+    return index
+
+@app.route('/api/results/<result_id>')
+def api_results(result_id):
+    """
+    结果卡片API：本次会话的结果（search_session_id）或历史搜索（数字ID）
+    
+    参数: sort=score|year|impact_factor, order=desc|asc, cursor, limit,
+         journal, type, min_year, max_year, min_score
+    """
+    complete = True
+    if result_id.isdigit():
+        index = history_result_index(int(result_id))
+    else:
+        index = search_results.get_index(result_id)
+        meta = search_results.get_meta(result_id)
+        complete = meta is None or meta['complete']
+    if index is None:
+        return jsonify({'success': False, 'error': '搜索结果不存在'}), 404
+    
+    args = request.args
+    try:
+        page = index.query(
+            sort=args.get('sort', 'score'),
+            order=args.get('order', 'desc'),
+            cursor=args.get('cursor') or None,
+            limit=args.get('limit', 20, type=int),
+            journal=args.get('journal', '').strip() or None,
+            article_type=args.get('type', '').strip() or None,
+            min_year=args.get('min_year', type=int),
+            max_year=args.get('max_year', type=int),
+            min_score=args.get('min_score', type=float)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'complete': complete, **page})
+
+@app.route('/api/results/<search_session_id>/stream')
+def api_results_stream(search_session_id):
+    """
+    NDJSON结果流：文章按到达顺序逐行输出，搜索仍在进行时持续等待新的批次
+    
+    每行一个对象：{"type": "article", "position", "article"}，
+    最后一行 {"type": "end", "status", "total", "message"}；offset参数可从指定位置继续读取
+    """
+    offset = max(0, request.args.get('offset', 0, type=int))
+    if search_progress.get(search_session_id) is None and search_results.get_meta(search_session_id) is None:
+        return jsonify({'success': False, 'error': '搜索会话不存在'}), 404
+    if not _acquire_stream_slot():
+        return _streams_busy_response(url_for('api_results', result_id=search_session_id))
+
+    def line(record):
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+    def generate():
+        sent = offset
+        version = -1
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        while True:
+            # 先读任务状态再读文章：状态为完成时，之前追加的批次一定已经可读
+            state = search_progress.wait_for_change(search_session_id, version, SSE_HEARTBEAT_SECONDS)
+            status = state.get('status') if state is not None else 'completed'
+            if state is not None:
+                version = state['version']
+            while True:
+                batch = search_results.get_articles(search_session_id, sent, 500)
+                for article in batch:
+                    yield line({'type': 'article', 'position': sent, 'article': article})
+                    sent += 1
+                if len(batch) < 500:
+                    break
+            if state is None or status in TERMINAL_STATUSES:
+                yield line({'type': 'end', 'status': status, 'total': sent,
+                            'message': state.get('message') if state is not None else None})
+                return
+            if time.monotonic() >= deadline:
+                yield line({'type': 'end', 'status': 'timeout', 'total': sent,
+                            'message': '连接时间过长，请用offset参数从已收到的位置继续读取'})
+                return
+
+    return _stream_response(generate, 'application/x-ndjson')
 
 @app.route('/history/<int:search_id>')
 def view_history(search_id):
-    """查看历史搜索结果"""
+    """查看历史搜索结果（已保存的搜索不会再变化，支持ETag/Last-Modified条件请求）"""
+    validators = history_validators([search_id])
+    if is_not_modified(validators):
+        return not_modified_response(validators)
+    
     search_data = get_search_by_id(search_id)
     
     if not search_data:
@@ -77,18 +451,33 @@ def view_history(search_id):
     end_idx = start_idx + per_page
     page_articles = articles[start_idx:end_idx]
     
-    return render_template('history_results.html',
+    response = make_response(render_template('history_results.html',
                          articles=page_articles,
                          search_params=search_params,
                          current_page=page,
                          total_pages=total_pages,
                          total_articles=len(articles),
                          search_id=search_id,
-                         is_history=True)
+                         is_history=True))
+    return with_validators(response, validators)
+
+@app.route('/api/history/<int:search_id>/trace')
+def api_history_trace(search_id):
+    """某次已保存搜索的执行记录：阶段耗时、efetch批次、请求字节数/重试、结果漏斗和可选的profile"""
+    trace = get_search_trace(search_id)
+    if trace is None:
+        return jsonify({'success': False, 'error': '搜索记录不存在'}), 404
+    return jsonify({'success': True, 'search_id': search_id, 'trace': trace or None})
 
 @app.route('/api/generate_query', methods=['POST'])
 def api_generate_query():
-    """AI生成查询API - 带fallback机制"""
+    """
+    AI生成查询API - 带缓存、时间预算和fallback机制
+
+    AI在预算内未返回时立即返回fallback查询并标记pending，生成在后台继续，
+    页面轮询/api/generate_query/status取得结果。
+    stream=true时以SSE逐段返回AI生成的文本（见generate_query_stream）
+    """
     try:
         data = request.get_json()
         user_topic = data.get('topic', '').strip()
@@ -96,25 +485,33 @@ def api_generate_query():
         if not user_topic:
             return jsonify({'success': False, 'error': '请提供研究主题'})
 
-        # 尝试使用AI生成查询
-        ai_query = generate_pubmed_query_with_ai(user_topic)
+        # 长连接名额用完时按非流式处理：预算内返回查询或fallback，页面再轮询生成结果
+        if data.get('stream') and _acquire_stream_slot():
+            return generate_query_stream(user_topic)
+
+        # 相同（忽略大小写、标点和空白差异）的主题直接返回缓存的查询
+        ai_query, status = ai_query_generator.generate(user_topic)
 
         if ai_query:
             return jsonify({
                 'success': True,
                 'query': ai_query,
                 'topic': user_topic,
-                'fallback_used': False
+                'fallback_used': False,
+                'cache_hit': status == 'cached',
+                'pending': False
             })
         else:
-            # AI失败时使用fallback机制
-            print(f"⚠️ AI生成失败，使用fallback查询: {user_topic}")
+            # AI失败或超出时间预算时先使用fallback机制
+            print(f"⚠️ AI{'生成超时' if status == 'pending' else '生成失败'}，使用fallback查询: {user_topic}")
             fallback_query = generate_inclusive_fallback_query(user_topic)
             return jsonify({
                 'success': True,
                 'query': fallback_query,
                 'topic': user_topic,
-                'fallback_used': True
+                'fallback_used': True,
+                'cache_hit': False,
+                'pending': status == 'pending'
             })
 
     except Exception as e:
@@ -129,12 +526,128 @@ def api_generate_query():
                     'query': fallback_query,
                     'topic': user_topic,
                     'fallback_used': True,
+                    'cache_hit': False,
+                    'pending': False,
                     'error_message': str(e)
                 })
         except:
             pass
         return jsonify({'success': False, 'error': str(e)})
 
+AI_QUERY_STREAM_MAX_SECONDS = 90      # 流式生成的最长等待
+AI_QUERY_STREAM_KEEPALIVE_SECONDS = 15
+
+def generate_query_stream(user_topic):
+    """
+    流式AI查询生成（text/event-stream），调用方已通过_acquire_stream_slot占用名额
+
+    事件：token {text}（追加到查询末尾）、fallback {query}（时间预算内没有收到任何文本时先给出的基础查询）、
+    done {query, cache_hit}（完整查询，以此为准）、error {error, query}（失败，query为基础查询）
+    """
+    cached_query = ai_query_cache.get(user_topic)
+
+    def generate():
+        if cached_query:
+            yield _sse_event('done', {'query': cached_query, 'cache_hit': True})
+            return
+        events = ai_query_generator.stream(user_topic)
+        started = time.monotonic()
+        received_text = False
+        fallback_sent = False
+        while True:
+            elapsed = time.monotonic() - started
+            if elapsed >= AI_QUERY_STREAM_MAX_SECONDS:
+                # 生成仍在后台继续，完成后写入缓存
+                yield _sse_event('error', {'error': 'AI查询生成超时',
+                                           'query': generate_inclusive_fallback_query(user_topic)})
+                return
+            if not received_text and not fallback_sent:
+                timeout = max(0.0, ai_query_generator.budget_seconds - elapsed)
+            else:
+                timeout = AI_QUERY_STREAM_KEEPALIVE_SECONDS
+            timeout = min(timeout, AI_QUERY_STREAM_MAX_SECONDS - elapsed)
+            try:
+                kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                if not received_text and not fallback_sent:
+                    fallback_sent = True
+                    yield _sse_event('fallback', {'query': generate_inclusive_fallback_query(user_topic)})
+                else:
+                    yield ': keepalive\n\n'
+                continue
+            if kind == 'token':
+                received_text = True
+                yield _sse_event('token', {'text': value})
+            elif kind == 'done':
+                yield _sse_event('done', {'query': value, 'cache_hit': False})
+                return
+            else:
+                yield _sse_event('error', {'error': value, 'query': generate_inclusive_fallback_query(user_topic)})
+                return
+
+    return _stream_response(generate, 'text/event-stream')
+
+@app.route('/api/generate_query/status')
+def api_generate_query_status():
+    """后台AI生成的结果：status为 done（附query）/ pending / failed / unknown"""
+    user_topic = request.args.get('topic', '').strip()
+    if not user_topic:
+        return jsonify({'success': False, 'error': '请提供研究主题'}), 400
+    ai_query, status = ai_query_generator.status(user_topic)
+    return jsonify({'success': True, 'topic': user_topic, 'status': status, 'query': ai_query})
+
+# 查询草稿的命中数预览：按esearch term的规范形式缓存（只是大小写、顺序不同的查询共用结果），
+# 并发的相同请求只发出一次esearch
+QUERY_COUNT_CACHE_SECONDS = int(os.environ.get("QUERY_COUNT_CACHE_SECONDS", "600"))
+query_counts = CoalescingCache('query_count', QUERY_COUNT_CACHE_SECONDS, max_entries=2000)
+
+def _query_cache_key(term):
+    try:
+        return canonical_query(term)
+    except QuerySyntaxError:
+        return term
+
+SMALL_SEARCH_MAX_ARTICLES = int(os.environ.get("SMALL_SEARCH_MAX_ARTICLES", "500"))
+
+def is_small_search(query, journal_filter, min_year, max_year, refine_from):
+    """
+    是否按小搜索提交（search_executor的单独通道，不排在大搜索后面）
+
+    缩小范围的搜索，或页面输入时已查过命中数（/api/query_count的缓存）且不超过SMALL_SEARCH_MAX_ARTICLES。
+    没有缓存的命中数（如计数请求落在其他worker上）时按普通搜索处理
+    """
+    if refine_from:
+        return True
+    term = build_search_term(query, journal_filter, min_year or None, max_year or None, verbose=False)
+    counted = query_counts.peek(_query_cache_key(term))
+    return counted is not None and counted['count'] <= SMALL_SEARCH_MAX_ARTICLES
+
+@app.route('/api/query_count', methods=['POST'])
+def api_query_count():
+    """
+    当前查询加期刊、年份过滤后的命中数（esearch rettype=count）
+
+    只返回数量，不建立history、不获取PMID；页面在用户停止输入后调用（前端防抖）
+    """
+    data = request.get_json() or {}
+    query = data.get('query', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': '请提供搜索查询'}), 400
+    term = build_search_term(query, data.get('journal_filter', '').strip(),
+                             data.get('min_year', '').strip() or None, data.get('max_year', '').strip() or None,
+                             verbose=False)
+    try:
+        # 计数请求按交互请求优先调度，计入该用户的NCBI份额
+        with ncbi_user(client_key()):
+            result, cached = query_counts.get_or_compute(_query_cache_key(term), lambda: count_pubmed(term))
+    except ValueError as e:
+        # PubMed无法解析查询
+        return jsonify({'success': False, 'error': str(e), 'term': term})
+    except Exception as e:
+        print(f"❌ 获取命中数失败: {e}")
+        return jsonify({'success': False, 'error': '暂时无法获取命中数'}), 502
+    return jsonify({'success': True, 'term': term, 'cache_hit': cached, **result})
+
 @app.route('/api/search', methods=['POST'])
 def api_search():
     """执行搜索API - 支持进度推送"""
@@ -150,6 +663,8 @@ def api_search():
         max_year = data.get('max_year', '').strip()
         min_score = float(data.get('min_score', 0))
         article_types = data.get('article_types', ['all'])
+        # 在某次已完成搜索的结果上缩小范围（/search?refine=<search_session_id>）
+        refine_from = data.get('refine_from', '').strip() or None
         
         if not query:
             return jsonify({'success': False, 'error': '请提供搜索查询'})
@@ -159,22 +674,30 @@ def api_search():
         session['current_search'] = search_session_id
         
         # 初始化进度
-        search_progress[search_session_id] = {
-            'status': 'starting',
+        search_progress.create(search_session_id, {
+            'status': 'queued',
             'progress': 0,
-            'message': '正在初始化搜索...',
+            'message': '正在排队...',
             'total_articles': 0,
             'processed_articles': 0
-        }
+        })
         
-        # 在后台线程中执行搜索
-        search_thread = threading.Thread(
-            target=execute_search_with_progress,
-            args=(search_session_id, query, user_topic, ai_generated_query,
-                  journal_filter, min_year, max_year, min_score, article_types)
-        )
-        search_thread.daemon = True
-        search_thread.start()
+        # 交给搜索执行器，队列已满时返回429
+        try:
+            search_executor.submit(
+                search_session_id, execute_search_with_progress,
+                search_session_id, query, user_topic, ai_generated_query,
+                journal_filter, min_year, max_year, min_score, article_types, client_key(),
+                profile_mode(data.get('profile')), time.time(), refine_from,
+                interactive=is_small_search(query, journal_filter, min_year, max_year, refine_from)
+            )
+        except SearchQueueFull:
+            search_progress.delete(search_session_id)
+            stats = search_executor.stats()
+            retry_after = max(1, int(stats['avg_job_seconds'] / stats['concurrency']))
+            response = jsonify({'success': False, 'error': '当前搜索请求过多，请稍后再试'})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
         
         return jsonify({
             'success': True,
@@ -185,42 +708,90 @@ def api_search():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def client_key():
+    """
+    NCBI请求公平调度的用户标识：客户端IP
+
+    经反向代理时由ProxyFix取可信代理追加的X-Forwarded-For条目（见TRUSTED_PROXY_COUNT），
+    客户端每次伪造不同的X-Forwarded-For也仍是同一个用户
+    """
+    return request.remote_addr or 'unknown'
+
 def execute_search_with_progress(search_session_id, query, user_topic, ai_generated_query,
-                                journal_filter, min_year, max_year, min_score, article_types):
-    """在后台执行搜索并更新进度"""
-    with app.app_context():
+                                journal_filter, min_year, max_year, min_score, article_types,
+                                user_key=None, profile=None, submitted_at=None, refine_from=None):
+    """
+    在后台执行搜索并更新进度
+
+    refine_from为之前某次搜索的search_session_id：新条件只是在其基础上缩小范围时，在NCBI历史结果集上
+    追加过滤条件，之前已获取的文章直接复用，只efetch新出现的PMID
+    """
+    # 取消标志在esearch后、每批efetch前、解析前、等待NCBI请求机会时以及写入结果前检查
+    cancel = search_progress.cancel_token(search_session_id)
+    # 执行记录随结果一起写入search_history（/api/history/<id>/trace）
+    trace = SearchTrace('web', profile)
+    if submitted_at is not None:
+        trace.queue_seconds = round(max(0.0, time.time() - submitted_at), 4)
+    # 本线程的NCBI请求计入user_key的份额
+    with app.app_context(), ncbi_user(user_key, cancel), trace.activate():
+        search_id = None
         try:
+            trace.start_profiling()
             app.logger.info(f"Thread {search_session_id}: Starting search execution.")
+            # 排队期间（可能在其他worker上）已被取消
+            raise_if_cancelled(cancel)
+            
+            search_params = build_search_params(user_topic, ai_generated_query, query, journal_filter,
+                                                min_year, max_year, min_score, article_types)
+            # 预留搜索ID，结果由后台写入队列写入
+            search_id = reserve_search_id(search_params)
+            search_progress.update(search_session_id, {'search_id': search_id})
             
             # 更新进度：开始搜索
-            search_progress[search_session_id].update({
+            search_progress.update(search_session_id, {
                 'status': 'searching',
                 'progress': 10,
+                'queue_position': 0,
+                'estimated_start_seconds': 0,
                 'message': '正在搜索PubMed数据库...'
             })
             app.logger.info(f"Thread {search_session_id}: Updated progress to 'searching'.")
             
-            # 执行搜索
-            search_result = search_pubmed( # Call to pubmed_search_core
-                query=query,
-                journal=journal_filter,
-                min_year=min_year if min_year else None,
-                max_year=max_year if max_year else None,
-                main_journals_only=True
-            )
+            # 执行搜索：能在上次结果集上缩小范围时只发送新增的过滤条件，历史失效时改为完整搜索
+            refinement = refinement_base(refine_from, query, journal_filter, min_year, max_year)
+            with trace.span('esearch'):
+                search_result = None
+                if refinement is not None:
+                    search_progress.update(search_session_id, {'message': '正在上次结果的基础上缩小范围...'})
+                    history = refinement['history']
+                    search_result = refine_pubmed(history['web_env'], history['query_key'], **refinement['filters'])
+                if search_result is None:
+                    refinement = None
+                    search_result = search_pubmed( # Call to pubmed_search_core
+                        query=query,
+                        journal=journal_filter,
+                        min_year=min_year if min_year else None,
+                        max_year=max_year if max_year else None,
+                        main_journals_only=True
+                    )
+            raise_if_cancelled(cancel)
             app.logger.info(f"Thread {search_session_id}: search_pubmed returned. PMIDs found: {len(search_result.get('pmids', [])) if search_result else 'None'}")
 
             if not search_result or (not search_result.get("pmids") and not (search_result.get("web_env") and search_result.get("query_key"))):
-                search_progress[search_session_id].update({
+                error = search_result.get("error") if search_result else None
+                search_progress.update(search_session_id, {
                     'status': 'error',
                     'progress': 0,
-                    'message': '未找到任何文章，请尝试其他搜索条件'
+                    'message': f'PubMed搜索失败: {error}' if error else '未找到任何文章，请尝试其他搜索条件'
                 })
                 app.logger.warning(f"Thread {search_session_id}: No articles found by search_pubmed.")
+                SEARCHES.inc(status='error')
+                release_search_id(search_id)
                 return
             
             total_found = search_result.get("total_count", 0)
-            search_progress[search_session_id].update({
+            trace.set_funnel('found', total_found)
+            search_progress.update(search_session_id, {
                 'status': 'fetching',
                 'progress': 30,
                 'message': f'找到 {total_found} 篇文章，正在获取详细信息...',
@@ -228,135 +799,295 @@ def execute_search_with_progress(search_session_id, query, user_topic, ai_genera
             })
             app.logger.info(f"Thread {search_session_id}: Updated progress to 'fetching'. Total found: {total_found}")
             
-            # 获取文章详情（带进度回调）
-            articles = fetch_article_details_with_progress( # Call to pubmed_search_core
-                pmids=search_result.get("pmids"),
-                web_env=search_result.get("web_env"),
-                query_key=search_result.get("query_key"),
-                main_journals_only=True,
-                progress_callback=lambda processed, total: update_fetch_progress(
-                    search_session_id, processed, total
-                )
-            )
+            search_params['total_results'] = total_found
+            if search_result.get("web_env") and search_result.get("query_key"):
+                # 之后可以在这个结果集上继续缩小范围
+                search_params['ncbi_history'] = {
+                    'web_env': search_result["web_env"],
+                    'query_key': search_result["query_key"],
+                    'created_at': time.time(),
+                    'query': query,
+                    'journal': journal_filter,
+                    'min_year': min_year,
+                    'max_year': max_year
+                }
+            
+            # 每批文章解析后立即评分、过滤并追加到结果集，第一批到达时结果页即可使用
+            kept_articles = []
+            funnel = {'score_filtered': 0}
+            
+            def publish_batch(batch_articles):
+                raise_if_cancelled(cancel)
+                start = time.perf_counter()
+                scored = assign_scores_by_if(batch_articles) # pubmed_search_core
+                scored_at = time.perf_counter()
+                score_filtered = filter_articles(scored, min_score)
+                type_filtered = filter_articles_by_type(score_filtered, article_types)
+                filtered_at = time.perf_counter()
+                STAGE_SECONDS.observe(scored_at - start, stage='score')
+                STAGE_SECONDS.observe(filtered_at - scored_at, stage='filter')
+                funnel['score_filtered'] += len(score_filtered)
+                trace.annotate_batch(score_seconds=round(scored_at - start, 4),
+                                     filter_seconds=round(filtered_at - scored_at, 4),
+                                     kept=len(type_filtered))
+                if not type_filtered:
+                    return
+                kept_articles.extend(type_filtered)
+                with STAGE_SECONDS.time(stage='result_save'):
+                    available = search_results.append(search_session_id, search_params, type_filtered,
+                                                      search_id=search_id)
+                trace.annotate_batch(save_seconds=round(time.perf_counter() - filtered_at, 4))
+                search_progress.update(search_session_id, {'partial_count': available})
+            
+            fetch_pmids = search_result.get("pmids")
+            articles = []
+            if refinement is not None:
+                # 上次已获取的文章直接复用（重新评分过滤），只获取新出现的PMID
+                previous = refinement['articles']
+                articles = [previous[pmid] for pmid in fetch_pmids if pmid in previous]
+                fetch_pmids = [pmid for pmid in fetch_pmids if pmid not in previous]
+                app.logger.info(f"Thread {search_session_id}: Refinement reuses {len(articles)} articles, fetching {len(fetch_pmids)}.")
+                with trace.span('reuse', reused=len(articles), efetch=len(fetch_pmids)):
+                    trace.add_funnel('fetched', len(articles))
+                    trace.add_funnel('main_journal', len(articles))
+                    if articles:
+                        publish_batch(articles)
+            
+            # 获取文章详情（带进度回调）；各批的评分、过滤和追加结果计入fetch阶段
+            with trace.span('fetch'):
+                if refinement is None or fetch_pmids:
+                    articles += fetch_article_details_with_progress( # Call to pubmed_search_core
+                        pmids=fetch_pmids,
+                        # 缩小范围时只按PMID获取新文章，不能用WebEnv获取整个结果集
+                        web_env=search_result.get("web_env") if refinement is None else None,
+                        query_key=search_result.get("query_key") if refinement is None else None,
+                        main_journals_only=True,
+                        progress_callback=lambda processed, total: update_fetch_progress(
+                            search_session_id, processed, total
+                        ),
+                        batch_callback=publish_batch,
+                        cancel_event=cancel
+                    )
             app.logger.info(f"Thread {search_session_id}: fetch_article_details_with_progress returned. Articles fetched: {len(articles) if articles else 'None'}")
             
             if not articles:
-                search_progress[search_session_id].update({
+                search_progress.update(search_session_id, {
                     'status': 'error',
                     'progress': 0,
                     'message': '未能获取到任何符合条件的文章详细信息'
                 })
                 app.logger.warning(f"Thread {search_session_id}: No article details fetched.")
+                SEARCHES.inc(status='error')
+                release_search_id(search_id)
                 return
             
-            # 更新进度：评分和过滤
-            search_progress[search_session_id].update({
+            # 更新进度：汇总各批结果
+            search_progress.update(search_session_id, {
                 'status': 'processing',
                 'progress': 80,
-                'message': '正在评分和过滤文章...'
+                'message': '正在汇总评分结果...'
             })
             app.logger.info(f"Thread {search_session_id}: Updated progress to 'processing'.")
             
-            # 评分和过滤
-            scored_articles = assign_scores_by_if(articles) # pubmed_search_core
-            app.logger.info(f"Thread {search_session_id}: assign_scores_by_if returned. Scored articles: {len(scored_articles)}")
-            filtered_articles = filter_articles(scored_articles, min_score) # pubmed_search_core
-            app.logger.info(f"Thread {search_session_id}: filter_articles returned. Filtered articles: {len(filtered_articles)}")
-
-            # 按文章类型筛选
-            type_filtered_articles = filter_articles_by_type(filtered_articles, article_types) # pubmed_search_core
-            app.logger.info(f"Thread {search_session_id}: filter_articles_by_type returned. Type filtered articles: {len(type_filtered_articles)}")
-            
-            # 准备搜索参数
-            year_range_str = ""
-            if min_year and max_year:
-                year_range_str = f"{min_year}-{max_year}"
-            elif min_year:
-                year_range_str = f"{min_year}以后"
-            elif max_year:
-                year_range_str = f"{max_year}以前"
-            
-            # 准备文章类型显示字符串
-            article_types_str = ""
-            if 'all' in article_types:
-                article_types_str = "所有类型"
-            else:
-                specific_types = [t for t in article_types if t != 'all']
-                if specific_types:
-                    article_types_str = ', '.join(specific_types)
-                else:
-                    article_types_str = "所有类型"
-
-            search_params = {
-                'user_topic': user_topic,
-                'ai_generated_query': ai_generated_query,
-                'final_query': query,
-                'journal_filter': journal_filter if journal_filter else "所有预定义主刊",
-                'year_range': year_range_str,
-                'min_score': min_score,
-                'article_types': article_types_str,
-                'total_results': total_found
-            }
+            # 各批已分别评分过滤，这里只需整体按分数排序（稳定排序，与一次性评分结果相同）
+            with trace.span('rank'):
+                type_filtered_articles = sorted(kept_articles, key=lambda article: article["score"], reverse=True)
+            trace.set_funnel('score_filtered', funnel['score_filtered'])
+            trace.set_funnel('type_filtered', len(type_filtered_articles))
+            app.logger.info(f"Thread {search_session_id}: Score filtered articles: {funnel['score_filtered']}, type filtered articles: {len(type_filtered_articles)}")
             
-            # 保存到数据库
-            search_id = save_search_to_database(search_params, type_filtered_articles) # pubmed_search_core
-            app.logger.info(f"Thread {search_session_id}: save_search_to_database returned. Search ID: {search_id}")
-
-            # 准备结果数据，但不直接写入session
-            results_data_payload = {
-                'articles': type_filtered_articles,
-                'search_params': search_params,
-                'search_id': search_id
-            }
+            # 结果集已逐批写入，这里标记为完成
+            raise_if_cancelled(cancel)
+            with trace.span('finish'):
+                search_results.finish(search_session_id, search_params, search_id=search_id)
             
-            # 完成 - 将结果数据也放入search_progress
-            search_progress[search_session_id].update({
+            # 完成
+            search_progress.update(search_session_id, {
                 'status': 'completed',
                 'progress': 100,
-                'message': f'搜索完成！找到 {len(filtered_articles)} 篇符合条件的文章',
+                'message': f'搜索完成！找到 {funnel["score_filtered"]} 篇符合条件的文章',
                 'total_found': total_found,
-                'filtered_count': len(filtered_articles),
+                'filtered_count': funnel['score_filtered'],
+                'partial_count': len(type_filtered_articles),
                 'search_id': search_id,
-                'results_data': results_data_payload
+                'persisted': False
             })
+            SEARCHES.inc(status='completed')
             app.logger.info(f"Thread {search_session_id}: Updated progress to 'completed'.")
             
+            # 交给后台写入队列，搜索无需等待数据库写入即可完成
+            trace.stop_profiling()
+            search_write_queue.submit(
+                search_id, search_params, type_filtered_articles,
+                on_done=lambda saved_id, error: mark_search_persisted(search_session_id, saved_id, error),
+                trace=trace
+            )
+            app.logger.info(f"Thread {search_session_id}: Results queued for saving. Search ID: {search_id}")
+            
+            purge_expired_search_state()
+            
+        except SearchCancelled:
+            app.logger.info(f"Thread {search_session_id}: Search cancelled.")
+            discard_search(search_session_id, search_id, {
+                'status': 'cancelled',
+                'progress': 0,
+                'message': '搜索已取消'
+            })
         except Exception as e:
             app.logger.error(f"Thread {search_session_id}: Exception caught in execute_search_with_progress: {str(e)}", exc_info=True)
-            search_progress[search_session_id].update({
+            discard_search(search_session_id, search_id, {
                 'status': 'error',
                 'progress': 0,
                 'message': f'搜索过程中发生错误: {str(e)}' # This message will be shown to the user
             })
+        finally:
+            search_progress.release_cancel_token(search_session_id)
+
+def discard_search(search_session_id, search_id, final_state):
+    """失败或取消的搜索：释放预留的搜索ID、丢弃已追加的部分结果，并写入最终状态"""
+    SEARCHES.inc(status=final_state['status'])
+    if search_id is not None:
+        release_search_id(search_id)
+    search_results.delete(search_session_id)
+    search_progress.update(search_session_id, final_state)
+
+def build_search_params(user_topic, ai_generated_query, query, journal_filter,
+                        min_year, max_year, min_score, article_types):
+    """构建保存到历史记录的搜索参数"""
+    year_range_str = ""
+    if min_year and max_year:
+        year_range_str = f"{min_year}-{max_year}"
+    elif min_year:
+        year_range_str = f"{min_year}以后"
+    elif max_year:
+        year_range_str = f"{max_year}以前"
+    
+    # 准备文章类型显示字符串
+    article_types_str = ""
+    if 'all' in article_types:
+        article_types_str = "所有类型"
+    else:
+        specific_types = [t for t in article_types if t != 'all']
+        if specific_types:
+            article_types_str = ', '.join(specific_types)
+        else:
+            article_types_str = "所有类型"
+
+    return {
+        'user_topic': user_topic,
+        'ai_generated_query': ai_generated_query,
+        'final_query': query,
+        'journal_filter': journal_filter if journal_filter else "所有预定义主刊",
+        'year_range': year_range_str,
+        'min_year': min_year,
+        'max_year': max_year,
+        'min_score': min_score,
+        'article_types': article_types_str,
+        'total_results': 0
+    }
+
+# NCBI只在一段时间内保留history（WebEnv），超过这个时间的结果集不再用于缩小范围
+NCBI_HISTORY_TTL_SECONDS = int(os.environ.get("NCBI_HISTORY_TTL_SECONDS", "3600"))
+
+def _journal_names(journal_filter):
+    return frozenset(name.strip().lower() for name in
+                     (journal_filter or '').replace("、", ",").replace("，", ",").split(",") if name.strip())
+
+def refinement_base(refine_from, query, journal_filter, min_year, max_year):
+    """
+    新的搜索条件只是在refine_from那次搜索的基础上缩小范围时，返回
+    {'history': 上次的NCBI历史, 'filters': 需要追加的过滤条件, 'articles': {pmid: 上次的文章}}，否则返回None
+
+    查询必须相同；期刊只能从不限变为指定（或保持不变）；年份范围只能收窄。
+    最低评分和文章类型在本地过滤，不影响判断：上次被过滤掉的文章不在复用范围内，会重新获取
+    """
+    if not refine_from:
+        return None
+    meta = search_results.get_meta(refine_from)
+    history = meta['search_params'].get('ncbi_history') if meta and meta['complete'] else None
+    if not history or time.time() - history['created_at'] > NCBI_HISTORY_TTL_SECONDS:
+        return None
+    if ' '.join(query.split()) != ' '.join(history['query'].split()):
+        return None
+    old_journals, new_journals = _journal_names(history['journal']), _journal_names(journal_filter)
+    if old_journals and old_journals != new_journals:
+        return None
+    old_min, old_max = year_or_none(history['min_year']), year_or_none(history['max_year'])
+    new_min, new_max = year_or_none(min_year), year_or_none(max_year)
+    if old_min is not None and (new_min is None or new_min < old_min):
+        return None
+    if old_max is not None and (new_max is None or new_max > old_max):
+        return None
+    return {
+        'history': history,
+        'filters': {
+            'journal': journal_filter if new_journals and not old_journals else None,
+            'min_year': new_min if new_min != old_min else None,
+            'max_year': new_max if new_max != old_max else None
+        },
+        'articles': {article['pmid']: article for article in search_results.iter_articles(refine_from)}
+    }
+
+def mark_search_persisted(search_session_id, search_id, error):
+    """写入队列完成后的回调；写入最终失败时删除预留的pending记录，搜索历史中不会留下未完成的搜索"""
+    if error is None:
+        search_progress.update(search_session_id, {'persisted': True})
+        return
+    app.logger.error(f"Thread {search_session_id}: Saving results failed: {error}")
+    release_search_id(search_id)
+    search_progress.update(search_session_id, {
+        'persisted': False,
+        'search_id': None,
+        'persist_error': f'结果未能保存到搜索历史: {error}'
+    })
 
 def update_fetch_progress(search_session_id, processed, total):
     """更新获取文章的进度"""
-    if search_session_id in search_progress:
-        progress = 30 + int((processed / total) * 40)  # 30-70%
-        search_progress[search_session_id].update({
-            'progress': progress,
-            'message': f'正在获取文章详情... ({processed}/{total})',
-            'processed_articles': processed
+    progress = 30 + int((processed / total) * 40)  # 30-70%
+    search_progress.update(search_session_id, {
+        'progress': progress,
+        'message': f'正在获取文章详情... ({processed}/{total})',
+        'processed_articles': processed
+    })
+
+CANCEL_ON_LEAVE_GRACE_SECONDS = 10   # 离开进度页后延迟取消，期间页面重新连接（如刷新）则撤销
+
+@app.route('/api/search/<search_session_id>/cancel', methods=['POST'])
+def api_cancel_search(search_session_id):
+    """
+    取消搜索：排队中的任务直接移出队列，执行中的任务在下一个检查点停止
+    
+    on_leave=1（进度页pagehide时由sendBeacon发送）为延迟取消，
+    CANCEL_ON_LEAVE_GRACE_SECONDS内仍有页面读取进度则不取消
+    """
+    state = search_progress.get(search_session_id)
+    if state is None:
+        return jsonify({'success': False, 'error': '搜索会话不存在'}), 404
+    if state.get('status') in TERMINAL_STATUSES:
+        return jsonify({'success': False, 'error': '搜索已结束', 'status': state['status']}), 409
+    
+    if request.args.get('on_leave') == '1':
+        search_progress.request_cancel(search_session_id, delay=CANCEL_ON_LEAVE_GRACE_SECONDS)
+        return jsonify({'success': True, 'status': 'cancelling'})
+    
+    search_progress.request_cancel(search_session_id)
+    # 还在本worker队列中的任务不会再开始，直接标记为已取消
+    if search_executor.cancel(search_session_id):
+        SEARCHES.inc(status='cancelled')
+        search_progress.update(search_session_id, {
+            'status': 'cancelled',
+            'progress': 0,
+            'message': '搜索已取消'
         })
+        return jsonify({'success': True, 'status': 'cancelled'})
+    return jsonify({'success': True, 'status': 'cancelling'})
 
 @app.route('/api/search_progress/<search_session_id>')
 def api_search_progress(search_session_id):
     """获取搜索进度API"""
-    if search_session_id in search_progress:
-        current_progress_data = search_progress[search_session_id]
-        
-        # 如果搜索完成且结果尚未移至session，则处理结果数据
-        if current_progress_data.get('status') == 'completed' and \
-           f'search_results_{search_session_id}' not in session and \
-           'results_data' in current_progress_data:
-            
-            session[f'search_results_{search_session_id}'] = current_progress_data['results_data']
-            # 从search_progress中移除已处理的results_data以节省内存，
-            # 注意：如果其他地方可能还需要它，或者前端可能基于此进行多次操作，则不应删除或应复制。
-            # 为简单起见，这里我们选择不立即删除，以防万一。
-            # 如果内存占用成为问题，可以考虑更复杂的清理策略。
-            # 例如: del current_progress_data['results_data']
-
+    current_progress_data = search_progress.get(search_session_id)
+    search_progress.clear_deferred_cancel(search_session_id, current_progress_data)
+    if current_progress_data is not None:
         return jsonify({
             'success': True,
             'progress': current_progress_data
@@ -367,6 +1098,76 @@ def api_search_progress(search_session_id):
             'error': '搜索会话不存在'
         })
 
+SSE_HEARTBEAT_SECONDS = 15      # 无变化时发送注释行保持连接
+SSE_MAX_STREAM_SECONDS = 600    # 单个连接的最长时间，之后由浏览器自动重连
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+# 每个进程同时保持的长连接（SSE进度、NDJSON结果流、AI查询流）上限：gthread下每个长连接占用一个线程，
+# 上限要小于--threads，给普通请求留出线程；名额用完时客户端改用轮询接口
+STREAM_MAX_CONCURRENT = int(os.environ.get("STREAM_MAX_CONCURRENT", "8"))
+_stream_slots = threading.BoundedSemaphore(max(1, STREAM_MAX_CONCURRENT))
+
+def _acquire_stream_slot():
+    """占用一个长连接名额（不等待），名额用完时返回False"""
+    return _stream_slots.acquire(blocking=False)
+
+def _stream_response(generate, mimetype):
+    """长连接响应；连接关闭时（包括客户端中途断开）释放_acquire_stream_slot占用的名额"""
+    response = Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(_stream_slots.release)
+    return response
+
+def _streams_busy_response(poll_url):
+    """长连接名额用完：返回503，客户端改用poll_url轮询"""
+    response = jsonify({'success': False, 'error': '服务器繁忙，请改用轮询接口', 'poll_url': poll_url})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(SSE_HEARTBEAT_SECONDS)
+    return response
+
+def _sse_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/search_progress/<search_session_id>/stream')
+def api_search_progress_stream(search_session_id):
+    """搜索进度SSE：仅在任务状态变化时推送，任务结束后关闭连接"""
+    # 浏览器重连时带上最后收到的version，避免重复推送
+    try:
+        last_version = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        last_version = -1
+
+    # 名额用完时EventSource收到503后关闭，页面改为轮询/api/search_progress
+    if not _acquire_stream_slot():
+        return _streams_busy_response(url_for('api_search_progress', search_session_id=search_session_id))
+
+    def generate():
+        version = last_version
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        yield 'retry: 2000\n\n'
+        while time.monotonic() < deadline:
+            state = search_progress.wait_for_change(search_session_id, version, SSE_HEARTBEAT_SECONDS)
+            if state is None:
+                yield _sse_event('missing', {'success': False, 'error': '搜索会话不存在'})
+                return
+            if state['version'] <= version:
+                yield ': keep-alive\n\n'
+                continue
+            version = state['version']
+            search_progress.clear_deferred_cancel(search_session_id, state)
+            yield _sse_event('progress', state, event_id=version)
+            if state.get('status') in TERMINAL_STATUSES:
+                yield _sse_event('done', {'status': state['status']}, event_id=version)
+                return
+
+    return _stream_response(generate, 'text/event-stream')
+
 @app.route('/search_progress/<search_session_id>')
 def search_progress_page(search_session_id):
     """搜索进度页面"""
@@ -375,165 +1176,139 @@ def search_progress_page(search_session_id):
 @app.route('/results/<search_session_id>')
 def results_page(search_session_id):
     """结果页面"""
-    search_data = session.get(f'search_results_{search_session_id}')
+    meta = search_results.get_meta(search_session_id)
     
-    if not search_data:
+    if not meta:
         return redirect(url_for('search_page'))
     
-    articles = search_data['articles']
-    search_params = search_data['search_params']
-    
-    # 分页参数
-    page = int(request.args.get('page', 1))
+    # 分页参数：只读取当前页的文章
+    page = max(1, int(request.args.get('page', 1)))
     per_page = 20
-    total_pages = (len(articles) + per_page - 1) // per_page
-    
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    page_articles = articles[start_idx:end_idx]
+    total_articles = meta['total']
+    total_pages = (total_articles + per_page - 1) // per_page
+    page_articles = search_results.get_ranked_articles(search_session_id, (page - 1) * per_page, per_page)
     
     return render_template('results.html',
                          articles=page_articles,
-                         search_params=search_params,
+                         search_params=meta['search_params'],
                          current_page=page,
                          total_pages=total_pages,
-                         total_articles=len(articles),
-                         search_session_id=search_session_id)
+                         total_articles=total_articles,
+                         search_session_id=search_session_id,
+                         partial=not meta['complete'])
+
+def wants_gzip():
+    return request.args.get('gzip') == '1' and 'gzip' in request.headers.get('Accept-Encoding', '')
+
+def export_response(format, open_articles, search_params, total, basename, validators=None):
+    """以分块响应流式返回导出文件；请求带gzip=1且客户端接受gzip时压缩传输"""
+    export_format = EXPORT_FORMATS.get(format)
+    if export_format is None:
+        return jsonify({'success': False, 'error': '不支持的导出格式'}), 400
+    
+    use_gzip = wants_gzip()
+    filename = f"{basename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format.extension}"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    
+    chunks = export_chunks(format, open_articles, search_params, total, gzip=use_gzip)
+    return with_validators(Response(stream_with_context(chunks),
+                                    mimetype=export_format.mimetype, headers=headers), validators)
 
 @app.route('/api/export/<search_session_id>/<format>')
 def api_export(search_session_id, format):
-    """导出结果API"""
-    try:
-        search_data = session.get(f'search_results_{search_session_id}')
-        
-        if not search_data:
-            return jsonify({'success': False, 'error': '搜索结果不存在'})
-        
-        articles = search_data['articles']
-        search_params = search_data['search_params']
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        if format == 'json':
-            filename = f"pubmed_search_{timestamp}.json"
-            export_data = {
-                "search_parameters": search_params,
-                "articles": articles
-            }
-            
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'data': export_data
-            })
-        
-        elif format == 'markdown':
-            md_content = generate_markdown_content(articles, search_params)
-            
-            return jsonify({
-                'success': True,
-                'filename': f"pubmed_search_{timestamp}.md",
-                'content': md_content
-            })
-        
-        else:
-            return jsonify({'success': False, 'error': '不支持的导出格式'})
+    """导出结果API（流式下载）"""
+    meta = search_results.get_meta(search_session_id)
+    if not meta:
+        return jsonify({'success': False, 'error': '搜索结果不存在'}), 404
     
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-@app.route('/api/export_history/<int:search_id>/<format>')
-def api_export_history(search_id, format):
-    """导出历史搜索结果API"""
-    try:
-        search_data = get_search_by_id(search_id)
-        
-        if not search_data:
-            return jsonify({'success': False, 'error': '搜索结果不存在'})
-        
-        articles = search_data['articles']
-        search_info = search_data['search_info']
-        
-        search_params = {
-            'user_topic': search_info[2],
-            'final_query': search_info[4],
-            'journal_filter': search_info[5],
-            'year_range': search_info[6]
-        }
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        if format == 'json':
-            filename = f"pubmed_history_{search_id}_{timestamp}.json"
-            export_data = {
-                "search_parameters": search_params,
-                "articles": articles
-            }
-            
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'data': export_data
-            })
-        
-        elif format == 'markdown':
-            md_content = generate_markdown_content(articles, search_params)
-            
-            return jsonify({
-                'success': True,
-                'filename': f"pubmed_history_{search_id}_{timestamp}.md",
-                'content': md_content
-            })
-        
-        else:
-            return jsonify({'success': False, 'error': '不支持的导出格式'})
+    # 完成的结果集不再变化；搜索仍在追加批次时不发送校验信息，避免客户端一直使用不完整的文件
+    validators = None
+    if meta['complete']:
+        created_at = datetime.fromtimestamp(int(meta['created_at']), timezone.utc)
+        validators = (f"{search_session_id}-{int(meta['created_at'])}-{meta['total']}-{BUILD_ID}"
+                      f"{'-gz' if wants_gzip() else ''}", created_at)
+        if is_not_modified(validators):
+            return not_modified_response(validators)
     
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+    return export_response(format, lambda: search_results.iter_articles(search_session_id),
+                           meta['search_params'], meta['total'], 'pubmed_search', validators)
 
-def generate_markdown_content(articles, search_params):
-    """生成Markdown内容"""
-    content = f"""# PubMed搜索结果
-
-**搜索关键词**: `{search_params.get('final_query', '')}`  
-**期刊过滤**: {search_params.get('journal_filter', '')}  
-**年份范围**: {search_params.get('year_range', '')}  
-**搜索日期**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  
-**结果数量**: {len(articles)}篇文章  
+def _export_params(search_info):
+    """导出文件中记录的搜索参数（来自search_history行）"""
+    return {
+        'user_topic': search_info[2],
+        'final_query': search_info[4],
+        'journal_filter': search_info[5],
+        'year_range': search_info[6]
+    }
 
-## 目录
+BULK_EXPORT_MAX_SEARCHES = 100
 
-"""
+@app.route('/api/export_history/bulk/<format>')
+def api_export_history_bulk(format):
+    """批量导出历史搜索：?ids=1,2,3，流式返回zip（每次搜索一个文件 + 按PMID去重的合并文件）"""
+    if format not in BULK_FORMATS:
+        return jsonify({'success': False, 'error': f'批量导出支持的格式: {", ".join(BULK_FORMATS)}'}), 400
+    try:
+        search_ids = sorted({int(value) for value in request.args.get('ids', '').split(',') if value.strip()})
+    except ValueError:
+        return jsonify({'success': False, 'error': '搜索ID格式错误'}), 400
+    if not search_ids:
+        return jsonify({'success': False, 'error': '请提供要导出的搜索ID'}), 400
+    if len(search_ids) > BULK_EXPORT_MAX_SEARCHES:
+        return jsonify({'success': False, 'error': f'一次最多导出 {BULK_EXPORT_MAX_SEARCHES} 次搜索'}), 400
     
-    for i, article in enumerate(articles, 1):
-        content += f"{i}. [{article['title']}](#article-{i})  \n"
+    validators = history_validators(search_ids)
+    if is_not_modified(validators):
+        return not_modified_response(validators)
     
-    content += "\n---\n\n## 文章详情\n\n"
+    search_infos = get_search_infos(search_ids)
+    if not search_infos:
+        return jsonify({'success': False, 'error': '搜索结果不存在'}), 404
     
-    for i, article in enumerate(articles, 1):
-        content += f"""### {i}. {article['title']} {{#article-{i}}}
-
-| 项目 | 内容 |
-| --- | --- |
-| 期刊 | {article['journal']} |
-| 影响因子 | {article.get('impact_factor', 'N/A')} |
-| 年份 | {article['year']} |
-| 评分 | {article.get('score', 'N/A')} |
-
-**作者**: {', '.join(article['authors'])}
-
-**摘要**:  
-{article['abstract']}
+    def searches():
+        # 一次游标遍历所有搜索的文章，按搜索ID分组依次写入zip；没有文章的搜索也写出一个空文件
+        groups = groupby(iter_articles_for_searches(sorted(search_infos)), key=lambda row: row[0])
+        group_id, group = next(groups, (None, None))
+        for search_id in sorted(search_infos):
+            search_info = search_infos[search_id]
+            has_rows = search_id == group_id
+            articles = (article for _, article in group) if has_rows else iter(())
+            yield (f'search_{search_id}', _export_params(search_info), search_info[10] or 0, articles)
+            if has_rows:
+                group_id, group = next(groups, (None, None))
+    
+    missing = [f'search_{search_id}' for search_id in search_ids if search_id not in search_infos]
+    filename = f"pubmed_history_bulk_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    response = Response(stream_with_context(zip_export_chunks(format, searches(), missing=missing)),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    return with_validators(response, validators)
 
-**链接**:  
-- PubMed: [{article['pmid']}]({article['pubmed_url']})  
-"""
-        if article.get('doi'):
-            content += f"- DOI: [{article['doi']}](https://doi.org/{article['doi']})  \n"
-        
-        content += "\n---\n\n"
+@app.route('/api/export_history/<int:search_id>/<format>')
+def api_export_history(search_id, format):
+    """导出历史搜索结果API（流式下载，按游标逐批读取文章）"""
+    validators = history_validators([search_id], '-gz' if wants_gzip() else '')
+    if is_not_modified(validators):
+        return not_modified_response(validators)
+    
+    search_info = get_search_info(search_id)
+    if not search_info:
+        return jsonify({'success': False, 'error': '搜索结果不存在'}), 404
+    
+    search_params = _export_params(search_info)
+    
+    # RIS/BibTeX/CSL-JSON直接读取数据库行，不构建文章dict
+    if format in EXPORT_FORMATS and EXPORT_FORMATS[format].reads_rows:
+        open_articles = lambda: iter_search_article_rows(search_id)
+    else:
+        open_articles = lambda: iter_search_articles(search_id)
     
-    return content
+    return export_response(format, open_articles, search_params,
+                           search_info[10] or 0, f'pubmed_history_{search_id}', validators)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,72 @@
+# coalescing_cache.py
+# 带过期时间的进程内结果缓存，同一个键的并发请求只计算一次（其余请求等待同一个结果）
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    from .metrics import CACHE_REQUESTS
+except ImportError:
+    from metrics import CACHE_REQUESTS
+
+
+class CoalescingCache:
+    """
+    TTL + LRU缓存，未命中时合并并发的相同请求
+
+    计算出错时异常传给所有等待者，结果不缓存。命中情况计入pubmed_cache_requests_total{cache=name}，
+    result为hit / miss / coalesced（等待了其他请求正在进行的计算）。
+    """
+
+    def __init__(self, name, ttl_seconds, max_entries=1000):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # key -> (过期时间, value)
+        self._inflight = {}              # key -> Future
+
+    def peek(self, key):
+        """未过期的缓存值，没有时返回None（不计算、不计入命中统计）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns:
+            (value, cached): cached为True表示结果来自缓存或其他请求的计算
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                CACHE_REQUESTS.inc(cache=self.name, result='hit')
+                return entry[1], True
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            CACHE_REQUESTS.inc(cache=self.name, result='coalesced')
+            return future.result(), True
+
+        CACHE_REQUESTS.inc(cache=self.name, result='miss')
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(value)
+        return value, False
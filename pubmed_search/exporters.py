@@ -0,0 +1,405 @@
+# exporters.py
+# 流式导出：各格式的写出函数都是生成器，逐篇文章产出文本，不在内存中拼接整个文件
+
+import csv
+import io
+import json
+import re
+import tempfile
+import zipfile
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    from .text_codec import decode_authors, decompress_text
+except ImportError:
+    from text_codec import decode_authors, decompress_text
+
+EXPORT_CHUNK_SIZE = 64 * 1024   # 合并成约64KB再发送，避免每篇文章一个chunk
+ZIP_SPOOL_MAX_SIZE = 1024 * 1024    # 批量导出合并文件的内存缓冲上限，超过后落盘（每个并发导出各占一份）
+
+# reads_rows: 写出函数可以直接处理articles表的sqlite3.Row（按列名取值、列值可能仍是压缩的）
+ExportFormat = namedtuple('ExportFormat', ['writer', 'mimetype', 'extension', 'reads_rows'], defaults=[False])
+
+CSV_COLUMNS = [
+    'pmid', 'title', 'journal', 'journal_abbr', 'year', 'volume', 'issue', 'pages', 'doi',
+    'authors', 'article_types', 'keywords', 'impact_factor', 'score', 'pubmed_url', 'abstract'
+]
+
+
+def write_json(open_articles, search_params, total):
+    """{"search_parameters": ..., "articles": [...]}，与原JSON导出结构相同"""
+    yield '{"search_parameters": '
+    yield json.dumps(search_params, ensure_ascii=False)
+    yield ', "articles": ['
+    for i, article in enumerate(open_articles()):
+        yield ('\n' if i == 0 else ',\n') + json.dumps(article, ensure_ascii=False)
+    yield '\n]}\n'
+
+
+def write_ndjson(open_articles, search_params, total):
+    """每行一篇文章"""
+    for article in open_articles():
+        yield json.dumps(article, ensure_ascii=False) + '\n'
+
+
+def write_markdown(open_articles, search_params, total):
+    """Markdown：先遍历一次写目录，再遍历一次写详情"""
+    yield f"""# PubMed搜索结果
+
+**搜索关键词**: `{search_params.get('final_query', '')}`  
+**期刊过滤**: {search_params.get('journal_filter', '')}  
+**年份范围**: {search_params.get('year_range', '')}  
+**搜索日期**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  
+**结果数量**: {total}篇文章  
+
+## 目录
+
+"""
+    for i, article in enumerate(open_articles(), 1):
+        yield f"{i}. [{article['title']}](#article-{i})  \n"
+
+    yield "\n---\n\n## 文章详情\n\n"
+
+    for i, article in enumerate(open_articles(), 1):
+        block = f"""### {i}. {article['title']} {{#article-{i}}}
+
+| 项目 | 内容 |
+| --- | --- |
+| 期刊 | {article['journal']} |
+| 影响因子 | {article.get('impact_factor', 'N/A')} |
+| 年份 | {article['year']} |
+| 评分 | {article.get('score', 'N/A')} |
+
+**作者**: {', '.join(article['authors'])}
+
+**摘要**:  
+{article['abstract']}
+
+**链接**:  
+- PubMed: [{article['pmid']}]({article['pubmed_url']})  
+"""
+        if article.get('doi'):
+            block += f"- DOI: [{article['doi']}](https://doi.org/{article['doi']})  \n"
+        yield block + "\n---\n\n"
+
+
+def write_csv(open_articles, search_params, total):
+    """CSV（带BOM，Excel可直接打开中文），列表字段用"; "连接"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    buffer.write('\ufeff')
+    writer.writerow(CSV_COLUMNS)
+    yield take()
+    for article in open_articles():
+        row = []
+        for column in CSV_COLUMNS:
+            value = article.get(column)
+            if isinstance(value, list):
+                value = '; '.join(str(item) for item in value)
+            row.append('' if value is None else value)
+        writer.writerow(row)
+        yield take()
+
+
+# ---- 文献管理软件格式 ----
+# 记录可以是文章dict，也可以是articles表的sqlite3.Row；
+# Row中的作者、摘要可能是压缩值，关键词是JSON文本，读取时按需解码
+
+def _field(record, key):
+    try:
+        value = record[key]
+    except (KeyError, IndexError):
+        return None
+    return value if value not in ('', None) else None
+
+
+def _authors(record):
+    value = _field(record, 'authors')
+    return decode_authors(value) if value else []
+
+
+def _abstract(record):
+    value = decompress_text(_field(record, 'abstract'))
+    return None if value in (None, '', '无摘要') else value
+
+
+def _keywords(record):
+    value = _field(record, 'keywords')
+    if isinstance(value, str):
+        value = json.loads(value)
+    return value or []
+
+
+def _split_name(name):
+    """PubMed作者名为"ForeName LastName"，拆成(姓, 名)；单个词（团体作者）只有姓"""
+    parts = name.rsplit(' ', 1)
+    if len(parts) == 1:
+        return parts[0], ''
+    return parts[1], parts[0]
+
+
+def _page_range(pages):
+    """"123-30" -> ("123", "30")"""
+    if not pages:
+        return None, None
+    start, _, end = str(pages).partition('-')
+    return start.strip() or None, end.strip() or None
+
+
+def write_ris(open_articles, search_params, total):
+    """RIS（EndNote、Zotero、Mendeley均可导入）"""
+    for record in open_articles():
+        lines = ['TY  - JOUR']
+
+        def tag(name, value):
+            if value not in (None, ''):
+                lines.append(f"{name}  - {str(value).replace(chr(10), ' ')}")
+
+        tag('TI', _field(record, 'title'))
+        for author in _authors(record):
+            family, given = _split_name(author)
+            tag('AU', f"{family}, {given}" if given else family)
+        tag('T2', _field(record, 'journal'))
+        tag('J2', _field(record, 'journal_abbr'))
+        tag('PY', _field(record, 'year'))
+        tag('VL', _field(record, 'volume'))
+        tag('IS', _field(record, 'issue'))
+        start_page, end_page = _page_range(_field(record, 'pages'))
+        tag('SP', start_page)
+        tag('EP', end_page)
+        tag('DO', _field(record, 'doi'))
+        tag('AN', _field(record, 'pmid'))
+        tag('UR', _field(record, 'pubmed_url'))
+        for keyword in _keywords(record):
+            tag('KW', keyword)
+        tag('AB', _abstract(record))
+        lines.append('ER  - ')
+        yield '\r\n'.join(lines) + '\r\n\r\n'
+
+
+_BIBTEX_SPECIAL = re.compile(r'([{}&%$#_\\])')
+
+
+def _bibtex_escape(value):
+    return _BIBTEX_SPECIAL.sub(lambda m: '\\textbackslash{}' if m.group(1) == '\\' else '\\' + m.group(1),
+                               str(value))
+
+
+def write_bibtex(open_articles, search_params, total):
+    """BibTeX，引用键为 pmid<PMID>"""
+    for record in open_articles():
+        pmid = _field(record, 'pmid')
+        start_page, end_page = _page_range(_field(record, 'pages'))
+        fields = [
+            ('title', _field(record, 'title')),
+            ('author', ' and '.join(_authors(record)) or None),
+            ('journal', _field(record, 'journal')),
+            ('year', _field(record, 'year')),
+            ('volume', _field(record, 'volume')),
+            ('number', _field(record, 'issue')),
+            ('pages', f"{start_page}--{end_page}" if end_page else start_page),
+            ('doi', _field(record, 'doi')),
+            ('pmid', pmid),
+            ('url', _field(record, 'pubmed_url')),
+            ('keywords', ', '.join(_keywords(record)) or None),
+            ('abstract', _abstract(record)),
+        ]
+        body = ',\n'.join(
+            # 标题多加一层括号，保留原有大小写
+            f"  {name} = {{{{{_bibtex_escape(value)}}}}}" if name == 'title' else f"  {name} = {{{_bibtex_escape(value)}}}"
+            for name, value in fields if value not in (None, '')
+        )
+        yield f"@article{{pmid{pmid},\n{body}\n}}\n\n"
+
+
+def write_csl_json(open_articles, search_params, total):
+    """CSL-JSON数组（Zotero、Pandoc等使用）"""
+    yield '['
+    for i, record in enumerate(open_articles()):
+        item = {'id': f"pmid:{_field(record, 'pmid')}", 'type': 'article-journal'}
+        authors = []
+        for author in _authors(record):
+            family, given = _split_name(author)
+            authors.append({'family': family, 'given': given} if given else {'literal': family})
+        year = _field(record, 'year')
+        for key, value in (
+            ('title', _field(record, 'title')),
+            ('author', authors),
+            ('container-title', _field(record, 'journal')),
+            ('container-title-short', _field(record, 'journal_abbr')),
+            ('issued', {'date-parts': [[int(year)]]} if year and str(year).isdigit() else None),
+            ('volume', _field(record, 'volume')),
+            ('issue', _field(record, 'issue')),
+            ('page', _field(record, 'pages')),
+            ('DOI', _field(record, 'doi')),
+            ('PMID', _field(record, 'pmid')),
+            ('URL', _field(record, 'pubmed_url')),
+            ('keyword', ', '.join(_keywords(record)) or None),
+            ('abstract', _abstract(record)),
+        ):
+            if value:
+                item[key] = value
+        yield ('\n' if i == 0 else ',\n') + json.dumps(item, ensure_ascii=False)
+    yield '\n]\n'
+
+
+EXPORT_FORMATS = {
+    'json': ExportFormat(write_json, 'application/json', 'json'),
+    'ndjson': ExportFormat(write_ndjson, 'application/x-ndjson', 'ndjson'),
+    'markdown': ExportFormat(write_markdown, 'text/markdown', 'md'),
+    'csv': ExportFormat(write_csv, 'text/csv', 'csv'),
+    'ris': ExportFormat(write_ris, 'application/x-research-info-systems', 'ris', True),
+    'bibtex': ExportFormat(write_bibtex, 'application/x-bibtex', 'bib', True),
+    'csl': ExportFormat(write_csl_json, 'application/vnd.citationstyles.csl+json', 'csl.json', True),
+}
+
+
+def write_export_file(format, articles, filename, search_params=None):
+    """把文章列表按格式写入文件（命令行保存使用）"""
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        for piece in EXPORT_FORMATS[format].writer(lambda: iter(articles), search_params or {}, len(articles)):
+            f.write(piece)
+
+
+def encode_chunks(pieces, chunk_size=EXPORT_CHUNK_SIZE):
+    """把文本片段编码为UTF-8并合并成约chunk_size的块；第一个片段立即发出"""
+    buffer = []
+    size = 0
+    first = True
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        if first:
+            first = False
+            yield data
+            continue
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """逐块gzip压缩；第一块同步刷新，保证首字节不被压缩缓冲延迟"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if first:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(format, open_articles, search_params, total, gzip=False):
+    """
+    生成导出文件的字节块
+
+    Args:
+        format: EXPORT_FORMATS中的格式名
+        open_articles: 无参函数，每次调用返回一个新的文章迭代器（Markdown需要遍历两次）
+        total: 文章总数
+        gzip: 是否gzip压缩
+    """
+    chunks = encode_chunks(EXPORT_FORMATS[format].writer(open_articles, search_params, total))
+    return gzip_chunks(chunks) if gzip else chunks
+
+
+
+# 批量导出只支持遍历一次文章即可写出的格式（Markdown需要先写目录）
+BULK_FORMATS = ('json', 'ndjson', 'csv', 'ris', 'bibtex', 'csl')
+
+
+class _ZipSink(io.RawIOBase):
+    """ZipFile的输出目标：不可seek，写入的字节累积起来由生成器取走"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def zip_export_chunks(format, searches, merged_name='merged_dedup', missing=()):
+    """
+    流式生成zip：每次搜索一个文件，附加按PMID去重的合并文件和manifest.json
+
+    Args:
+        format: BULK_FORMATS中的格式名
+        searches: 按顺序产出 (文件名主干, search_params, 文章数, 文章迭代器) 的迭代器，逐个消费；
+                  没有文章的搜索也应产出（空迭代器），写出只有表头的文件
+        merged_name: 合并文件的文件名主干
+        missing: 请求了但不存在的搜索，记入manifest.json
+
+    合并文件的内容在遍历各次搜索时写入临时文件（超过ZIP_SPOOL_MAX_SIZE落盘），不在内存中累积
+    """
+    export_format = EXPORT_FORMATS[format]
+    sink = _ZipSink()
+    seen_pmids = set()
+    merged_from = []
+    merged_count = 0
+    manifest = {'format': format, 'exported_at': datetime.now().isoformat(timespec='seconds'),
+                'files': [], 'missing': list(missing)}
+
+    def write_entry(archive, name, pieces):
+        with archive.open(name, 'w', force_zip64=True) as entry:
+            for piece in pieces:
+                entry.write(piece.encode('utf-8'))
+                if sink.size >= EXPORT_CHUNK_SIZE:
+                    yield sink.drain()
+
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE) as spool:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for stem, search_params, total, articles in searches:
+                merged_from.append(stem)
+                entry = {'file': f"{stem}.{export_format.extension}", 'articles': 0}
+                manifest['files'].append(entry)
+
+                def spool_new(articles=articles, entry=entry):
+                    nonlocal merged_count
+                    for article in articles:
+                        entry['articles'] += 1
+                        if article['pmid'] not in seen_pmids:
+                            seen_pmids.add(article['pmid'])
+                            spool.write(json.dumps(article, ensure_ascii=False).encode('utf-8') + b'\n')
+                            merged_count += 1
+                        yield article
+
+                pieces = export_format.writer(lambda: spool_new(), search_params, total)
+                yield from write_entry(archive, entry['file'], pieces)
+
+            spool.seek(0)
+            merged_params = {'merged_from': merged_from, 'deduplicated_by': 'pmid'}
+            pieces = export_format.writer(lambda: (json.loads(line) for line in spool), merged_params, merged_count)
+            yield from write_entry(archive, f"{merged_name}.{export_format.extension}", pieces)
+            manifest['merged'] = {'file': f"{merged_name}.{export_format.extension}", 'articles': merged_count}
+            yield from write_entry(archive, 'manifest.json',
+                                   [json.dumps(manifest, ensure_ascii=False, indent=2)])
+        # 关闭ZipFile时写入中央目录
+        yield sink.drain()
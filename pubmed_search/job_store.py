@@ -0,0 +1,232 @@
+# job_store.py
+# 搜索任务状态存储：进度保存在SQLite中，所有gunicorn worker都能读取
+
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+
+try:
+    from .pubmed_search_core import DATABASE_PATH
+except ImportError:
+    from pubmed_search_core import DATABASE_PATH
+
+# 任务状态单独放一个数据库文件，频繁的进度更新不会和历史记录写入争锁
+JOB_STATE_DB_PATH = os.environ.get(
+    "JOB_STATE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), "pubmed_search_jobs.db")
+)
+CANCEL_POLL_SECONDS = 1.0   # 执行中的任务检查其他进程发出的取消请求的间隔
+
+
+class SQLiteStore(ABC):
+    """每个线程一个自动提交连接的SQLite存储，首次使用时由子类的_init_schema建表"""
+
+    def __init__(self, path=JOB_STATE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._init_schema(conn)
+                    self._initialized = True
+        return conn
+
+    @abstractmethod
+    def _init_schema(self, conn):
+        """在conn上建表/建索引（每个实例只调用一次，需可重复执行：CREATE ... IF NOT EXISTS）"""
+
+
+class CancelToken:
+    """
+    搜索任务的取消标志，接口与threading.Event的is_set/wait相同
+
+    本进程发出的取消立即生效；其他worker进程写入任务状态的取消请求（cancel_at）
+    最多CANCEL_POLL_SECONDS后被发现。任务状态被删除也视为取消。
+    """
+
+    def __init__(self, store, session_id, poll_interval=CANCEL_POLL_SECONDS):
+        self.store = store
+        self.session_id = session_id
+        self.poll_interval = poll_interval
+        self._event = threading.Event()
+        self._last_poll = 0.0
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        if self._event.is_set():
+            return True
+        now = time.monotonic()
+        if now - self._last_poll >= self.poll_interval:
+            self._last_poll = now
+            state = self.store.get(self.session_id)
+            cancel_at = state.get('cancel_at') if state is not None else None
+            if state is None or (cancel_at is not None and cancel_at <= time.time()):
+                self._event.set()
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """等待最多timeout秒，期间被取消时提前返回True"""
+        deadline = time.monotonic() + timeout
+        while not self.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._event.wait(min(remaining, self.poll_interval))
+        return True
+
+
+class JobStore(SQLiteStore):
+    """
+    跨进程共享的搜索任务状态
+
+    进度以JSON保存在search_jobs表中，每次更新version加一。
+    """
+
+    def __init__(self, path=JOB_STATE_DB_PATH):
+        super().__init__(path)
+        # 本进程内的更新会立即唤醒等待者，其他进程的更新靠短间隔轮询发现
+        self._changed = threading.Condition()
+        self._generation = 0
+        self._cancel_tokens = {}    # 本进程中执行中任务的取消标志
+
+    def _init_schema(self, conn):
+        # WAL模式下进度轮询（读）不会阻塞搜索线程的写
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS search_jobs (
+                session_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def create(self, session_id, state):
+        """创建任务状态"""
+        now = time.time()
+        self._connect().execute(
+            'INSERT OR REPLACE INTO search_jobs (session_id, state, version, created_at, updated_at) '
+            'VALUES (?, ?, 0, ?, ?)',
+            (session_id, json.dumps(state, ensure_ascii=False), now, now)
+        )
+        self._notify()
+
+    def update(self, session_id, fields):
+        """合并更新任务状态的部分字段（单条语句完成，多进程并发更新不会丢字段）"""
+        self._connect().execute(
+            'UPDATE search_jobs SET state = json_patch(state, ?), version = version + 1, updated_at = ? '
+            'WHERE session_id = ?',
+            (json.dumps(fields, ensure_ascii=False), time.time(), session_id)
+        )
+        self._notify()
+
+    def update_if_status(self, session_id, status, fields):
+        """
+        仅当任务当前状态仍为status时合并更新（条件与更新在同一条语句中），返回是否更新
+
+        用于可能过时的更新，例如在锁外发布的排队位置不能覆盖已开始执行或已取消的任务
+        """
+        cursor = self._connect().execute(
+            'UPDATE search_jobs SET state = json_patch(state, ?), version = version + 1, updated_at = ? '
+            "WHERE session_id = ? AND json_extract(state, '$.status') = ?",
+            (json.dumps(fields, ensure_ascii=False), time.time(), session_id, status)
+        )
+        if cursor.rowcount:
+            self._notify()
+        return cursor.rowcount > 0
+
+    def get(self, session_id):
+        """返回任务状态dict，不存在时返回None"""
+        row = self._connect().execute(
+            'SELECT state, version FROM search_jobs WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        state['version'] = row[1]
+        return state
+
+    def wait_for_change(self, session_id, version, timeout, poll_interval=0.5):
+        """
+        等待任务状态的version超过给定值
+
+        Returns:
+            最新的任务状态（超时时version可能未变），任务不存在时返回None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            generation = self._generation
+            state = self.get(session_id)
+            remaining = deadline - time.monotonic()
+            if state is None or state['version'] > version or remaining <= 0:
+                return state
+            with self._changed:
+                if self._generation == generation:
+                    self._changed.wait(min(remaining, poll_interval))
+
+    def _notify(self):
+        with self._changed:
+            self._generation += 1
+            self._changed.notify_all()
+
+    def cancel_token(self, session_id):
+        """为本进程中开始执行的任务登记取消标志，任务结束时调用release_cancel_token"""
+        token = CancelToken(self, session_id)
+        with self._changed:
+            self._cancel_tokens[session_id] = token
+        return token
+
+    def release_cancel_token(self, session_id):
+        with self._changed:
+            self._cancel_tokens.pop(session_id, None)
+
+    def request_cancel(self, session_id, delay=0):
+        """
+        请求取消任务
+
+        delay>0 时为延迟取消（页面离开时发出）：期间仍有客户端读取进度则由clear_deferred_cancel撤销
+        """
+        fields = {'cancel_at': time.time() + delay}
+        if delay > 0:
+            fields['cancel_deferred'] = True
+        self.update(session_id, fields)
+        if delay <= 0:
+            with self._changed:
+                token = self._cancel_tokens.get(session_id)
+            if token is not None:
+                token.set()
+
+    def clear_deferred_cancel(self, session_id, state):
+        """有客户端仍在查看进度时撤销延迟取消（例如页面只是刷新）"""
+        if state is not None and state.get('cancel_deferred'):
+            self.update(session_id, {'cancel_at': None, 'cancel_deferred': None})
+
+    def __contains__(self, session_id):
+        return self._connect().execute(
+            'SELECT 1 FROM search_jobs WHERE session_id = ?', (session_id,)
+        ).fetchone() is not None
+
+    def delete(self, session_id):
+        self._connect().execute('DELETE FROM search_jobs WHERE session_id = ?', (session_id,))
+
+    def purge_expired(self, max_age_seconds):
+        """删除超过max_age_seconds未更新的任务状态，返回删除数"""
+        cursor = self._connect().execute(
+            'DELETE FROM search_jobs WHERE updated_at < ?', (time.time() - max_age_seconds,)
+        )
+        return cursor.rowcount
@@ -0,0 +1,211 @@
+# ncbi_scheduler.py
+# NCBI E-utilities请求的公平调度：所有搜索共用一个API key的速率上限，
+# 按用户加权轮转分配请求机会，交互请求（esearch、第一批efetch）优先于后台批量获取
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 速率和配额是整个服务的合计，按gunicorn worker数（WEB_CONCURRENCY）平均分到每个进程
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+NCBI_REQUESTS_PER_SECOND = float(os.environ.get("NCBI_REQUESTS_PER_SECOND", "8"))     # NCBI上限为每个API key 10次/秒
+NCBI_USER_QUOTA_PER_MINUTE = int(os.environ.get("NCBI_USER_QUOTA_PER_MINUTE", "0"))   # 每个用户每分钟最多请求数，0表示不限
+NCBI_USER_WEIGHTS = os.environ.get("NCBI_USER_WEIGHTS", "")                            # "用户=权重,..."，未列出的用户权重为1
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+QUOTA_WINDOW_SECONDS = 60
+IDLE_USER_SECONDS = 60          # 空闲超过这么久的用户状态被清除
+MAX_WAIT_SLICE_SECONDS = 0.5    # 等待者至少每隔这么久检查一次取消标志
+MIN_WAIT_SECONDS = 0.001        # 等待时间下限，避免在锁上空转
+
+
+def _parse_weights(text):
+    weights = {}
+    for item in text.split(','):
+        user, _, weight = item.partition('=')
+        if user.strip() and weight.strip():
+            weights[user.strip()] = max(0.1, float(weight))
+    return weights
+
+
+class _Ticket:
+    __slots__ = ('user', 'priority', 'granted')
+
+    def __init__(self, user, priority):
+        self.user = user
+        self.priority = priority
+        self.granted = False
+
+
+class _UserState:
+    __slots__ = ('weight', 'pass_value', 'queues', 'grants', 'last_active')
+
+    def __init__(self, weight, pass_value):
+        self.weight = weight
+        self.pass_value = pass_value                       # 步进调度的虚拟时间，越小越先获得机会
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.grants = deque()                              # 配额窗口内获得机会的时间
+        self.last_active = time.monotonic()
+
+    def waiting(self):
+        return any(self.queues.values())
+
+
+class FairShareScheduler:
+    """
+    E-utilities请求机会的分配器
+
+    令牌桶限制总速率；有令牌时先在有交互请求的用户中选择，再在批量请求中选择，
+    同一优先级内选虚拟时间最小的用户，每次分配后其虚拟时间增加1/权重（加权轮转）。
+    超出每分钟配额的用户暂时不参与分配。没有独立的调度线程，由等待者在持锁时完成分配。
+    调度只在本进程中已开始执行的搜索之间进行，搜索能否开始由search_executor决定。
+
+    Args:
+        rate: 每秒请求数上限，默认为NCBI_REQUESTS_PER_SECOND分到本进程的份额
+        quota_per_minute: 每个用户每分钟请求数上限，0表示不限，默认为NCBI_USER_QUOTA_PER_MINUTE分到本进程的份额
+        weights: {用户: 权重}
+    """
+
+    def __init__(self, rate=None, quota_per_minute=None, weights=None):
+        if rate is None:
+            rate = NCBI_REQUESTS_PER_SECOND / WEB_CONCURRENCY
+        if quota_per_minute is None:
+            quota_per_minute = -(-NCBI_USER_QUOTA_PER_MINUTE // WEB_CONCURRENCY)
+        self.rate = max(0.1, rate)
+        self.quota_per_minute = quota_per_minute
+        self.weights = _parse_weights(NCBI_USER_WEIGHTS) if weights is None else dict(weights)
+        self._cond = threading.Condition()
+        self._tokens = self.rate
+        self._refilled_at = time.monotonic()
+        self._users = {}
+        self._virtual_time = 0.0
+        self._granted = {priority: 0 for priority in PRIORITIES}
+
+    def acquire(self, user, priority=BULK, cancel_event=None):
+        """
+        阻塞直到user获得一次请求机会
+
+        Returns:
+            bool: 获得机会返回True；等待期间cancel_event被设置时放弃排队并返回False
+
+        cancel_event（任务的CancelToken）在锁外检查：它的is_set()可能查询SQLite，
+        不能放在所有NCBI请求共用的临界区内
+        """
+        ticket = _Ticket(user, priority)
+        with self._cond:
+            state = self._users.get(user)
+            if state is None:
+                self._forget_idle_users_locked()
+                state = self._users[user] = _UserState(self.weights.get(user, 1.0), self._virtual_time)
+            elif not state.waiting():
+                # 空闲后重新开始请求的用户不能用之前积累的虚拟时间插队
+                state.pass_value = max(state.pass_value, self._virtual_time)
+            state.queues[priority].append(ticket)
+            state.last_active = time.monotonic()
+
+        while True:
+            with self._cond:
+                wait = self._dispatch_locked()
+                if not ticket.granted:
+                    self._cond.wait(min(wait, MAX_WAIT_SLICE_SECONDS))
+                if ticket.granted:
+                    return True
+            if cancel_event is not None and cancel_event.is_set():
+                with self._cond:
+                    if ticket.granted:
+                        return True
+                    state.queues[priority].remove(ticket)
+                    # 让出的位置立即分配给其他等待者
+                    self._dispatch_locked()
+                return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rate': self.rate,
+                'active_users': sum(1 for state in self._users.values() if state.waiting()),
+                'waiting_interactive': sum(len(state.queues[INTERACTIVE]) for state in self._users.values()),
+                'waiting_bulk': sum(len(state.queues[BULK]) for state in self._users.values()),
+                'granted_interactive': self._granted[INTERACTIVE],
+                'granted_bulk': self._granted[BULK]
+            }
+
+    def _dispatch_locked(self):
+        """按令牌分配机会，返回下一次可能有变化前的等待秒数（大于0）"""
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        granted = False
+        while self._tokens >= 1:
+            state, ticket = self._next_ticket_locked(now)
+            if ticket is None:
+                break
+            state.queues[ticket.priority].popleft()
+            ticket.granted = True
+            granted = True
+            self._tokens -= 1
+            self._granted[ticket.priority] += 1
+            self._virtual_time = state.pass_value
+            state.pass_value += 1.0 / state.weight
+            if self.quota_per_minute > 0:
+                state.grants.append(now)
+        if granted:
+            self._cond.notify_all()
+        if self._tokens < 1:
+            return max(MIN_WAIT_SECONDS, (1 - self._tokens) / self.rate)
+        # 有令牌但等待者都超出了配额：等到最早的一次机会移出配额窗口
+        expiries = [state.grants[0] + QUOTA_WINDOW_SECONDS - now
+                    for state in self._users.values() if state.waiting() and state.grants]
+        return max(MIN_WAIT_SECONDS, min(expiries, default=MAX_WAIT_SLICE_SECONDS))
+
+    def _next_ticket_locked(self, now):
+        best = None
+        for priority in PRIORITIES:
+            for state in self._users.values():
+                if not state.queues[priority] or self._over_quota_locked(state, now):
+                    continue
+                if best is None or state.pass_value < best.pass_value:
+                    best = state
+            if best is not None:
+                return best, best.queues[priority][0]
+        return None, None
+
+    def _over_quota_locked(self, state, now):
+        if self.quota_per_minute <= 0:
+            return False
+        while state.grants and state.grants[0] <= now - QUOTA_WINDOW_SECONDS:
+            state.grants.popleft()
+        return len(state.grants) >= self.quota_per_minute
+
+    def _forget_idle_users_locked(self):
+        now = time.monotonic()
+        for user, state in list(self._users.items()):
+            if not state.waiting() and now - state.last_active > max(IDLE_USER_SECONDS, QUOTA_WINDOW_SECONDS):
+                del self._users[user]
+
+
+ncbi_scheduler = FairShareScheduler()
+
+# 当前线程代表哪个用户发出NCBI请求（由执行搜索的线程设置，CLI等未设置时为'local'）
+_context = threading.local()
+
+
+@contextmanager
+def ncbi_user(user, cancel_event=None):
+    """在with块内，本线程发出的E-utilities请求计入user的份额，排队时可被cancel_event打断"""
+    previous = getattr(_context, 'user', None), getattr(_context, 'cancel_event', None)
+    _context.user, _context.cancel_event = user, cancel_event
+    try:
+        yield
+    finally:
+        _context.user, _context.cancel_event = previous
+
+
+def wait_for_slot(priority=BULK):
+    """为当前线程的用户等待一次请求机会，等待中被取消时返回False"""
+    return ncbi_scheduler.acquire(getattr(_context, 'user', None) or 'local', priority,
+                                  getattr(_context, 'cancel_event', None))
@@ -8,22 +8,64 @@ import re
 import os
 import json
 import sqlite3
+import base64
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
+try:
+    import fcntl
+except ImportError:   # Windows：没有gunicorn多进程，只需进程内互斥
+    fcntl = None
+try:
+    from .text_codec import (
+        COMPRESSION_MODES, LazyArticle, build_dictionary, compress_text,
+        decompress_text, set_dictionary_loader
+    )
+    from .exporters import write_export_file
+    from .ncbi_scheduler import BULK, INTERACTIVE, wait_for_slot
+    from .metrics import (
+        ARTICLES_FETCHED, ARTICLES_KEPT, NCBI_BYTES, NCBI_RETRIES, NCBI_WAIT_SECONDS, STAGE_SECONDS
+    )
+    from .search_trace import SearchTrace, current_trace, profile_mode
+    from .query_parser import QuerySyntaxError, encoded_size, shard_query
+except ImportError:
+    from text_codec import (
+        COMPRESSION_MODES, LazyArticle, build_dictionary, compress_text,
+        decompress_text, set_dictionary_loader
+    )
+    from exporters import write_export_file
+    from ncbi_scheduler import BULK, INTERACTIVE, wait_for_slot
+    from metrics import (
+        ARTICLES_FETCHED, ARTICLES_KEPT, NCBI_BYTES, NCBI_RETRIES, NCBI_WAIT_SECONDS, STAGE_SECONDS
+    )
+    from search_trace import SearchTrace, current_trace, profile_mode
+    from query_parser import QuerySyntaxError, encoded_size, shard_query
 
 # 设置API密钥和基础URL (PubMed E-utilities)
 PUBMED_API_KEY = os.environ.get("PUBMED_API_KEY", "b6a22ac9a183cabddf8a38046641c2378308")
 BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+# esearch的term参数（URL编码后）超过此长度时，按OR分组拆成多个子查询，在NCBI历史中合并结果
+PUBMED_MAX_TERM_BYTES = int(os.environ.get("PUBMED_MAX_TERM_BYTES", "8000"))
 
 # OpenRouter API Configuration
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "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")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")  # 测试时可指向本地假服务（scripts/fake_openrouter.py）
 YOUR_SITE_URL = os.environ.get("SITE_URL", "https://pubmed-search-4nr1.onrender.com")
 YOUR_SITE_NAME = "PubMed Search Tool"
+AI_QUERY_MODEL = os.environ.get("AI_QUERY_MODEL", "anthropic/claude-haiku-4.5")  # 使用更便宜的Haiku模型
+AI_QUERY_PROMPT_VERSION = 1     # 修改生成查询的提示词时加一，旧的缓存结果随之失效
 
 # 数据库配置
 import os
 DATABASE_PATH = os.environ.get("DATABASE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pubmed_search_history.db"))
 
+# 大文本列压缩: ""(不压缩) / "zlib" / "zlib_dict"(zlib + 共享字典)
+DB_COMPRESSION = os.environ.get("DB_COMPRESSION", "").strip().lower()
+if DB_COMPRESSION not in COMPRESSION_MODES:
+    print(f"⚠️ 未知的DB_COMPRESSION设置: {DB_COMPRESSION}，将不进行压缩")
+    DB_COMPRESSION = ""
+
 # 定义主刊和子刊列表 (32个期刊)
 MAIN_JOURNALS = {
     "Nature Reviews Genetics": ["Nature Reviews Genetics"],
@@ -102,78 +144,262 @@ JOURNAL_IMPACT_FACTORS = {
     "GigaScience": 11.8
 }
 
+def _column_exists(cursor, table, column):
+    return any(row[1] == column for row in cursor.execute(f'PRAGMA table_info({table})'))
+
+def _add_column_if_missing(cursor, table, column, column_type):
+    """旧数据库可能已经手工加过该字段，迁移需要可重复执行"""
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+        return True
+    return False
+
+def _migrate_base_tables(cursor):
+    """v1: 搜索历史表、文章表及基础索引"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            search_date TEXT NOT NULL,
+            user_topic TEXT,
+            ai_generated_query TEXT,
+            final_query TEXT,
+            journal_filter TEXT,
+            year_range TEXT,
+            min_score REAL,
+            article_types TEXT,
+            total_results INTEGER,
+            filtered_results INTEGER,
+            search_parameters TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 早期版本的search_history没有article_types字段
+    _add_column_if_missing(cursor, 'search_history', 'article_types', 'TEXT')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS articles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            search_id INTEGER,
+            pmid TEXT NOT NULL,
+            title TEXT,
+            journal TEXT,
+            journal_abbr TEXT,
+            year TEXT,
+            volume TEXT,
+            issue TEXT,
+            pages TEXT,
+            doi TEXT,
+            abstract TEXT,
+            authors TEXT,
+            article_types TEXT,
+            keywords TEXT,
+            citation TEXT,
+            pubmed_url TEXT,
+            impact_factor REAL,
+            score REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (search_id) REFERENCES search_history (id),
+            UNIQUE(search_id, pmid)
+        )
+    ''')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_date ON search_history(search_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pmid ON articles(pmid)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_id ON articles(search_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_score ON articles(score)')
+
+def _migrate_compression_dictionaries(cursor):
+    """v2: 共享压缩字典表（见text_codec.py）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compression_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content BLOB NOT NULL,
+            sample_count INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migrate_search_status(cursor):
+    """v3: 搜索状态 pending(已预留、结果写入中) / saved"""
+    _add_column_if_missing(cursor, 'search_history', 'status', "TEXT DEFAULT 'saved'")
+
+def _migrate_history_listing(cursor):
+    """v4: 年份范围、摘要统计、游标分页索引和全文索引"""
+    added = False
+    for column, column_type in (('min_year', 'INTEGER'), ('max_year', 'INTEGER'), ('summary_stats', 'TEXT')):
+        added = _add_column_if_missing(cursor, 'search_history', column, column_type) or added
+    if added:
+        _backfill_history_years(cursor)
+    # 历史列表按 (created_at, id) 做游标分页
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_created ON search_history(created_at, id)')
+    _init_history_fts(cursor)
+
+def _migrate_write_version(cursor):
+    """v5: 写入版本和更新时间（历史页面和导出的ETag/Last-Modified）"""
+    _add_column_if_missing(cursor, 'search_history', 'write_version', 'INTEGER NOT NULL DEFAULT 0')
+    if _add_column_if_missing(cursor, 'search_history', 'updated_at', 'TIMESTAMP'):
+        cursor.execute('UPDATE search_history SET updated_at = created_at')
+
+def _migrate_search_trace(cursor):
+    """v6: 每次搜索的执行记录（阶段耗时、批次、漏斗，JSON）"""
+    _add_column_if_missing(cursor, 'search_history', 'trace', 'TEXT')
+
+# 按顺序执行的数据库迁移，版本号记录在 PRAGMA user_version 中
+MIGRATIONS = [
+    (1, _migrate_base_tables),
+    (2, _migrate_compression_dictionaries),
+    (3, _migrate_search_status),
+    (4, _migrate_history_listing),
+    (5, _migrate_write_version),
+    (6, _migrate_search_trace),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_migration_thread_lock = threading.Lock()
+
+@contextmanager
+def _migration_guard():
+    """跨进程互斥（数据库旁的.lock文件），保证迁移和一次性VACUUM只由一个进程执行"""
+    with _migration_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(DATABASE_PATH + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def init_database():
-    """初始化SQLite数据库"""
-    try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 创建搜索历史表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS search_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                search_date TEXT NOT NULL,
-                user_topic TEXT,
-                ai_generated_query TEXT,
-                final_query TEXT,
-                journal_filter TEXT,
-                year_range TEXT,
-                min_score REAL,
-                article_types TEXT,
-                total_results INTEGER,
-                filtered_results INTEGER,
-                search_parameters TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    """
+    初始化/升级SQLite数据库
+
+    结构已是最新版本时只读取一次 user_version，不执行任何DDL；
+    需要升级时先取得跨进程的迁移锁，再重新检查版本并执行迁移（包括切换auto_vacuum所需的
+    一次性VACUUM），多个进程同时启动也只会有一个执行。
 
-        # 为现有数据库添加article_types字段（如果不存在）
+    Returns:
+        bool: 数据库是否可用
+    """
+    try:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=60, isolation_level=None)
         try:
-            cursor.execute('ALTER TABLE search_history ADD COLUMN article_types TEXT')
-        except sqlite3.OperationalError:
-            # 字段已存在，忽略错误
-            pass
-        
-        # 创建文章详情表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS articles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                search_id INTEGER,
-                pmid TEXT NOT NULL,
-                title TEXT,
-                journal TEXT,
-                journal_abbr TEXT,
-                year TEXT,
-                volume TEXT,
-                issue TEXT,
-                pages TEXT,
-                doi TEXT,
-                abstract TEXT,
-                authors TEXT,
-                article_types TEXT,
-                keywords TEXT,
-                citation TEXT,
-                pubmed_url TEXT,
-                impact_factor REAL,
-                score REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (search_id) REFERENCES search_history (id),
-                UNIQUE(search_id, pmid)
-            )
-        ''')
-        
-        # 创建索引以提高查询性能
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_date ON search_history(search_date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pmid ON articles(pmid)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_id ON articles(search_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_score ON articles(score)')
-        
-        conn.commit()
-        conn.close()
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return True
+            
+            with _migration_guard():
+                # 拿到迁移锁后重新读取，其他进程可能已经完成迁移
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= SCHEMA_VERSION:
+                    return True
+                
+                # 启用增量VACUUM，删除历史后可以逐步回收空间（见retention.py）
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    # 已有数据的数据库需要一次完整VACUUM才能切换模式（不能在事务中执行）
+                    conn.execute('VACUUM')
+                
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    cursor = conn.cursor()
+                    for migration_version, migrate in MIGRATIONS:
+                        if migration_version > version:
+                            migrate(cursor)
+                            print(f"🔧 数据库迁移 {migrate.__doc__}")
+                    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+        finally:
+            conn.close()
         print("✅ 数据库初始化完成")
+        return True
         
     except Exception as e:
         print(f"❌ 数据库初始化失败: {e}")
+        return False
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def get_db_connection(timeout=30, **kwargs):
+    """
+    获取数据库连接，第一次使用时才初始化/迁移数据库
+
+    应用启动时不再执行建表DDL，worker启动更快。
+    """
+    global _schema_ready
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                _schema_ready = init_database()
+    return sqlite3.connect(DATABASE_PATH, timeout=timeout, **kwargs)
+
+def _init_history_fts(cursor):
+    """创建历史主题/查询的全文索引（trigram分词，支持子串匹配）；SQLite不支持FTS5时跳过"""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'search_history_fts'"
+    ).fetchone()
+    if exists:
+        return
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE search_history_fts USING fts5(
+                user_topic, final_query,
+                content='search_history', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ 当前SQLite不支持FTS5 trigram，历史搜索将使用LIKE匹配: {e}")
+        return
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_history_fts_insert AFTER INSERT ON search_history BEGIN
+            INSERT INTO search_history_fts(rowid, user_topic, final_query)
+            VALUES (new.id, new.user_topic, new.final_query);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_history_fts_delete AFTER DELETE ON search_history BEGIN
+            INSERT INTO search_history_fts(search_history_fts, rowid, user_topic, final_query)
+            VALUES ('delete', old.id, old.user_topic, old.final_query);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_history_fts_update AFTER UPDATE OF user_topic, final_query ON search_history BEGIN
+            INSERT INTO search_history_fts(search_history_fts, rowid, user_topic, final_query)
+            VALUES ('delete', old.id, old.user_topic, old.final_query);
+            INSERT INTO search_history_fts(rowid, user_topic, final_query)
+            VALUES (new.id, new.user_topic, new.final_query);
+        END
+    ''')
+    cursor.execute("INSERT INTO search_history_fts(search_history_fts) VALUES ('rebuild')")
+
+def _parse_year_range(year_range):
+    """从 '2015-2020' / '2015以后' / '2020以前' 解析出 (min_year, max_year)"""
+    if not year_range:
+        return None, None
+    match = re.fullmatch(r'\s*(\d{4})\s*-\s*(\d{4})\s*', year_range)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    match = re.match(r'\s*(\d{4})\s*以后', year_range)
+    if match:
+        return int(match.group(1)), None
+    match = re.match(r'\s*(\d{4})\s*以前', year_range)
+    if match:
+        return None, int(match.group(1))
+    return None, None
+
+def _backfill_history_years(cursor):
+    """为旧记录补全min_year/max_year"""
+    rows = cursor.execute(
+        'SELECT id, year_range FROM search_history WHERE min_year IS NULL AND max_year IS NULL'
+    ).fetchall()
+    updates = [(*_parse_year_range(year_range), row_id) for row_id, year_range in rows]
+    cursor.executemany('UPDATE search_history SET min_year = ?, max_year = ? WHERE id = ?',
+                       [u for u in updates if u[0] is not None or u[1] is not None])
 
 def generate_inclusive_fallback_query(topic):
     """
@@ -190,10 +416,8 @@ def generate_inclusive_fallback_query(topic):
     # 这是一个简单但有效的fallback策略
     return f'("{topic}"[tiab])'
 
-def generate_pubmed_query_with_ai(user_topic):
-    """
-    使用AI生成PubMed搜索查询字符串
-    """
+def _ai_query_request(user_topic, stream=False):
+    """OpenRouter请求的headers和JSON body（普通和流式生成共用同一提示词）"""
     prompt_xml_md = f"""
 <prompt_instructions>
   <role>You are an AI assistant specialized in crafting comprehensive and inclusive PubMed search queries for biomedical research.</role>
@@ -315,11 +539,81 @@ def generate_pubmed_query_with_ai(user_topic):
     }
     
     data = {
-        "model": "anthropic/claude-haiku-4.5",  # 使用更便宜的Haiku模型
+        "model": AI_QUERY_MODEL,
         "messages": [{"role": "user", "content": prompt_xml_md}],
         "temperature": 0.4,  # 降低温度以获得更一致的结果
         "top_p": 0.8,        # 稍微降低以提高质量
     }
+    if stream:
+        data["stream"] = True
+    return headers, data
+
+def clean_ai_query(ai_content):
+    """去掉AI响应首尾的空白和```pubmed / ```代码块标记"""
+    ai_content_cleaned = ai_content.strip()
+    if ai_content_cleaned.lower().startswith("```pubmed"):
+        ai_content_cleaned = ai_content_cleaned[len("```pubmed"):]
+    elif ai_content_cleaned.lower().startswith("```"):
+        ai_content_cleaned = ai_content_cleaned[len("```"):]
+
+    if ai_content_cleaned.lower().endswith("```"):
+        ai_content_cleaned = ai_content_cleaned[:-len("```")]
+    
+    return ai_content_cleaned.strip()
+
+class FenceStripper:
+    """
+    clean_ai_query的增量版本，用于流式生成
+
+    开头可能是代码块标记的部分和结尾的空白/反引号先暂存，确定不属于标记后再输出；
+    所有feed()输出加上finish()输出与对完整文本调用clean_ai_query的结果相同。
+    """
+    OPENING = ("```pubmed", "```")
+
+    def __init__(self):
+        self._head = ""          # 尚未确定是否以代码块标记开头的内容
+        self._started = False    # 开头已处理
+        self._skip_space = True  # 去掉标记后紧跟的空白
+        self._tail = ""          # 暂存的结尾空白和反引号
+
+    def feed(self, text):
+        """返回可以立即输出的文本"""
+        if not self._started:
+            self._head += text
+            head = self._head.lstrip()
+            if not head or (len(head) < len(self.OPENING[0]) and self.OPENING[0].startswith(head.lower())):
+                return ""
+            self._started = True
+            for opening in self.OPENING:
+                if head.lower().startswith(opening):
+                    head = head[len(opening):]
+                    break
+            text = head
+        if self._skip_space:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._skip_space = False
+        text = self._tail + text
+        body = re.sub(r"[\s`]*$", "", text)
+        self._tail = text[len(body):]
+        return body
+
+    def finish(self):
+        """返回暂存的剩余文本（结尾的代码块标记和空白已去掉）"""
+        if not self._started:
+            return clean_ai_query(self._head)
+        tail = self._tail.rstrip()
+        if tail.endswith("```"):
+            tail = tail[:-len("```")]
+        self._tail = ""
+        return tail.rstrip()
+
+def generate_pubmed_query_with_ai(user_topic):
+    """
+    使用AI生成PubMed搜索查询字符串
+    """
+    headers, data = _ai_query_request(user_topic)
 
     print("\n🤖 正在使用AI生成包容性PubMed查询...")
     print(f"🔑 使用API密钥: {OPENROUTER_API_KEY[:20]}...{OPENROUTER_API_KEY[-10:]}")
@@ -336,16 +630,7 @@ def generate_pubmed_query_with_ai(user_topic):
         if response_json.get("choices") and len(response_json["choices"]) > 0:
             ai_content = response_json["choices"][0].get("message", {}).get("content", "")
             # 清理响应内容
-            ai_content_cleaned = ai_content.strip()
-            if ai_content_cleaned.lower().startswith("```pubmed"):
-                ai_content_cleaned = ai_content_cleaned[len("```pubmed"):]
-            elif ai_content_cleaned.lower().startswith("```"):
-                ai_content_cleaned = ai_content_cleaned[len("```"):]
-
-            if ai_content_cleaned.lower().endswith("```"):
-                ai_content_cleaned = ai_content_cleaned[:-len("```")]
-            
-            return ai_content_cleaned.strip()
+            return clean_ai_query(ai_content)
         else:
             print("❌ AI响应格式错误: 未找到choices或choices数组为空")
             return None
@@ -358,168 +643,68 @@ def generate_pubmed_query_with_ai(user_topic):
         print(f"❌ AI查询生成时发生意外错误: {e}")
         return None
 
-def search_pubmed_with_simplified_query(original_query, journal=None, min_year=None, max_year=None, main_journals_only=True):
-    """当原查询过长时，使用简化查询作为后备方案"""
-    print("🔄 正在简化查询以避免URL过长错误...")
-    
-    # 简化策略：提取核心关键词
-    simplified_query = simplify_query(original_query)
-    print(f"📝 简化后的查询: {simplified_query}")
-    
-    # 处理期刊过滤
-    search_query = simplified_query
-    if journal:
-        journals_input_list = journal.replace("、", ",").replace("，", ",").split(",")
-        journals_input_list = [j.strip() for j in journals_input_list if j.strip()]
-        journal_filter_parts = []
-        
-        if main_journals_only:
-            matched_main_journal_variants = set()
-            for j_input in journals_input_list:
-                found_main = False
-                for main_name_key, variants_list in MAIN_JOURNALS.items():
-                    if main_name_key.lower() == j_input.lower() or j_input.lower() in [v.lower() for v in variants_list]:
-                        for v in variants_list:
-                            matched_main_journal_variants.add(f'"{v}"[journal]')
-                        found_main = True
-                        break
-                
-                if not found_main:
-                    journal_filter_parts.append(f'"{j_input}"[journal]')
-            
-            if matched_main_journal_variants:
-                journal_filter_parts.extend(list(matched_main_journal_variants))
-        else:
-            for j_input in journals_input_list:
-                journal_filter_parts.append(f'"{j_input}"[journal]')
-        
-        if journal_filter_parts:
-            journal_query_segment = " OR ".join(journal_filter_parts)
-            search_query += f" AND ({journal_query_segment})"
-    
-    # 处理年份过滤
-    if min_year and max_year:
-        search_query += f" AND {min_year}:{max_year}[pdat]"
-    elif min_year:
-        search_query += f" AND {min_year}:[pdat]"
-    elif max_year:
-        search_query += f" AND :{max_year}[pdat]"
-    
-    # 使用POST请求执行简化查询
-    search_url = BASE_URL + "esearch.fcgi"
-    search_params = {
-        "db": "pubmed", 
-        "term": search_query,
-        "retmax": 0,
-        "usehistory": "y", 
-        "api_key": PUBMED_API_KEY
-    }
-    
-    try:
-        response = requests.post(search_url, data=search_params, timeout=30)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        
-        error_elem = root.find("ERROR")
-        if error_elem is not None and error_elem.text:
-            print(f"❌ 简化查询也失败: {error_elem.text}")
-            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
-        
-        count_elem = root.find("Count")
-        total_count = int(count_elem.text) if count_elem is not None else 0
-        print(f"📊 简化查询找到 {total_count} 篇相关文章")
-        
-        if total_count == 0:
-            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
-        
-        # 获取PMIDs
-        search_params["retmax"] = min(total_count, 10000)
-        response = requests.post(search_url, data=search_params, timeout=60)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        
-        web_env_elem = root.find("WebEnv")
-        query_key_elem = root.find("QueryKey")
-        
-        if web_env_elem is None or query_key_elem is None:
-            id_list_direct = [id_elem.text for id_elem in root.findall(".//IdList/Id")]
-            if id_list_direct:
-                return {"pmids": id_list_direct, "web_env": None, "query_key": None, "total_count": total_count}
-            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
-        
-        web_env = web_env_elem.text
-        query_key = query_key_elem.text
-        id_list = [id_elem.text for id_elem in root.findall(".//IdList/Id")]
-        
-        print(f"✅ 简化查询成功获取 {len(id_list)} 篇文章的PMIDs")
-        return {"pmids": id_list, "web_env": web_env, "query_key": query_key, "total_count": total_count}
-        
-    except Exception as e:
-        print(f"❌ 简化查询失败: {e}")
-        return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
+def stream_pubmed_query_with_ai(user_topic):
+    """
+    流式生成PubMed查询（OpenRouter的SSE流式接口），逐段产出已去掉代码块标记的文本
 
-def simplify_query(query):
-    """简化复杂的PubMed查询"""
-    # 移除过多的OR条件，保留核心关键词
-    # 提取主要的AND分组
-    and_parts = query.split(" AND ")
-    
-    simplified_parts = []
-    for part in and_parts:
-        if part.strip():
-            # 对于每个AND部分，如果包含很多OR条件，则简化
-            if " OR " in part and part.count(" OR ") > 10:
-                # 提取括号内的内容
-                if part.startswith("(") and part.endswith(")"):
-                    inner_content = part[1:-1]
-                    or_terms = [term.strip() for term in inner_content.split(" OR ")]
-                    
-                    # 保留前5个最重要的术语
-                    important_terms = []
-                    for term in or_terms[:15]:  # 只取前15个术语
-                        if not ("[MeSH Terms]" in term and len(important_terms) > 5):
-                            important_terms.append(term)
-                        if len(important_terms) >= 8:  # 限制为8个术语
-                            break
-                    
-                    simplified_part = "(" + " OR ".join(important_terms) + ")"
-                    simplified_parts.append(simplified_part)
-                else:
-                    simplified_parts.append(part)
-            else:
-                simplified_parts.append(part)
-    
-    simplified_query = " AND ".join(simplified_parts)
-    
-    # 如果仍然太长，进一步简化
-    if len(simplified_query) > 1000:
-        # 只保留前两个AND部分
-        and_parts = simplified_query.split(" AND ")
-        simplified_query = " AND ".join(and_parts[:2])
-    
-    return simplified_query
+    请求失败或响应格式错误时抛出异常；产出的各段拼接后即为完整查询
+    """
+    headers, data = _ai_query_request(user_topic, stream=True)
+    print(f"\n🤖 正在流式生成PubMed查询 (模型: {data['model']})...")
+    stripper = FenceStripper()
+    with requests.post(OPENROUTER_API_URL, headers=headers, data=json.dumps(data),
+                       stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            # 空行分隔事件，以冒号开头的是注释（OpenRouter处理中的保活）
+            if not line or line.startswith(':') or not line.startswith('data:'):
+                continue
+            payload = line[len('data:'):].strip()
+            if payload == '[DONE]':
+                break
+            chunk = json.loads(payload)
+            if chunk.get('error'):
+                raise RuntimeError(chunk['error'].get('message', 'OpenRouter流式响应出错'))
+            choices = chunk.get('choices') or []
+            delta = (choices[0].get('delta') or {}).get('content') if choices else None
+            if delta:
+                text = stripper.feed(delta)
+                if text:
+                    yield text
+    text = stripper.finish()
+    if text:
+        yield text
+
+@lru_cache(maxsize=None)
+def _main_journal_variants():
+    """所有主刊名称变体（小写），第一次使用时才构建"""
+    return frozenset(variant.lower() for variants in MAIN_JOURNALS.values() for variant in variants)
+
+@lru_cache(maxsize=None)
+def _impact_factor_index():
+    """小写期刊名 -> 影响因子，第一次使用时才构建"""
+    index = {}
+    for journal_key, impact_factor in JOURNAL_IMPACT_FACTORS.items():
+        index.setdefault(journal_key.lower(), impact_factor)
+    return index
 
 def is_main_journal(journal_name):
-    """检查期刊是否为主刊"""
-    for main_journal_variants in MAIN_JOURNALS.values():
-        if any(variant.lower() == journal_name.lower() for variant in main_journal_variants):
-            return True
-    
-    for pattern in SUBSIDIARY_PATTERNS:
-        if re.search(pattern, journal_name, re.IGNORECASE):
-            for main_journal_variants in MAIN_JOURNALS.values():
-                if any(variant.lower() == journal_name.lower() for variant in main_journal_variants):
-                    return True
-            return False
-    return False
+    """检查期刊是否为主刊（子刊名称如 Nature Xxx 只有在主刊列表中时才算）"""
+    return journal_name.lower() in _main_journal_variants()
 
-def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journals_only=True):
-    """搜索PubMed文章，获取所有结果"""
-    print(f"📝 原始搜索词: {query}")
+def build_search_term(query, journal=None, min_year=None, max_year=None, main_journals_only=True, verbose=True):
+    """
+    组合esearch的term：查询 + 期刊过滤 + 年份范围
+
+    相同的输入总是得到相同的字符串（期刊变体按名称排序），可用作缓存键
+    """
+    if verbose:
+        print(f"📝 原始搜索词: {query}")
     
     # 处理中文标点符号
     query = query.replace("，", " ").replace("、", " ")
-    print(f"🔧 处理后的搜索词: {query}")
+    if verbose:
+        print(f"🔧 处理后的搜索词: {query}")
     
     search_query = query
     
@@ -541,18 +726,21 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
                         break
                 
                 if not found_main:
-                    print(f"⚠️ 警告: '{j_input}' 不在预定义的主刊列表中，但将按字面意思搜索")
+                    if verbose:
+                        print(f"⚠️ 警告: '{j_input}' 不在预定义的主刊列表中，但将按字面意思搜索")
                     journal_filter_parts.append(f'"{j_input}"[journal]')
             
             if matched_main_journal_variants:
-                journal_filter_parts.extend(list(matched_main_journal_variants))
-                print(f"📚 期刊过滤 (主刊模式): {', '.join(journals_input_list)}")
-            elif not journal_filter_parts:
-                print(f"⚠️ 警告: 用户指定的期刊均未匹配到预定义的主刊列表")
+                journal_filter_parts.extend(sorted(matched_main_journal_variants))
+                if verbose:
+                    print(f"📚 期刊过滤 (主刊模式): {', '.join(journals_input_list)}")
+            elif not journal_filter_parts and verbose:
+                print("⚠️ 警告: 用户指定的期刊均未匹配到预定义的主刊列表")
         else:
             for j_input in journals_input_list:
                 journal_filter_parts.append(f'"{j_input}"[journal]')
-            print(f"📚 期刊过滤 (所有期刊模式): {', '.join(journals_input_list)}")
+            if verbose:
+                print(f"📚 期刊过滤 (所有期刊模式): {', '.join(journals_input_list)}")
         
         if journal_filter_parts:
             journal_query_segment = " OR ".join(journal_filter_parts)
@@ -561,20 +749,128 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
     # 处理年份过滤
     if min_year and max_year:
         search_query += f" AND {min_year}:{max_year}[pdat]"
-        print(f"📅 年份范围: {min_year}-{max_year}")
+        if verbose:
+            print(f"📅 年份范围: {min_year}-{max_year}")
     elif min_year:
         search_query += f" AND {min_year}:[pdat]"
-        print(f"📅 起始年份: {min_year}")
+        if verbose:
+            print(f"📅 起始年份: {min_year}")
     elif max_year:
         search_query += f" AND :{max_year}[pdat]"
-        print(f"📅 截止年份: {max_year}")
+        if verbose:
+            print(f"📅 截止年份: {max_year}")
+    
+    return search_query
+
+def count_pubmed(term):
+    """
+    只获取esearch的命中数（rettype=count，不建立history、不返回PMID），用于查询草稿的实时预览
+
+    Returns:
+        dict: count、query_translation（PubMed实际执行的查询）、warnings（未找到的短语等）
+
+    Raises:
+        ValueError: PubMed返回查询错误
+    """
+    search_url = BASE_URL + "esearch.fcgi"
+    search_params = {"db": "pubmed", "term": term, "rettype": "count", "api_key": PUBMED_API_KEY}
+    shards = _shard_search_term(term, PUBMED_MAX_TERM_BYTES)
+    if len(shards) > 1:
+        search_params["WebEnv"], search_params["term"] = _post_query_shards(shards)
+    # 与search_pubmed相同的URL长度规则
+    if len(search_url) + sum(len(f"{k}={v}&") for k, v in search_params.items()) > 2000:
+        response = _eutils_request("POST", search_url, INTERACTIVE, data=search_params, timeout=15)
+    else:
+        response = _eutils_request("GET", search_url, INTERACTIVE, params=search_params, timeout=15)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+    error_elem = root.find("ERROR")
+    if error_elem is not None and error_elem.text:
+        raise ValueError(error_elem.text)
+    count_elem = root.find("Count")
+    warnings = [f"{elem.tag}: {elem.text}" for elem in root.findall(".//ErrorList/*") if elem.text]
+    warnings.extend(elem.text for elem in root.findall(".//WarningList/OutputMessage") if elem.text)
+    translation = root.findtext("QueryTranslation")
+    return {
+        "count": int(count_elem.text) if count_elem is not None else 0,
+        "query_translation": translation,
+        "warnings": warnings
+    }
+
+def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journals_only=True):
+    """搜索PubMed文章，获取所有结果"""
+    search_query = build_search_term(query, journal, min_year, max_year, main_journals_only)
     
     if not search_query.strip():
         print("❌ 错误：搜索查询为空。请提供有效的关键词。")
         return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
 
     print(f"🔍 最终搜索查询: {search_query}")
-    
+
+    shards = _shard_search_term(search_query, PUBMED_MAX_TERM_BYTES)
+    if len(shards) > 1:
+        return _search_pubmed_shards(shards)
+    return _esearch_with_history(search_query)
+
+def _shard_search_term(term, max_bytes):
+    """
+    把过长的查询拆成若干子查询（结果并集与原查询相同）；不需要拆分或无法解析时返回[term]
+    """
+    if encoded_size(term) <= max_bytes:
+        return [term]
+    try:
+        return shard_query(term, max_bytes)
+    except QuerySyntaxError as e:
+        print(f"⚠️ 查询无法解析，不拆分: {e}")
+        return [term]
+
+def _post_query_shards(shards):
+    """
+    逐个提交子查询到同一个NCBI历史（WebEnv），返回 (web_env, 合并查询)
+
+    合并查询形如 "#1 OR #2 OR #3"，在NCBI服务器端精确求并集，计数和PMID与原查询一致
+
+    Raises:
+        ValueError: PubMed返回查询错误或响应缺少WebEnv/QueryKey
+    """
+    search_url = BASE_URL + "esearch.fcgi"
+    web_env = None
+    query_keys = []
+    for shard in shards:
+        search_params = {"db": "pubmed", "term": shard, "retmax": 0, "usehistory": "y", "api_key": PUBMED_API_KEY}
+        if web_env:
+            search_params["WebEnv"] = web_env
+        response = _eutils_request("POST", search_url, INTERACTIVE, data=search_params, timeout=30)
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+        error_elem = root.find("ERROR")
+        if error_elem is not None and error_elem.text:
+            raise ValueError(error_elem.text)
+        web_env = root.findtext("WebEnv")
+        query_key = root.findtext("QueryKey")
+        if not web_env or not query_key:
+            raise ValueError("子查询响应中缺少WebEnv或QueryKey")
+        query_keys.append(query_key)
+    return web_env, " OR ".join(f"#{query_key}" for query_key in query_keys)
+
+def _search_pubmed_shards(shards):
+    """分片执行过长的查询，再用合并查询获取总数和PMIDs"""
+    print(f"🔀 查询过长，拆分为 {len(shards)} 个子查询，在NCBI历史中合并结果")
+    try:
+        web_env, combined_query = _post_query_shards(shards)
+    except SearchCancelled:
+        raise
+    except Exception as e:
+        print(f"❌ 子查询失败: {e}")
+        return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0, "error": str(e)}
+    return _esearch_with_history(combined_query, web_env)
+
+def _esearch_with_history(search_query, web_env=None):
+    """
+    执行esearch（usehistory=y）获取总数和PMIDs；web_env用于引用已有历史中的查询（#1 OR #2）
+
+    请求或查询出错时返回空结果，并在error中附带原因
+    """
     # 检查查询长度，决定使用GET还是POST
     search_url = BASE_URL + "esearch.fcgi"
     search_params = {
@@ -584,6 +880,8 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
         "usehistory": "y", 
         "api_key": PUBMED_API_KEY
     }
+    if web_env:
+        search_params["WebEnv"] = web_env
     
     # 估算URL长度，如果太长则使用POST
     estimated_url_length = len(search_url) + sum(len(f"{k}={v}&") for k, v in search_params.items())
@@ -595,9 +893,9 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
     try:
         # 首先获取总数
         if use_post:
-            response = requests.post(search_url, data=search_params, timeout=30)
+            response = _eutils_request("POST", search_url, INTERACTIVE, data=search_params, timeout=30)
         else:
-            response = requests.get(search_url, params=search_params, timeout=30)
+            response = _eutils_request("GET", search_url, INTERACTIVE, params=search_params, timeout=30)
         
         response.raise_for_status()
         root = ET.fromstring(response.content)
@@ -605,7 +903,7 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
         error_elem = root.find("ERROR")
         if error_elem is not None and error_elem.text:
             print(f"❌ PubMed API错误: {error_elem.text}")
-            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
+            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0, "error": error_elem.text}
         
         count_elem = root.find("Count")
         total_count = int(count_elem.text) if count_elem is not None else 0
@@ -618,9 +916,9 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
         search_params["retmax"] = min(total_count, 10000)  # PubMed API限制
         
         if use_post:
-            response = requests.post(search_url, data=search_params, timeout=60)
+            response = _eutils_request("POST", search_url, INTERACTIVE, data=search_params, timeout=60)
         else:
-            response = requests.get(search_url, params=search_params, timeout=60)
+            response = _eutils_request("GET", search_url, INTERACTIVE, params=search_params, timeout=60)
         
         response.raise_for_status()
         root = ET.fromstring(response.content)
@@ -643,14 +941,19 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
         print(f"✅ 成功获取 {len(id_list)} 篇文章的PMIDs用于详情提取")
         return {"pmids": id_list, "web_env": web_env, "query_key": query_key, "total_count": total_count}
         
+    except SearchCancelled:
+        raise
     except requests.exceptions.HTTPError as e:
         if "414" in str(e) or "Request-URI Too Long" in str(e):
-            print("⚠️ 查询过长，尝试简化查询...")
-            # 尝试简化查询的后备方案
-            return search_pubmed_with_simplified_query(query, journal, min_year, max_year, main_journals_only)
+            # 拆分按OR分组进行，不丢弃任何检索词
+            shards = _shard_search_term(search_query, encoded_size(search_query) // 2) if not web_env else []
+            if len(shards) > 1:
+                return _search_pubmed_shards(shards)
+            print("❌ 查询过长且无法拆分")
+            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
         else:
             print(f"❌ HTTP错误: {e}")
-            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
+            return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0, "error": str(e)}
     except ET.ParseError as e:
         print(f"❌ XML解析错误: {e}")
         # Log the problematic XML content for debugging
@@ -668,12 +971,29 @@ def search_pubmed(query, journal=None, min_year=None, max_year=None, main_journa
                         print(f"{i+1:03d}: {lines[i]}")
             except Exception as log_e:
                 print(f"❌ 记录问题XML时出错: {log_e}")
-        return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
+        return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0, "error": str(e)}
     except Exception as e:
         print(f"❌ 搜索出错: {e}")
         if 'response' in locals() and response is not None:
              print(f"📄 可能相关的响应状态码: {response.status_code}")
-        return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0}
+        return {"pmids": [], "web_env": None, "query_key": None, "total_count": 0, "error": str(e)}
+
+def refine_pubmed(web_env, query_key, journal=None, min_year=None, max_year=None, main_journals_only=True):
+    """
+    在上一次搜索的NCBI历史结果集上追加过滤条件：#query_key AND 期刊 AND 年份
+
+    只把新增的过滤条件发给PubMed，由服务器在已有结果集上求交集，不再重新执行原查询。
+
+    Returns:
+        与search_pubmed相同的结果；历史已过期或请求失败时返回None，调用方应改为完整搜索
+    """
+    search_query = build_search_term(f"#{query_key}", journal, min_year, max_year, main_journals_only, verbose=False)
+    print(f"🔍 在历史结果集上缩小范围: {search_query}")
+    result = _esearch_with_history(search_query, web_env)
+    if result.get("error"):
+        print(f"⚠️ 无法使用NCBI历史结果集: {result['error']}")
+        return None
+    return result
 
 def get_element_text_recursive(element):
     """递归获取元素文本内容"""
@@ -687,6 +1007,64 @@ def get_element_text_recursive(element):
             text += child.tail
     return text.strip()
 
+class SearchCancelled(Exception):
+    """搜索在执行过程中被取消"""
+
+def raise_if_cancelled(cancel_event=None):
+    """cancel_event（threading.Event或具有is_set/wait方法的对象）已设置时抛出SearchCancelled"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise SearchCancelled("搜索已取消")
+
+def sleep_unless_cancelled(seconds, cancel_event=None):
+    """可被取消打断的等待，被取消时抛出SearchCancelled"""
+    if cancel_event is None:
+        time.sleep(seconds)
+    elif cancel_event.wait(seconds):
+        raise SearchCancelled("搜索已取消")
+
+def _eutils_request(method, url, priority=BULK, **kwargs):
+    """
+    经公平调度器发出E-utilities请求
+
+    请求速率由ncbi_scheduler统一控制（各用户加权轮转，交互请求优先），
+    排队期间搜索被取消时抛出SearchCancelled
+    """
+    wait_start = time.perf_counter()
+    granted = wait_for_slot(priority)
+    waited = time.perf_counter() - wait_start
+    NCBI_WAIT_SECONDS.observe(waited, priority=priority)
+    if not granted:
+        raise SearchCancelled("搜索已取消")
+    endpoint = _eutils_endpoint(url)
+    request_start = time.perf_counter()
+    response = requests.request(method, url, **kwargs)
+    elapsed = time.perf_counter() - request_start
+    STAGE_SECONDS.observe(elapsed, stage=endpoint)
+    NCBI_BYTES.inc(len(response.content), endpoint=endpoint)
+    trace = current_trace()
+    if trace is not None:
+        trace.record_request(endpoint, elapsed, waited, len(response.content))
+    return response
+
+def _eutils_endpoint(url):
+    """'esearch'、'efetch' 等，用作指标标签"""
+    return url.rsplit('/', 1)[-1].split('.', 1)[0]
+
+def _new_batch_stats(size):
+    """一批efetch的统计：请求和解析耗时、下载字节数、重试次数、解析出的有效文章数"""
+    return {'size': size, 'fetch_seconds': 0.0, 'parse_seconds': 0.0, 'bytes': 0, 'retries': 0, 'articles': 0}
+
+def _trace_batch(batch_stats):
+    trace = current_trace()
+    if trace is not None:
+        trace.add_batch(**{key: round(value, 4) if isinstance(value, float) else value
+                           for key, value in batch_stats.items()})
+
+def _trace_retry():
+    trace = current_trace()
+    if trace is not None:
+        trace.record_retry()
+
 def fetch_article_details(pmids=None, web_env=None, query_key=None, main_journals_only=True, batch_size=1000):
     """批量获取文章详细信息 - 改进版本"""
     print("🔄 正在获取文章详细信息...")
@@ -717,6 +1095,7 @@ def fetch_article_details(pmids=None, web_env=None, query_key=None, main_journal
             # 重试机制
             max_retries = 3
             retry_delay = 2
+            batch_stats = _new_batch_stats(len(batch_pmids))
             
             for retry in range(max_retries):
                 try:
@@ -727,19 +1106,25 @@ def fetch_article_details(pmids=None, web_env=None, query_key=None, main_journal
                         "id": ",".join(batch_pmids)
                     }
                     
+                    request_start = time.perf_counter()
                     # Use POST for large batches to avoid URL length limits
                     if len(batch_pmids) > 200:  # Use POST for batches larger than 200
-                        response = requests.post(fetch_url, data=fetch_params, timeout=120)
+                        response = _eutils_request("POST", fetch_url, data=fetch_params, timeout=120)
                     else:
-                        response = requests.get(fetch_url, params=fetch_params, timeout=120)
+                        response = _eutils_request("GET", fetch_url, params=fetch_params, timeout=120)
+                    batch_stats['fetch_seconds'] += time.perf_counter() - request_start
+                    batch_stats['bytes'] += len(response.content)
                     response.raise_for_status()
                     
                     if not response.content:
                         print(f"⚠️ 第 {batch_num} 批获取到空响应")
                         break
                     
+                    parse_start = time.perf_counter()
                     root = ET.fromstring(response.content)
                     batch_articles = parse_articles_from_xml(root, main_journals_only)
+                    batch_stats['parse_seconds'] += time.perf_counter() - parse_start
+                    batch_stats['articles'] = len(batch_articles)
                     all_articles.extend(batch_articles)
                     
                     print(f"✅ 第 {batch_num} 批完成，获取 {len(batch_articles)} 篇有效文章")
@@ -748,6 +1133,9 @@ def fetch_article_details(pmids=None, web_env=None, query_key=None, main_journal
                 except (requests.exceptions.SSLError, requests.exceptions.ConnectionError) as e:
                     if retry < max_retries - 1:
                         print(f"⚠️ 第 {batch_num} 批网络错误，{retry_delay}秒后重试 ({retry + 1}/{max_retries})")
+                        NCBI_RETRIES.inc(endpoint='efetch')
+                        batch_stats['retries'] += 1
+                        _trace_retry()
                         time.sleep(retry_delay)
                         retry_delay *= 2  # 指数退避
                     else:
@@ -757,9 +1145,7 @@ def fetch_article_details(pmids=None, web_env=None, query_key=None, main_journal
                     print(f"❌ 第 {batch_num} 批处理失败: {e}")
                     break
             
-            # 添加延迟以避免API限制
-            if i + batch_size < total_pmids:
-                time.sleep(2)  # 稍微增加延迟时间以适应更大的批次
+            _trace_batch(batch_stats)
     
     elif web_env and query_key:
         # 使用WebEnv/QueryKey方式
@@ -775,7 +1161,7 @@ def fetch_article_details(pmids=None, web_env=None, query_key=None, main_journal
         }
         
         try:
-            response = requests.get(fetch_url, params=fetch_params, timeout=120)
+            response = _eutils_request("GET", fetch_url, params=fetch_params, timeout=120)
             response.raise_for_status()
             
             if not response.content:
@@ -794,8 +1180,14 @@ def fetch_article_details(pmids=None, web_env=None, query_key=None, main_journal
 
 def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None, 
                                       main_journals_only=True, batch_size=1000, 
-                                      progress_callback=None):
-    """批量获取文章详细信息 - 支持进度回调"""
+                                      progress_callback=None, batch_callback=None, cancel_event=None):
+    """
+    批量获取文章详细信息 - 支持进度回调
+
+    batch_callback(batch_articles) 在每批文章解析完成后立即调用，调用方可以在全部批次
+    完成之前就开始使用已到达的结果；cancel_event被设置后，在下一批开始前、解析前或等待中
+    抛出SearchCancelled
+    """
     print("🔄 正在获取文章详细信息...")
     
     if not pmids and (not web_env or not query_key):
@@ -819,6 +1211,8 @@ def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None
             batch_num = i // batch_size + 1
             total_batches = (total_pmids + batch_size - 1) // batch_size
             
+            raise_if_cancelled(cancel_event)
+            
             # 更新进度
             if progress_callback:
                 progress_callback(i, total_pmids)
@@ -828,6 +1222,8 @@ def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None
             # 重试机制
             max_retries = 3
             retry_delay = 2
+            batch_articles = []
+            batch_stats = _new_batch_stats(len(batch_pmids))
             
             for retry in range(max_retries):
                 try:
@@ -838,28 +1234,44 @@ def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None
                         "id": ",".join(batch_pmids)
                     }
                     
+                    # 第一批决定结果页何时可用，按交互请求优先调度；之后的批次为后台批量获取
+                    priority = INTERACTIVE if batch_num == 1 else BULK
+                    request_start = time.perf_counter()
                     # Use POST for large batches to avoid URL length limits
                     if len(batch_pmids) > 200:  # Use POST for batches larger than 200
-                        response = requests.post(fetch_url, data=fetch_params, timeout=120)
+                        response = _eutils_request("POST", fetch_url, priority, data=fetch_params, timeout=120)
                     else:
-                        response = requests.get(fetch_url, params=fetch_params, timeout=120)
+                        response = _eutils_request("GET", fetch_url, priority, params=fetch_params, timeout=120)
+                    batch_stats['fetch_seconds'] += time.perf_counter() - request_start
+                    batch_stats['bytes'] += len(response.content)
                     response.raise_for_status()
                     
                     if not response.content:
                         print(f"⚠️ 第 {batch_num} 批获取到空响应")
                         break
                     
+                    raise_if_cancelled(cancel_event)
+                    parse_start = time.perf_counter()
                     root = ET.fromstring(response.content)
                     batch_articles = parse_articles_from_xml(root, main_journals_only)
+                    batch_stats['parse_seconds'] += time.perf_counter() - parse_start
+                    STAGE_SECONDS.observe(time.perf_counter() - parse_start, stage='parse')
+                    batch_stats['articles'] = len(batch_articles)
                     all_articles.extend(batch_articles)
                     
                     print(f"✅ 第 {batch_num} 批完成，获取 {len(batch_articles)} 篇有效文章")
                     break  # 成功则跳出重试循环
                     
+                except SearchCancelled:
+                    raise
+                    
                 except (requests.exceptions.SSLError, requests.exceptions.ConnectionError) as e:
                     if retry < max_retries - 1:
                         print(f"⚠️ 第 {batch_num} 批网络错误，{retry_delay}秒后重试 ({retry + 1}/{max_retries})")
-                        time.sleep(retry_delay)
+                        NCBI_RETRIES.inc(endpoint='efetch')
+                        batch_stats['retries'] += 1
+                        _trace_retry()
+                        sleep_unless_cancelled(retry_delay, cancel_event)
                         retry_delay *= 2  # 指数退避
                     else:
                         print(f"❌ 第 {batch_num} 批处理失败 (已重试{max_retries}次): {e}")
@@ -868,9 +1280,12 @@ def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None
                     print(f"❌ 第 {batch_num} 批处理失败: {e}")
                     break
             
-            # 添加延迟以避免API限制
-            if i + batch_size < total_pmids:
-                time.sleep(1)
+            _trace_batch(batch_stats)
+            
+            # 回调在重试循环之外，回调本身的异常不会被当作获取失败
+            if batch_callback and batch_articles:
+                batch_callback(batch_articles)
+            
         
         # 最终进度更新
         if progress_callback:
@@ -879,6 +1294,7 @@ def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None
     elif web_env and query_key:
         # 使用WebEnv/QueryKey方式
         print("🔄 使用WebEnv/QueryKey方式获取文章详情")
+        raise_if_cancelled(cancel_event)
         fetch_params = {
             "db": "pubmed", 
             "retmode": "xml", 
@@ -889,20 +1305,35 @@ def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None
             "retmax": "10000"  # 最大限制
         }
         
+        batch_stats = _new_batch_stats(None)
         try:
-            response = requests.get(fetch_url, params=fetch_params, timeout=120)
+            request_start = time.perf_counter()
+            response = _eutils_request("GET", fetch_url, INTERACTIVE, params=fetch_params, timeout=120)
+            batch_stats['fetch_seconds'] += time.perf_counter() - request_start
+            batch_stats['bytes'] += len(response.content)
             response.raise_for_status()
             
             if not response.content:
                 print("❌ 获取到空响应")
                 return []
             
+            raise_if_cancelled(cancel_event)
+            parse_start = time.perf_counter()
             root = ET.fromstring(response.content)
             all_articles = parse_articles_from_xml(root, main_journals_only)
+            batch_stats['parse_seconds'] += time.perf_counter() - parse_start
+            STAGE_SECONDS.observe(time.perf_counter() - parse_start, stage='parse')
+            batch_stats['articles'] = len(all_articles)
+            _trace_batch(batch_stats)
             
+        except SearchCancelled:
+            raise
         except Exception as e:
             print(f"❌ 获取文章详细信息时出错: {e}")
             return []
+        
+        if batch_callback and all_articles:
+            batch_callback(all_articles)
     
     print(f"🎉 总共成功获取并解析 {len(all_articles)} 篇文章的详细信息")
     return all_articles
@@ -910,8 +1341,9 @@ def fetch_article_details_with_progress(pmids=None, web_env=None, query_key=None
 def parse_articles_from_xml(root, main_journals_only=True):
     """从XML解析文章信息"""
     articles = []
+    article_elems = root.findall(".//PubmedArticle")
     
-    for article_elem in root.findall(".//PubmedArticle"):
+    for article_elem in article_elems:
         try:
             pmid_elem = article_elem.find(".//PMID")
             if pmid_elem is None or not pmid_elem.text: 
@@ -925,14 +1357,8 @@ def parse_articles_from_xml(root, main_journals_only=True):
             journal_name_raw = journal_title_elem.text if journal_title_elem is not None and journal_title_elem.text else "未知期刊"
             
             # 主刊过滤
-            if main_journals_only:
-                is_target_main_journal = False
-                for main_variants_list in MAIN_JOURNALS.values():
-                    if any(variant.lower() == journal_name_raw.lower() for variant in main_variants_list):
-                        is_target_main_journal = True
-                        break
-                if not is_target_main_journal: 
-                    continue
+            if main_journals_only and journal_name_raw.lower() not in _main_journal_variants():
+                continue
             
             journal_abbr_elem = article_elem.find(".//Journal/ISOAbbreviation")
             journal_abbr = journal_abbr_elem.text if journal_abbr_elem is not None and journal_abbr_elem.text else ""
@@ -1028,10 +1454,7 @@ def parse_articles_from_xml(root, main_journals_only=True):
                     break
             
             if impact_factor == 0.0 and journal_name_raw != "未知期刊":
-                for jf_key, jf_val in JOURNAL_IMPACT_FACTORS.items():
-                    if journal_name_raw.lower() == jf_key.lower():
-                         impact_factor = jf_val
-                         break
+                impact_factor = _impact_factor_index().get(journal_name_raw.lower(), 0.0)
             
             # 构建文章数据
             article_data = {
@@ -1058,6 +1481,12 @@ def parse_articles_from_xml(root, main_journals_only=True):
             print(f"❌ 解析文章PMID {pmid if 'pmid' in locals() else 'Unknown'} 时出错: {e}")
             continue
     
+    ARTICLES_FETCHED.inc(len(article_elems))
+    ARTICLES_KEPT.inc(len(articles))
+    trace = current_trace()
+    if trace is not None:
+        trace.add_funnel('fetched', len(article_elems))
+        trace.add_funnel('main_journal', len(articles))
     return articles
 
 def assign_scores_by_if(articles):
@@ -1125,52 +1554,102 @@ def filter_articles_by_type(articles, article_types=None):
     print(f"📋 按文章类型 {', '.join(specific_types)} 过滤后，保留 {len(filtered)} 篇文章")
     return filtered
 
-def save_search_to_database(search_params, articles):
-    """将搜索结果保存到数据库"""
+ARTICLE_INSERT_SQL = '''
+    INSERT OR REPLACE INTO articles 
+    (search_id, pmid, title, journal, journal_abbr, year, volume, issue, pages, 
+     doi, abstract, authors, article_types, keywords, citation, pubmed_url, 
+     impact_factor, score)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def year_or_none(value):
+    """年份（如2020、"2020"、"2020 Jan"）转为整数，空值或无法解析时返回None"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        return int(str(value)[:4]) if value else None
+    except ValueError:
+        return None
+
+def compute_summary_stats(articles):
+    """在写入时计算每次搜索的摘要统计，历史列表无需再读取文章表"""
+    if not articles:
+        return {}
+    scores = [article.get('score', 0.0) or 0.0 for article in articles]
+    years = [y for y in (year_or_none(article.get('year')) for article in articles) if y]
+    journal_counts = {}
+    for article in articles:
+        journal_counts[article['journal']] = journal_counts.get(article['journal'], 0) + 1
+    top_journals = sorted(journal_counts.items(), key=lambda item: item[1], reverse=True)[:3]
+    return {
+        'avg_score': round(sum(scores) / len(scores), 2),
+        'max_score': round(max(scores), 2),
+        'year_min': min(years) if years else None,
+        'year_max': max(years) if years else None,
+        'top_journals': top_journals
+    }
+
+def _history_values(search_params, articles):
+    """search_history中由搜索参数和结果决定的列值"""
+    min_year = year_or_none(search_params.get('min_year'))
+    max_year = year_or_none(search_params.get('max_year'))
+    if min_year is None and max_year is None:
+        min_year, max_year = _parse_year_range(search_params.get('year_range', ''))
+    return (
+        search_params.get('user_topic', ''),
+        search_params.get('ai_generated_query', ''),
+        search_params.get('final_query', ''),
+        search_params.get('journal_filter', ''),
+        search_params.get('year_range', ''),
+        search_params.get('min_score', 0.0),
+        search_params.get('article_types', '所有类型'),
+        search_params.get('total_results', 0),
+        len(articles),
+        json.dumps(search_params, ensure_ascii=False),
+        min_year,
+        max_year,
+        json.dumps(compute_summary_stats(articles), ensure_ascii=False)
+    )
+
+def _article_rows(search_id, articles, dictionary_id=None):
+    """生成articles表的插入行，大文本列按配置压缩"""
+    for article in articles:
+        yield (
+            search_id, article['pmid'], article['title'], article['journal'],
+            article.get('journal_abbr', ''), article['year'], article.get('volume', ''),
+            article.get('issue', ''), article.get('pages', ''), article.get('doi', ''),
+            compress_text(article['abstract'], DB_COMPRESSION, dictionary_id),
+            compress_text(json.dumps(article['authors'], ensure_ascii=False), DB_COMPRESSION, dictionary_id),
+            json.dumps(article.get('article_types', []), ensure_ascii=False),
+            json.dumps(article.get('keywords', []), ensure_ascii=False),
+            compress_text(article['citation'], DB_COMPRESSION, dictionary_id), article['pubmed_url'],
+            article.get('impact_factor', 0.0), article.get('score', 0.0)
+        )
+
+def save_search_to_database(search_params, articles, trace=None):
+    """将搜索结果保存到数据库，trace为本次搜索的SearchTrace（可选）"""
+    try:
+        start = time.perf_counter()
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # 插入搜索历史
         cursor.execute('''
             INSERT INTO search_history
             (search_date, user_topic, ai_generated_query, final_query, journal_filter,
-             year_range, min_score, article_types, total_results, filtered_results, search_parameters)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            search_params.get('user_topic', ''),
-            search_params.get('ai_generated_query', ''),
-            search_params.get('final_query', ''),
-            search_params.get('journal_filter', ''),
-            search_params.get('year_range', ''),
-            search_params.get('min_score', 0.0),
-            search_params.get('article_types', '所有类型'),
-            search_params.get('total_results', 0),
-            len(articles),
-            json.dumps(search_params, ensure_ascii=False)
-        ))
+             year_range, min_score, article_types, total_results, filtered_results, search_parameters,
+             min_year, max_year, summary_stats)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),) + _history_values(search_params, articles))
         
         search_id = cursor.lastrowid
+        dictionary_id = get_active_dictionary_id(cursor) if DB_COMPRESSION == "zlib_dict" else None
         
         # 插入文章详情
-        for article in articles:
-            cursor.execute('''
-                INSERT OR REPLACE INTO articles 
-                (search_id, pmid, title, journal, journal_abbr, year, volume, issue, pages, 
-                 doi, abstract, authors, article_types, keywords, citation, pubmed_url, 
-                 impact_factor, score)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                search_id, article['pmid'], article['title'], article['journal'],
-                article.get('journal_abbr', ''), article['year'], article.get('volume', ''),
-                article.get('issue', ''), article.get('pages', ''), article.get('doi', ''),
-                article['abstract'], json.dumps(article['authors'], ensure_ascii=False),
-                json.dumps(article.get('article_types', []), ensure_ascii=False),
-                json.dumps(article.get('keywords', []), ensure_ascii=False),
-                article['citation'], article['pubmed_url'],
-                article.get('impact_factor', 0.0), article.get('score', 0.0)
-            ))
+        cursor.executemany(ARTICLE_INSERT_SQL, _article_rows(search_id, articles, dictionary_id))
+        
+        if trace is not None:
+            trace.add_span('db_save', start, time.perf_counter() - start)
+            cursor.execute('UPDATE search_history SET trace = ? WHERE id = ?',
+                           (json.dumps(trace.to_dict(), ensure_ascii=False), search_id))
         
         conn.commit()
         conn.close()
@@ -1181,44 +1660,235 @@ def save_search_to_database(search_params, articles):
         print(f"❌ 保存到数据库失败: {e}")
         return None
 
-def get_search_history(limit=20):
-    """获取搜索历史"""
+def reserve_search_id(search_params):
+    """
+    搜索开始时预留一条search_history记录
+
+    记录状态为pending，结果写入后（write_search_results）才会出现在历史列表中。
+
+    Returns:
+        int: 预留的搜索ID
+    """
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, search_date, user_topic, final_query, journal_filter, 
-                   year_range, filtered_results, total_results
-            FROM search_history 
-            ORDER BY created_at DESC 
-            LIMIT ?
-        ''', (limit,))
-        
-        history = []
-        for row in cursor.fetchall():
-            history.append({
-                'id': row[0],
-                'search_date': row[1],
-                'user_topic': row[2],
-                'final_query': row[3],
-                'journal_filter': row[4],
-                'year_range': row[5],
-                'filtered_results': row[6],
-                'total_results': row[7]
-            })
-        
+        cursor = conn.execute('''
+            INSERT INTO search_history
+            (search_date, user_topic, ai_generated_query, final_query, journal_filter,
+             year_range, min_score, article_types, total_results, filtered_results, search_parameters,
+             min_year, max_year, summary_stats, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),) + _history_values(search_params, []))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def release_search_id(search_id):
+    """搜索失败时删除尚未写入结果的预留记录"""
+    try:
+        conn = get_db_connection()
+        conn.execute("DELETE FROM search_history WHERE id = ? AND status = 'pending'", (search_id,))
+        conn.commit()
         conn.close()
-        return history
-        
     except Exception as e:
-        print(f"❌ 获取搜索历史失败: {e}")
-        return []
+        print(f"❌ 删除预留搜索记录失败 (搜索ID: {search_id}): {e}")
+
+def write_search_results(conn, jobs):
+    """
+    在同一个事务中写入多个搜索的结果（组提交）
+
+    Args:
+        conn: 数据库连接，由调用方负责重试和关闭
+        jobs: [(search_id, search_params, articles), ...]，search_id来自reserve_search_id
+    """
+    cursor = conn.cursor()
+    dictionary_id = get_active_dictionary_id(cursor) if DB_COMPRESSION == "zlib_dict" else None
+    try:
+        for search_id, search_params, articles in jobs:
+            cursor.execute('''
+                UPDATE search_history SET
+                    user_topic = ?, ai_generated_query = ?, final_query = ?, journal_filter = ?,
+                    year_range = ?, min_score = ?, article_types = ?, total_results = ?,
+                    filtered_results = ?, search_parameters = ?, min_year = ?, max_year = ?,
+                    summary_stats = ?, status = 'saved',
+                    write_version = write_version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', _history_values(search_params, articles) + (search_id,))
+            cursor.executemany(ARTICLE_INSERT_SQL, _article_rows(search_id, articles, dictionary_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def save_search_traces(conn, traces):
+    """
+    写入搜索的执行记录
+
+    Args:
+        traces: [(search_id, trace_dict), ...]
+    """
+    try:
+        conn.executemany('UPDATE search_history SET trace = ? WHERE id = ?',
+                         [(json.dumps(trace, ensure_ascii=False), search_id) for search_id, trace in traces])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def get_search_trace(search_id):
+    """
+    读取某次搜索的执行记录
+
+    Returns:
+        dict | None: 搜索不存在返回None；没有记录（旧搜索）时返回{}
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT trace FROM search_history WHERE id = ? AND status = 'saved'",
+                           (search_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return json.loads(row[0]) if row[0] else {}
+
+HISTORY_PAGE_MAX = 100
+
+def _encode_history_cursor(created_at, search_id):
+    raw = json.dumps([created_at, search_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_history_cursor(cursor_token):
+    padded = cursor_token + '=' * (-len(cursor_token) % 4)
+    try:
+        created_at, search_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return created_at, int(search_id)
+    except (ValueError, TypeError):
+        raise ValueError("无效的分页游标") from None
+
+def _history_text_condition(conn, text):
+    """主题/查询文本筛选：3个字符以上的词走FTS索引，更短的词（如两字中文词）退回LIKE"""
+    has_fts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'search_history_fts'"
+    ).fetchone() is not None
+    conditions, params = [], []
+    fts_terms = []
+    for term in text.split():
+        if has_fts and len(term) >= 3:
+            fts_terms.append('"' + term.replace('"', '""') + '"')
+        else:
+            conditions.append("(user_topic LIKE ? OR final_query LIKE ?)")
+            params.extend([f"%{term}%", f"%{term}%"])
+    if fts_terms:
+        conditions.append("id IN (SELECT rowid FROM search_history_fts WHERE search_history_fts MATCH ?)")
+        params.append(" AND ".join(fts_terms))
+    return conditions, params
+
+def get_search_history_page(limit=20, cursor=None, text=None, min_year=None, max_year=None,
+                            min_results=None, max_results=None):
+    """
+    分页获取搜索历史（按创建时间倒序，基于 (created_at, id) 的游标分页）
+
+    Args:
+        cursor: 上一页返回的next_cursor，为空时从最新记录开始
+        text: 主题/查询中包含的文本，多个词之间为AND
+        min_year, max_year: 与搜索年份范围有交集
+        min_results, max_results: 筛选后结果数范围
+
+    Returns:
+        dict: {"items": [...], "next_cursor": str或None}
+
+    Raises:
+        ValueError: cursor无效；数据库错误同样向上抛出，由调用方记录并返回错误
+    """
+    limit = max(1, min(int(limit), HISTORY_PAGE_MAX))
+    conditions = ["status = 'saved'"]
+    params = []
+
+    conn = get_db_connection()
+    try:
+        if cursor:
+            created_at, last_id = _decode_history_cursor(cursor)
+            conditions.append("(created_at, id) < (?, ?)")
+            params.extend([created_at, last_id])
+        if text and text.strip():
+            text_conditions, text_params = _history_text_condition(conn, text.strip())
+            conditions.extend(text_conditions)
+            params.extend(text_params)
+        if min_year:
+            conditions.append("(max_year IS NULL OR max_year >= ?)")
+            params.append(int(min_year))
+        if max_year:
+            conditions.append("(min_year IS NULL OR min_year <= ?)")
+            params.append(int(max_year))
+        if min_results not in (None, ''):
+            conditions.append("filtered_results >= ?")
+            params.append(int(min_results))
+        if max_results not in (None, ''):
+            conditions.append("filtered_results <= ?")
+            params.append(int(max_results))
+        
+        rows = conn.execute(f'''
+            SELECT id, search_date, user_topic, final_query, journal_filter,
+                   year_range, filtered_results, total_results, summary_stats, created_at
+            FROM search_history
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+    finally:
+        conn.close()
+
+    history = []
+    for row in rows[:limit]:
+        history.append({
+            'id': row[0],
+            'search_date': row[1],
+            'user_topic': row[2],
+            'final_query': row[3],
+            'journal_filter': row[4],
+            'year_range': row[5],
+            'filtered_results': row[6],
+            'total_results': row[7],
+            'summary_stats': json.loads(row[8]) if row[8] else {}
+        })
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_history_cursor(last[9], last[0])
+    return {'items': history, 'next_cursor': next_cursor}
+
+def get_search_history(limit=20):
+    """获取最近的搜索历史"""
+    return get_search_history_page(limit=limit)['items']
+
+def _article_from_row(row):
+    """articles表的一行（SELECT *）转为文章dict，摘要、作者、引用由LazyArticle在读取时才解压"""
+    return LazyArticle({
+        'pmid': row[2],
+        'title': row[3],
+        'journal': row[4],
+        'journal_abbr': row[5],
+        'year': row[6],
+        'volume': row[7],
+        'issue': row[8],
+        'pages': row[9],
+        'doi': row[10],
+        'abstract': row[11],
+        'authors': row[12] if row[12] else [],
+        'article_types': json.loads(row[13]) if row[13] else [],
+        'keywords': json.loads(row[14]) if row[14] else [],
+        'citation': row[15],
+        'pubmed_url': row[16],
+        'impact_factor': row[17],
+        'score': row[18]
+    })
 
 def get_search_by_id(search_id):
     """根据ID获取搜索结果"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # 获取搜索信息
@@ -1235,28 +1905,7 @@ def get_search_by_id(search_id):
             SELECT * FROM articles WHERE search_id = ? ORDER BY score DESC
         ''', (search_id,))
         
-        articles = []
-        for row in cursor.fetchall():
-            article = {
-                'pmid': row[2],
-                'title': row[3],
-                'journal': row[4],
-                'journal_abbr': row[5],
-                'year': row[6],
-                'volume': row[7],
-                'issue': row[8],
-                'pages': row[9],
-                'doi': row[10],
-                'abstract': row[11],
-                'authors': json.loads(row[12]) if row[12] else [],
-                'article_types': json.loads(row[13]) if row[13] else [],
-                'keywords': json.loads(row[14]) if row[14] else [],
-                'citation': row[15],
-                'pubmed_url': row[16],
-                'impact_factor': row[17],
-                'score': row[18]
-            }
-            articles.append(article)
+        articles = [_article_from_row(row) for row in cursor.fetchall()]
         
         conn.close()
         
@@ -1269,6 +1918,238 @@ def get_search_by_id(search_id):
         print(f"❌ 获取搜索结果失败: {e}")
         return None
 
+def get_search_info(search_id):
+    """只读取search_history中的一行，不存在时返回None"""
+    conn = get_db_connection()
+    try:
+        return conn.execute('SELECT * FROM search_history WHERE id = ?', (search_id,)).fetchone()
+    finally:
+        conn.close()
+
+def iter_search_articles(search_id, batch_size=500):
+    """
+    按评分降序逐批读取某次搜索的文章（生成器），内存中最多保留一批
+
+    用于导出等需要遍历全部文章但不需要一次性载入的场景
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            'SELECT * FROM articles WHERE search_id = ? ORDER BY score DESC', (search_id,)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _article_from_row(row)
+    finally:
+        conn.close()
+
+def iter_articles_for_searches(search_ids, batch_size=500):
+    """
+    一次游标遍历多次搜索的文章，按搜索ID分组、组内按评分降序
+
+    Yields:
+        (search_id, article)，内存中最多保留一批行
+    """
+    if not search_ids:
+        return
+    placeholders = ",".join("?" * len(search_ids))
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            f'SELECT * FROM articles WHERE search_id IN ({placeholders}) ORDER BY search_id, score DESC',
+            list(search_ids)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row[1], _article_from_row(row)
+    finally:
+        conn.close()
+
+def get_search_versions(search_ids):
+    """
+    读取搜索的写入版本，用于HTTP缓存校验
+
+    Returns:
+        {id: (write_version, 最后修改时间 'YYYY-MM-DD HH:MM:SS' UTC)}，只包含已保存的搜索
+    """
+    if not search_ids:
+        return {}
+    placeholders = ",".join("?" * len(search_ids))
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(f'''
+            SELECT id, write_version, COALESCE(updated_at, created_at) FROM search_history
+            WHERE id IN ({placeholders}) AND status = 'saved'
+        ''', list(search_ids)).fetchall()
+    finally:
+        conn.close()
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+def get_search_infos(search_ids):
+    """批量读取search_history行，返回 {id: row}"""
+    if not search_ids:
+        return {}
+    placeholders = ",".join("?" * len(search_ids))
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            f'SELECT * FROM search_history WHERE id IN ({placeholders})', list(search_ids)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row[0]: row for row in rows}
+
+# 文献管理软件格式导出需要的列（不含引用格式等不需要的大字段）
+REFERENCE_COLUMNS = ('pmid', 'title', 'journal', 'journal_abbr', 'year', 'volume', 'issue', 'pages',
+                     'doi', 'abstract', 'authors', 'keywords', 'pubmed_url')
+
+def iter_search_article_rows(search_id, columns=REFERENCE_COLUMNS, batch_size=1000):
+    """
+    按评分降序逐批产出articles表的原始行（sqlite3.Row），不构建文章dict
+
+    压缩列保持原值，由使用方按需解码（见exporters.py）
+    """
+    conn = get_db_connection()
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.execute(
+            f'SELECT {", ".join(columns)} FROM articles WHERE search_id = ? ORDER BY score DESC', (search_id,)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def _load_compression_dictionary(dictionary_id):
+    """从数据库加载共享压缩字典"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            'SELECT content FROM compression_dictionaries WHERE id = ?', (dictionary_id,)
+        ).fetchone()
+        return bytes(row[0]) if row else None
+    finally:
+        conn.close()
+
+set_dictionary_loader(_load_compression_dictionary)
+
+def get_active_dictionary_id(cursor):
+    """获取最新训练的压缩字典ID，没有字典时返回None"""
+    row = cursor.execute('SELECT MAX(id) FROM compression_dictionaries').fetchone()
+    return row[0] if row else None
+
+def train_compression_dictionary(sample_size=2000):
+    """
+    用数据库中已保存的摘要训练共享压缩字典
+
+    Returns:
+        int: 新字典的ID，样本不足时返回None
+    """
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            'SELECT abstract FROM articles ORDER BY id DESC LIMIT ?', (sample_size,)
+        ).fetchall()
+        samples = [decompress_text(row[0]) for row in rows if row[0]]
+        if len(samples) < 10:
+            print("⚠️ 摘要样本不足，无法训练压缩字典")
+            return None
+        
+        dictionary = build_dictionary(samples)
+        cursor = conn.execute(
+            'INSERT INTO compression_dictionaries (content, sample_count) VALUES (?, ?)',
+            (dictionary, len(samples))
+        )
+        conn.commit()
+        print(f"✅ 压缩字典训练完成 (ID: {cursor.lastrowid}, {len(dictionary)} 字节, {len(samples)} 条样本)")
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def recompress_articles(mode=None, batch_size=500):
+    """按当前压缩设置重写已有文章的大文本列，分批提交"""
+    mode = DB_COMPRESSION if mode is None else mode
+    conn = get_db_connection()
+    try:
+        dictionary_id = get_active_dictionary_id(conn.cursor()) if mode == "zlib_dict" else None
+        last_id = 0
+        updated = 0
+        while True:
+            rows = conn.execute(
+                'SELECT id, abstract, authors, citation FROM articles WHERE id > ? ORDER BY id LIMIT ?',
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany(
+                'UPDATE articles SET abstract = ?, authors = ?, citation = ? WHERE id = ?',
+                [
+                    (
+                        compress_text(decompress_text(abstract), mode, dictionary_id),
+                        compress_text(decompress_text(authors), mode, dictionary_id),
+                        compress_text(decompress_text(citation), mode, dictionary_id),
+                        row_id
+                    )
+                    for row_id, abstract, authors, citation in rows
+                ]
+            )
+            conn.commit()
+            last_id = rows[-1][0]
+            updated += len(rows)
+        print(f"✅ 已按 '{mode or '不压缩'}' 模式重写 {updated} 篇文章")
+        return updated
+    finally:
+        conn.close()
+
+def compression_report(sample_size=1000):
+    """
+    统计各压缩模式在已保存文章上的体积和读写耗时
+
+    Returns:
+        dict: {模式: {"bytes": 字节数, "ratio": 压缩比, "write_ms": 编码耗时, "read_ms": 解码耗时}}
+    """
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            'SELECT abstract, authors, citation FROM articles ORDER BY id DESC LIMIT ?', (sample_size,)
+        ).fetchall()
+        dictionary_id = get_active_dictionary_id(conn.cursor())
+    finally:
+        conn.close()
+    
+    texts = [decompress_text(value) or "" for row in rows for value in row]
+    raw_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    report = {"samples": len(rows), "raw_bytes": raw_bytes, "modes": {}}
+    
+    modes = ["zlib"] + (["zlib_dict"] if dictionary_id else [])
+    for mode in modes:
+        start = time.perf_counter()
+        encoded = [compress_text(text, mode, dictionary_id) for text in texts]
+        write_ms = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        for value in encoded:
+            decompress_text(value)
+        read_ms = (time.perf_counter() - start) * 1000
+        
+        stored_bytes = sum(len(v) if isinstance(v, bytes) else len(v.encode("utf-8")) for v in encoded)
+        report["modes"][mode] = {
+            "bytes": stored_bytes,
+            "ratio": round(stored_bytes / raw_bytes, 3) if raw_bytes else 1.0,
+            "write_ms": round(write_ms, 2),
+            "read_ms": round(read_ms, 2)
+        }
+    return report
+
 def display_articles_paginated(articles, page_size=50):
     """分页显示文章（命令行版本）"""
     if not articles:
@@ -1430,6 +2311,31 @@ def save_to_json(articles, filename, query, journal_query_info, year_range):
         print(f"❌ 保存JSON文件时出错: {e}")
         return False
 
+def save_to_ris(articles, filename):
+    """保存结果为RIS格式（EndNote/Zotero/Mendeley）"""
+    return _save_reference_file('ris', articles, filename)
+
+def save_to_bibtex(articles, filename):
+    """保存结果为BibTeX格式"""
+    return _save_reference_file('bibtex', articles, filename)
+
+def save_to_csl_json(articles, filename):
+    """保存结果为CSL-JSON格式"""
+    return _save_reference_file('csl', articles, filename)
+
+def _save_reference_file(format, articles, filename):
+    if not articles: 
+        print("❌ 没有文章可以保存")
+        return False
+    
+    try:
+        write_export_file(format, articles, filename)
+        print(f"✅ 结果已保存到 {filename}")
+        return True
+    except Exception as e: 
+        print(f"❌ 保存{format}文件时出错: {e}")
+        return False
+
 # 主搜索函数（命令行版本）
 def search_and_filter_pubmed():
     """
@@ -1514,42 +2420,51 @@ def search_and_filter_pubmed():
     print("\n🔍 将严格筛选预定义的主刊文章。")
     journal_query_display = journal_input if journal_input else "所有预定义主刊"
 
-    # 开始搜索
-    print("\n🚀 开始搜索...")
-    search_session = search_pubmed(query, journal_input, min_year, max_year, main_journals_only_flag)
+    # 开始搜索，整个搜索过程记录执行记录（SEARCH_PROFILE可开启cProfile/tracemalloc）
+    trace = SearchTrace('cli', profile_mode())
+    with trace.activate():
+        trace.start_profiling()
+        print("\n🚀 开始搜索...")
+        with trace.span('esearch'):
+            search_session = search_pubmed(query, journal_input, min_year, max_year, main_journals_only_flag)
     
-    if not search_session["pmids"] and not (search_session["web_env"] and search_session["query_key"]):
-        print("❌ 初步搜索未返回任何PMID或有效的搜索会话。请尝试放宽搜索条件。")
-        return
+        if not search_session["pmids"] and not (search_session["web_env"] and search_session["query_key"]):
+            print("❌ 初步搜索未返回任何PMID或有效的搜索会话。请尝试放宽搜索条件。")
+            return
 
-    total_found = search_session.get("total_count", 0)
-    print(f"📊 搜索完成！找到 {total_found} 篇相关文章")
+        total_found = search_session.get("total_count", 0)
+        trace.set_funnel('found', total_found)
+        print(f"📊 搜索完成！找到 {total_found} 篇相关文章")
     
-    if total_found == 0:
-        print("❌ 未找到任何文章，请尝试其他搜索条件。")
-        return
+        if total_found == 0:
+            print("❌ 未找到任何文章，请尝试其他搜索条件。")
+            return
 
-    # 获取文章详情
-    articles_detailed = fetch_article_details(
-        pmids=search_session.get("pmids"), 
-        web_env=search_session.get("web_env"),
-        query_key=search_session.get("query_key"), 
-        main_journals_only=main_journals_only_flag
-    )
+        # 获取文章详情
+        with trace.span('fetch'):
+            articles_detailed = fetch_article_details(
+                pmids=search_session.get("pmids"), 
+                web_env=search_session.get("web_env"),
+                query_key=search_session.get("query_key"), 
+                main_journals_only=main_journals_only_flag
+            )
     
-    if not articles_detailed:
-        print("❌ 未能获取到任何符合主刊条件的文章详细信息。")
-        return
+        if not articles_detailed:
+            print("❌ 未能获取到任何符合主刊条件的文章详细信息。")
+            return
 
-    print(f"✅ 成功获取 {len(articles_detailed)} 篇主刊文章的详细信息")
+        print(f"✅ 成功获取 {len(articles_detailed)} 篇主刊文章的详细信息")
 
-    # 评分和过滤
-    scored_articles = assign_scores_by_if(articles_detailed)
-    final_articles = filter_articles(scored_articles, min_score)
+        # 评分和过滤（命令行没有文章类型过滤，两级漏斗数量相同）
+        with trace.span('rank'):
+            scored_articles = assign_scores_by_if(articles_detailed)
+            final_articles = filter_articles(scored_articles, min_score)
+        trace.set_funnel('score_filtered', len(final_articles))
+        trace.set_funnel('type_filtered', len(final_articles))
     
-    if not final_articles:
-        print("❌ 经过所有筛选后，没有文章可供显示。")
-        return
+        if not final_articles:
+            print("❌ 经过所有筛选后，没有文章可供显示。")
+            return
 
     # 保存搜索参数用于数据库存储
     search_params = {
@@ -1558,12 +2473,14 @@ def search_and_filter_pubmed():
         'final_query': query,
         'journal_filter': journal_query_display,
         'year_range': year_range_str,
+        'min_year': min_year,
+        'max_year': max_year,
         'min_score': min_score,
         'total_results': total_found
     }
 
     # 保存到数据库
-    search_id = save_search_to_database(search_params, final_articles)
+    search_id = save_search_to_database(search_params, final_articles, trace)
 
     # 分页显示文章
     display_articles_paginated(final_articles, page_size=50)
@@ -1571,6 +2488,7 @@ def search_and_filter_pubmed():
     # 保存文件选项
     print("\n💾 请选择保存格式:")
     print("1. Markdown (.md)  2. JSON (.json)  3. 纯文本 (.txt)  4. Markdown和JSON  5. 不保存")
+    print("6. RIS (.ris)  7. BibTeX (.bib)  8. CSL-JSON (.csl.json)")
     save_choice = input("请选择 (默认1): ") or "1"
     
     results_dir = "pubmed_results"
@@ -1588,6 +2506,15 @@ def search_and_filter_pubmed():
         json_file = os.path.join(results_dir, f"{base_filename}.json")
         save_to_json(final_articles, json_file, query, journal_query_display, year_range_str)
     
+    if save_choice == "6":
+        save_to_ris(final_articles, os.path.join(results_dir, f"{base_filename}.ris"))
+    
+    if save_choice == "7":
+        save_to_bibtex(final_articles, os.path.join(results_dir, f"{base_filename}.bib"))
+    
+    if save_choice == "8":
+        save_to_csl_json(final_articles, os.path.join(results_dir, f"{base_filename}.csl.json"))
+    
     if save_choice == "3":
         txt_file = os.path.join(results_dir, f"{base_filename}.txt")
         try:
@@ -1622,13 +2549,14 @@ def search_and_filter_pubmed():
 def show_search_history():
     """显示搜索历史"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT id, search_date, user_topic, final_query, journal_filter, 
                    year_range, filtered_results 
             FROM search_history 
+            WHERE status = 'saved'
             ORDER BY created_at DESC 
             LIMIT 10
         ''')
@@ -0,0 +1,256 @@
+# query_cache.py
+# AI生成查询的持久缓存：按规范化后的主题、模型和提示词版本缓存，相同或仅有细微差别的主题不再调用OpenRouter
+
+import hashlib
+import os
+import queue
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+try:
+    from .job_store import JOB_STATE_DB_PATH, SQLiteStore
+    from .metrics import CACHE_REQUESTS
+    from .pubmed_search_core import AI_QUERY_MODEL, AI_QUERY_PROMPT_VERSION
+except ImportError:
+    from job_store import JOB_STATE_DB_PATH, SQLiteStore
+    from metrics import CACHE_REQUESTS
+    from pubmed_search_core import AI_QUERY_MODEL, AI_QUERY_PROMPT_VERSION
+
+AI_QUERY_CACHE_TTL_SECONDS = int(os.environ.get("AI_QUERY_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+AI_QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("AI_QUERY_CACHE_MAX_ENTRIES", "5000"))
+AI_QUERY_BUDGET_SECONDS = float(os.environ.get("AI_QUERY_BUDGET_SECONDS", "6"))     # 请求最多等待AI这么久，之后先返回fallback查询
+AI_QUERY_MAX_WORKERS = int(os.environ.get("AI_QUERY_MAX_WORKERS", "4"))             # 每个进程同时进行的AI生成数
+AI_QUERY_FAILURE_TTL_SECONDS = 300     # 后台生成失败的记录保留时间，供页面轮询时得知结果
+
+
+def normalize_topic(topic):
+    """
+    缓存键使用的主题文本：全角/半角统一、忽略大小写，标点视为空白，连续空白合并
+
+    "Telomere length & aging." 与 "telomere length aging" 得到同一个键
+    """
+    text = unicodedata.normalize('NFKC', topic or '').casefold()
+    text = ''.join(' ' if unicodedata.category(char).startswith('P') else char for char in text)
+    return ' '.join(text.split())
+
+
+class AIQueryCache(SQLiteStore):
+    """
+    AI查询缓存，所有worker共用，重启后仍然有效
+
+    条目超过ttl_seconds后不再命中；条目数超过max_entries时淘汰最久未使用的。
+    只缓存AI成功生成的查询，fallback查询不缓存。
+    """
+
+    def __init__(self, path=JOB_STATE_DB_PATH, ttl_seconds=AI_QUERY_CACHE_TTL_SECONDS,
+                 max_entries=AI_QUERY_CACHE_MAX_ENTRIES):
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def _init_schema(self, conn):
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ai_query_cache (
+                cache_key TEXT PRIMARY KEY,
+                topic TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                query TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_query_cache_used ON ai_query_cache(last_used_at)')
+
+    @staticmethod
+    def cache_key(topic, model=AI_QUERY_MODEL, prompt_version=AI_QUERY_PROMPT_VERSION):
+        raw = f'{model}\n{prompt_version}\n{normalize_topic(topic)}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, topic, model=AI_QUERY_MODEL, prompt_version=AI_QUERY_PROMPT_VERSION, record=True):
+        """返回缓存的查询，没有或已过期时返回None；record=False时不计入命中率指标（轮询）"""
+        key = self.cache_key(topic, model, prompt_version)
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute('SELECT query FROM ai_query_cache WHERE cache_key = ? AND created_at > ?',
+                           (key, now - self.ttl_seconds)).fetchone()
+        if record:
+            CACHE_REQUESTS.inc(cache='ai_query', result='miss' if row is None else 'hit')
+        if row is None:
+            return None
+        conn.execute('UPDATE ai_query_cache SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?', (now, key))
+        return row[0]
+
+    def put(self, topic, query, model=AI_QUERY_MODEL, prompt_version=AI_QUERY_PROMPT_VERSION):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO ai_query_cache '
+                '(cache_key, topic, model, prompt_version, query, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.cache_key(topic, model, prompt_version), topic, model, prompt_version, query, now, now)
+            )
+            conn.execute('DELETE FROM ai_query_cache WHERE created_at <= ?', (now - self.ttl_seconds,))
+            conn.execute('''
+                DELETE FROM ai_query_cache WHERE cache_key IN (
+                    SELECT cache_key FROM ai_query_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def clear(self):
+        self._connect().execute('DELETE FROM ai_query_cache')
+
+
+class BackgroundQueryGenerator:
+    """
+    有时间预算的AI查询生成
+
+    generate()最多等待budget秒；AI在预算内未返回时调用方先使用fallback查询，
+    生成在后台线程中继续，完成后写入缓存，页面通过status()轮询取得结果（任一worker均可读到缓存）。
+    同一主题同时只有一个生成在进行，重复请求等待同一个结果。
+
+    Args:
+        cache: AIQueryCache
+        generate_func: generate_func(topic)，返回查询字符串，失败返回None
+        stream_func: stream_func(topic)，逐段产出查询文本的生成器，失败时抛出异常（流式生成）
+    """
+
+    def __init__(self, cache, generate_func, stream_func=None, budget_seconds=AI_QUERY_BUDGET_SECONDS,
+                 max_workers=AI_QUERY_MAX_WORKERS):
+        self.cache = cache
+        self.generate_func = generate_func
+        self.stream_func = stream_func
+        self.budget_seconds = budget_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-query")
+        self._lock = threading.Lock()
+        self._inflight = {}      # cache_key -> Future
+        self._failed = {}        # cache_key -> 失败时间
+
+    def generate(self, topic, budget_seconds=None):
+        """
+        Returns:
+            (query, status): status为 'cached' / 'generated'（预算内完成）/ 'pending'（后台继续，query为None）/
+            'failed'（AI失败，query为None）
+        """
+        query = self.cache.get(topic)
+        if query:
+            return query, 'cached'
+        future = self._submit(topic)
+        budget = self.budget_seconds if budget_seconds is None else budget_seconds
+        try:
+            query = future.result(timeout=budget)
+        except FutureTimeout:
+            return None, 'pending'
+        except Exception as e:
+            print(f"❌ AI查询生成出错: {e}")
+            return None, 'failed'
+        return (query, 'generated') if query else (None, 'failed')
+
+    def stream(self, topic):
+        """
+        开始（或加入）一个主题的生成，返回事件队列
+
+        队列中依次出现 ('token', 文本)...，最后是 ('done', 完整查询) 或 ('error', 信息)。
+        同一主题已有生成在进行时不会再调用AI，只在其完成时收到done/error。
+        调用方断开后生成仍会完成并写入缓存。
+        """
+        events = queue.Queue()
+        key = self.cache.cache_key(topic)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                self._failed.pop(key, None)
+                future = self._inflight[key] = self._executor.submit(self._run_stream, key, topic, events)
+                return events
+
+        def relay(done_future):
+            try:
+                query = done_future.result()
+            except Exception as e:
+                events.put(('error', str(e)))
+                return
+            events.put(('done', query) if query else ('error', 'AI未能生成查询'))
+
+        future.add_done_callback(relay)
+        return events
+
+    def status(self, topic):
+        """
+        后台生成的状态
+
+        Returns:
+            (query, status): 'done' / 'pending' / 'failed' / 'unknown'（本进程没有这个生成，
+            可能在其他worker上进行，调用方继续轮询直到自己的超时）
+        """
+        query = self.cache.get(topic, record=False)
+        if query:
+            return query, 'done'
+        key = self.cache.cache_key(topic)
+        with self._lock:
+            self._forget_failures_locked()
+            if key in self._inflight:
+                return None, 'pending'
+            if key in self._failed:
+                return None, 'failed'
+        return None, 'unknown'
+
+    def _submit(self, topic):
+        key = self.cache.cache_key(topic)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                self._failed.pop(key, None)
+                future = self._inflight[key] = self._executor.submit(self._run, key, topic)
+            return future
+
+    def _run(self, key, topic):
+        query = None
+        try:
+            query = self.generate_func(topic)
+            if query:
+                self.cache.put(topic, query)
+            return query
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if not query:
+                    self._failed[key] = time.monotonic()
+
+    def _run_stream(self, key, topic, events):
+        parts = []
+        query = None
+        try:
+            for text in self.stream_func(topic):
+                parts.append(text)
+                events.put(('token', text))
+            query = ''.join(parts)
+            if query:
+                self.cache.put(topic, query)
+                events.put(('done', query))
+            else:
+                events.put(('error', 'AI未能生成查询'))
+            return query
+        except Exception as e:
+            print(f"❌ AI查询流式生成出错: {e}")
+            events.put(('error', str(e)))
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if not query:
+                    self._failed[key] = time.monotonic()
+
+    def _forget_failures_locked(self):
+        expired = time.monotonic() - AI_QUERY_FAILURE_TTL_SECONDS
+        for key, failed_at in list(self._failed.items()):
+            if failed_at < expired:
+                del self._failed[key]
@@ -0,0 +1,316 @@
+# query_parser.py
+# PubMed布尔查询解析：构建语法树，用于规范化（缓存键）、计算编码后长度，
+# 以及把过长查询中的OR分组拆成多个较小的子查询（各子查询结果的并集与原查询完全相同）
+
+import re
+from urllib.parse import quote_plus
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# 同一字段的不同写法（仅用于规范化，发送给PubMed的查询保留原写法）
+FIELD_ALIASES = {
+    'title/abstract': 'tiab',
+    'mesh terms': 'mh',
+    'mesh': 'mh',
+    'title': 'ti',
+    'author': 'au',
+    'journal': 'ta',
+    'publication type': 'pt',
+    'publication date': 'dp',
+    'pdat': 'dp',
+    'language': 'la',
+    'all fields': 'all',
+}
+
+_TOKEN_RE = re.compile(r'\s*(?:(?P<lparen>\()|(?P<rparen>\))|(?P<phrase>"[^"]*")|(?P<tag>\[[^\]]*\])|(?P<word>[^\s()"\[\]]+))')
+
+
+class QuerySyntaxError(ValueError):
+    """查询括号或引号不匹配、运算符缺少操作数等"""
+
+
+class Term:
+    """
+    检索词：一个或多个相邻的单词/带引号短语（原样保留），可带字段标签
+
+    相邻的无运算符单词保持为一个检索词（"telomere length"由PubMed自动映射处理），
+    这样序列化后与原查询完全相同。
+    """
+    __slots__ = ('text', 'field')
+
+    def __init__(self, text, field=None):
+        self.text = text
+        self.field = field
+
+    def __repr__(self):
+        return f'Term({self.text!r}, {self.field!r})'
+
+
+class RangeTerm(Term):
+    """
+    范围检索词：term[tag] : term[tag]（如 "2020/01/01"[Date - Publication] : "3000"[Date - Publication]），
+    高级检索和AI生成的查询常用这种写法。整体按原文保留（包括只括住范围的括号），不能在冒号处拆开
+    """
+    __slots__ = ()
+
+    def __init__(self, text):
+        super().__init__(text)
+
+    def __repr__(self):
+        return f'RangeTerm({self.text!r})'
+
+
+class Group:
+    """
+    运算符节点：AND/OR 有两个或更多子节点（满足结合律，已展平）；NOT 恰好两个子节点（左 NOT 右）
+    """
+    __slots__ = ('op', 'children')
+
+    def __init__(self, op, children):
+        self.op = op
+        self.children = children
+
+    def __repr__(self):
+        return f'Group({self.op!r}, {self.children!r})'
+
+
+def _tokenize(query):
+    """返回 (tokens, spans)：tokens为 (类型, 值)，spans为各token在query中的 (起, 止) 位置"""
+    tokens = []
+    spans = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = _TOKEN_RE.match(query, position)
+        if match is None:
+            rest = query[position:].lstrip()
+            if rest.startswith('"'):
+                raise QuerySyntaxError("引号不匹配")
+            if rest.startswith('['):
+                raise QuerySyntaxError(f"字段标签缺少右方括号: {rest[:20]!r}")
+            raise QuerySyntaxError(f"无法解析: {rest[:20]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value in OPERATORS:
+            kind = 'op'
+        tokens.append((kind, value))
+        spans.append(match.span(match.lastgroup))
+    return tokens, spans
+
+
+def _combine(op, left, right):
+    if op == 'NOT':
+        return Group('NOT', [left, right])
+    children = []
+    for node in (left, right):
+        children.extend(node.children if isinstance(node, Group) and node.op == op else [node])
+    return Group(op, children)
+
+
+class _Parser:
+    """
+    PubMed按从左到右的顺序处理布尔运算符（没有优先级），括号内先计算：
+    a OR b AND c 等价于 (a OR b) AND c
+    """
+
+    def __init__(self, tokens, spans, query):
+        self.tokens = tokens
+        self.spans = spans
+        self.query = query
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("查询为空")
+        node = self.expression()
+        if self.position < len(self.tokens):
+            raise QuerySyntaxError("右括号多余")
+        return node
+
+    def expression(self):
+        node = self.operand()
+        while True:
+            kind, value = self.peek()
+            if kind is None or kind == 'rparen':
+                return node
+            if kind == 'op':
+                self.take()
+                op = value
+            else:
+                op = 'AND'    # 相邻的检索词/括号之间是隐含的AND
+            node = _combine(op, node, self.operand())
+
+    def operand(self):
+        kind, value = self.take()
+        if kind == 'lparen':
+            start = self.position - 1
+            node = self.expression()
+            if self.take()[0] != 'rparen':
+                raise QuerySyntaxError("缺少右括号")
+            if isinstance(node, RangeTerm):
+                node = RangeTerm(self.query[self.spans[start][0]:self.spans[self.position - 1][1]])
+            return node
+        if kind in ('word', 'phrase'):
+            first = self.position - 1
+            parts = [value]
+            field = None
+            while True:
+                next_kind, next_value = self.peek()
+                if next_kind == 'tag':
+                    self.take()
+                    field = next_value[1:-1].strip()
+                    break
+                if next_kind not in ('word', 'phrase'):
+                    break
+                parts.append(self.take()[1])
+            next_kind, next_value = self.peek()
+            if field is not None and next_kind == 'word' and next_value.startswith(':'):
+                return self.range_term(first)
+            return Term(' '.join(parts), field)
+        if kind is None:
+            raise QuerySyntaxError("查询不完整，运算符后缺少检索词")
+        raise QuerySyntaxError(f"意外的 {value!r}")
+
+
+    def range_term(self, first):
+        """下限term[tag]已读取，接着读取 ":上限[tag]"；未加标签的 2020:2024[dp] 本身就是一个单词"""
+        _, value = self.take()
+        if value == ':' and self.peek()[0] not in ('word', 'phrase'):
+            raise QuerySyntaxError("范围缺少上限")
+        while self.peek()[0] in ('word', 'phrase'):
+            self.take()
+        if self.peek()[0] == 'tag':
+            self.take()
+        return RangeTerm(self.query[self.spans[first][0]:self.spans[self.position - 1][1]])
+
+
+def parse_query(query):
+    """解析查询为语法树（Term/RangeTerm/Group），语法错误时抛出QuerySyntaxError"""
+    return _Parser(*_tokenize(query), query).parse()
+
+
+def to_query(node, nested=False):
+    """序列化为发送给PubMed的查询字符串（检索词和字段按原样输出）"""
+    if isinstance(node, Term):
+        return f'{node.text}[{node.field}]' if node.field is not None else node.text
+    text = f' {node.op} '.join(to_query(child, True) for child in node.children)
+    return f'({text})' if nested else text
+
+
+def _canonical_field(field):
+    field = ' '.join(field.lower().split())
+    return FIELD_ALIASES.get(field, field)
+
+
+def canonical_query(node):
+    """
+    规范形式：大小写、空白、字段别名统一，AND/OR子节点排序去重
+
+    语义相同的查询（如 "B OR a" 与 "a OR b"）得到同一个字符串，可用作缓存键
+    """
+    if isinstance(node, str):
+        node = parse_query(node)
+    return _canonical(node, False)
+
+
+def _canonical(node, nested):
+    if isinstance(node, RangeTerm):
+        text = node.text
+        while text.startswith('(') and text.endswith(')'):
+            text = text[1:-1].strip()
+        return ' '.join(text.lower().split())
+    if isinstance(node, Term):
+        text = ' '.join(node.text.lower().split())
+        return f'{text}[{_canonical_field(node.field)}]' if node.field is not None else text
+    if node.op == 'NOT':
+        parts = [_canonical(child, True) for child in node.children]
+    else:
+        parts = sorted(set(_canonical(child, True) for child in node.children))
+    text = f' {node.op} '.join(parts)
+    return f'({text})' if nested and len(parts) > 1 else text
+
+
+def encoded_size(query):
+    """查询作为term参数URL编码后的字节数（决定GET/POST以及是否需要拆分）"""
+    if not isinstance(query, str):
+        query = to_query(query)
+    return len(quote_plus(query))
+
+
+def _positive_or_groups(node, path=()):
+    """
+    结果对其单调递增的OR分组（路径只经过AND/OR的子节点和NOT的左侧）
+
+    对这样的分组，把子节点分成两半分别查询，两个结果的并集等于原查询结果：
+    AND、OR对并集满足分配律，A NOT C 对A也满足
+    """
+    if isinstance(node, Term):
+        return
+    if node.op == 'OR' and len(node.children) > 1:
+        yield path, node
+    children = node.children[:1] if node.op == 'NOT' else node.children
+    for index, child in enumerate(children):
+        yield from _positive_or_groups(child, path + (index,))
+
+
+def _replace(node, path, new):
+    if not path:
+        return new
+    children = list(node.children)
+    children[path[0]] = _replace(children[path[0]], path[1:], new)
+    return Group(node.op, children)
+
+
+def _split_children(children):
+    """按序列化长度把子节点分成大致相等的两半"""
+    sizes = [encoded_size(child) for child in children]
+    half = sum(sizes) / 2
+    running = 0
+    for index, size in enumerate(sizes[:-1]):
+        running += size
+        if running >= half:
+            return children[:index + 1], children[index + 1:]
+    return children[:-1], children[-1:]
+
+
+def _as_node(children):
+    return children[0] if len(children) == 1 else Group('OR', children)
+
+
+def shard_query(node, max_size, max_shards=32):
+    """
+    把查询拆成编码后长度不超过max_size的子查询，各子查询结果的并集与原查询结果相同
+
+    每次把最长的可拆分OR分组分成两半；没有可拆分的分组或达到max_shards时停止，
+    此时返回的子查询可能仍超过max_size。
+
+    Returns:
+        list[str]: 查询不需要拆分时只有一个元素
+    """
+    if isinstance(node, str):
+        node = parse_query(node)
+    pending = [node]
+    done = []
+    while pending:
+        current = pending.pop()
+        if encoded_size(current) <= max_size or len(done) + len(pending) + 2 > max_shards:
+            done.append(current)
+            continue
+        groups = list(_positive_or_groups(current))
+        if not groups:
+            done.append(current)
+            continue
+        path, group = max(groups, key=lambda item: encoded_size(item[1]))
+        first, second = _split_children(group.children)
+        pending.append(_replace(current, path, _as_node(second)))
+        pending.append(_replace(current, path, _as_node(first)))
+    return [to_query(shard) for shard in done]
@@ -0,0 +1,175 @@
+# result_index.py
+# 结果集索引：精简文章卡片 + 预先计算的各排序键顺序，分页、排序、筛选都在索引上完成
+
+import base64
+import json
+import zlib
+
+try:
+    from .text_codec import decode_authors, decompress_text
+except ImportError:
+    from text_codec import decode_authors, decompress_text
+
+SORT_KEYS = ('score', 'year', 'impact_factor')
+RESULTS_PAGE_MAX = 100
+ABSTRACT_PREVIEW_LENGTH = 300
+
+# 构建卡片需要的articles表列
+CARD_COLUMNS = ('pmid', 'title', 'journal', 'journal_abbr', 'year', 'authors', 'doi', 'pubmed_url',
+                'article_types', 'abstract', 'impact_factor', 'score')
+
+
+def _year(value):
+    try:
+        return int(str(value)[:4])
+    except (TypeError, ValueError):
+        return None
+
+
+def make_card(article):
+    """
+    精简文章卡片：列表展示需要的字段和摘要开头
+
+    article可以是文章dict，也可以是按CARD_COLUMNS读取的sqlite3.Row（列值可能仍是压缩/JSON文本）
+    """
+    authors = article['authors']
+    authors = decode_authors(authors) if authors else []
+    article_types = article['article_types'] or []
+    if isinstance(article_types, str):
+        article_types = json.loads(article_types)
+    abstract = decompress_text(article['abstract']) or ''
+    return {
+        'pmid': article['pmid'],
+        'title': article['title'],
+        'journal': article['journal'],
+        'journal_abbr': article['journal_abbr'],
+        'year': article['year'],
+        'authors': authors[:3],
+        'author_count': len(authors),
+        'article_types': article_types,
+        'impact_factor': article['impact_factor'] or 0,
+        'score': article['score'] or 0,
+        'doi': article['doi'],
+        'pubmed_url': article['pubmed_url'],
+        'abstract_preview': abstract[:ABSTRACT_PREVIEW_LENGTH],
+        'abstract_truncated': len(abstract) > ABSTRACT_PREVIEW_LENGTH
+    }
+
+
+def _sort_value(card, key):
+    value = _year(card['year']) if key == 'year' else card[key]
+    return value if value is not None else float('-inf')
+
+
+def _encode_cursor(sort, order, position):
+    raw = json.dumps([sort, order, position]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    """返回 (sort, order, position)，格式错误时抛出ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort, order, position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return sort, order, int(position)
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+
+class ResultIndex:
+    """
+    一个结果集的卡片和排序索引
+
+    orders[key] 是按该键降序（同值按原顺序）排列的卡片下标，构建一次后所有分页请求复用；
+    升序从尾部反向读取。
+    """
+
+    def __init__(self, cards, orders=None):
+        self.cards = cards
+        self.orders = orders or {
+            key: sorted(range(len(cards)), key=lambda i, key=key: (-_sort_value(cards[i], key), i))
+            for key in SORT_KEYS
+        }
+
+    @classmethod
+    def from_articles(cls, articles):
+        return cls([make_card(article) for article in articles])
+
+    def extended(self, cards):
+        """追加cards后的新索引：已有顺序本身有序，排序只需整理新卡片并合并，本索引不变"""
+        all_cards = self.cards + cards
+        added = range(len(self.cards), len(all_cards))
+        return ResultIndex(all_cards, {
+            key: sorted(self.orders[key] + list(added), key=lambda i, key=key: (-_sort_value(all_cards[i], key), i))
+            for key in SORT_KEYS
+        })
+
+    def to_payload(self):
+        """压缩后的JSON，用于持久化"""
+        return zlib.compress(json.dumps({'cards': self.cards, 'orders': self.orders},
+                                        ensure_ascii=False).encode('utf-8'))
+
+    @classmethod
+    def from_payload(cls, payload):
+        data = json.loads(zlib.decompress(payload).decode('utf-8'))
+        return cls(data['cards'], data['orders'])
+
+    def _matches(self, card, journal, article_type, min_year, max_year, min_score):
+        if journal and journal not in (card['journal'] or '').lower() and journal != (card['journal_abbr'] or '').lower():
+            return False
+        if article_type and not any(article_type == t.lower() for t in card['article_types']):
+            return False
+        if min_year is not None or max_year is not None:
+            year = _year(card['year'])
+            if year is None or (min_year is not None and year < min_year) or (max_year is not None and year > max_year):
+                return False
+        if min_score is not None and (card['score'] or 0) < min_score:
+            return False
+        return True
+
+    def query(self, sort='score', order='desc', cursor=None, limit=20, journal=None, article_type=None,
+              min_year=None, max_year=None, min_score=None):
+        """
+        按排序键和筛选条件读取一页卡片
+
+        Args:
+            cursor: 上一页返回的next_cursor；游标记录排序方式和位置，排序改变时需要从头开始
+            journal: 期刊名包含（不区分大小写）或等于期刊缩写
+            article_type: 文章类型（不区分大小写）
+
+        Returns:
+            dict: items、next_cursor、total（符合筛选条件的总数）
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"不支持的排序方向: {order}")
+        limit = max(1, min(int(limit), RESULTS_PAGE_MAX))
+
+        start = 0
+        if cursor:
+            cursor_sort, cursor_order, start = _decode_cursor(cursor)
+            if (cursor_sort, cursor_order) != (sort, order):
+                raise ValueError("分页游标与排序方式不一致")
+
+        ordered = self.orders[sort]
+        count = len(ordered)
+        journal = journal.lower() if journal else None
+        article_type = article_type.lower() if article_type else None
+
+        items = []
+        next_cursor = None
+        total = 0
+        for position in range(count):
+            index = ordered[position] if order == 'desc' else ordered[count - 1 - position]
+            card = self.cards[index]
+            if not self._matches(card, journal, article_type, min_year, max_year, min_score):
+                continue
+            total += 1
+            if position < start:
+                continue
+            if len(items) < limit:
+                items.append(card)
+            elif next_cursor is None:
+                next_cursor = _encode_cursor(sort, order, position)
+        return {'items': items, 'next_cursor': next_cursor, 'total': total}
@@ -0,0 +1,405 @@
+# result_store.py
+# 搜索结果集存储：按search_session_id保存，每篇文章一行，页面按需读取切片
+# 搜索进行中每获取一批就追加一批，文章位置按到达顺序固定，排序由ResultIndex提供
+# 追加期间每批的卡片单独保存，完成时才写入一次完整索引
+
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    from .job_store import JOB_STATE_DB_PATH, SQLiteStore
+    from .result_index import ResultIndex
+    from .metrics import CACHE_REQUESTS
+except ImportError:
+    from job_store import JOB_STATE_DB_PATH, SQLiteStore
+    from result_index import ResultIndex
+    from metrics import CACHE_REQUESTS
+
+RESULT_TTL_SECONDS = int(os.environ.get("RESULT_TTL_SECONDS", str(24 * 3600)))          # 结果集和任务状态保留时间
+RESULT_PURGE_INTERVAL_SECONDS = int(os.environ.get("RESULT_PURGE_INTERVAL_SECONDS", "600"))
+RESULT_CACHE_MAX_MB = float(os.environ.get("RESULT_CACHE_MAX_MB", "64"))                # 每个进程的内存缓存上限
+RESULT_INDEX_CACHE_SIZE = 32    # 每个进程缓存的结果集索引数
+
+
+def _encode_article(article):
+    return zlib.compress(json.dumps(article, ensure_ascii=False).encode('utf-8'))
+
+
+def _decode_article(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class ResultStore(SQLiteStore):
+    """
+    搜索结果集
+
+    结果总是写入磁盘（所有worker可读），写入的进程同时在内存LRU中保留一份，
+    超出RESULT_CACHE_MAX_MB时淘汰最久未用的结果集，之后从磁盘按切片读取。
+    """
+
+    def __init__(self, path=JOB_STATE_DB_PATH, ttl_seconds=RESULT_TTL_SECONDS, cache_max_mb=RESULT_CACHE_MAX_MB):
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+        self.cache_max_bytes = int(cache_max_mb * 1024 * 1024)
+        self._cache = OrderedDict()      # session_id -> {'meta', 'articles', 'bytes'}
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        self._index_cache = OrderedDict()   # session_id -> ResultIndex
+
+    def _init_schema(self, conn):
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS search_result_sets (
+                session_id TEXT PRIMARY KEY,
+                search_id INTEGER,
+                search_params TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                complete INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(search_result_sets)')]
+        if 'complete' not in columns:
+            conn.execute('ALTER TABLE search_result_sets ADD COLUMN complete INTEGER NOT NULL DEFAULT 1')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS search_result_articles (
+                session_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                article BLOB NOT NULL,
+                PRIMARY KEY (session_id, position)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS search_result_index (
+                session_id TEXT PRIMARY KEY,
+                payload BLOB NOT NULL
+            )
+        ''')
+        # 逐批追加中的结果集：每批的卡片一行（position为该批第一篇的位置），finish()后清除
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS search_result_card_batches (
+                session_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                cards BLOB NOT NULL,
+                PRIMARY KEY (session_id, position)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_result_sets_created ON search_result_sets(created_at)')
+
+    def save(self, session_id, search_params, articles, search_id=None):
+        """保存一个结果集（覆盖同ID的旧结果），同时生成卡片和排序索引"""
+        index = ResultIndex.from_articles(articles)
+        meta = {
+            'search_id': search_id,
+            'search_params': search_params,
+            'total': len(articles),
+            'created_at': time.time(),
+            'complete': True
+        }
+        blobs = [_encode_article(article) for article in articles]
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM search_result_articles WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM search_result_card_batches WHERE session_id = ?', (session_id,))
+            conn.execute(
+                'INSERT OR REPLACE INTO search_result_sets (session_id, search_id, search_params, total, created_at, complete) '
+                'VALUES (?, ?, ?, ?, ?, 1)',
+                (session_id, search_id, json.dumps(search_params, ensure_ascii=False), meta['total'],
+                 meta['created_at'])
+            )
+            conn.executemany(
+                'INSERT INTO search_result_articles (session_id, position, article) VALUES (?, ?, ?)',
+                ((session_id, position, blob) for position, blob in enumerate(blobs))
+            )
+            conn.execute('INSERT OR REPLACE INTO search_result_index (session_id, payload) VALUES (?, ?)',
+                         (session_id, index.to_payload()))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        # 以压缩后大小的数倍粗略估计内存占用
+        self._cache_put(session_id, meta, list(articles), sum(len(blob) for blob in blobs) * 4)
+        self._index_put(session_id, index)
+
+    def append(self, session_id, search_params, articles, search_id=None):
+        """
+        追加一批部分结果（搜索仍在进行），返回结果集目前的文章数
+
+        新文章排在已有文章之后，页面和API可以立即按评分读取已到达的结果。
+        本进程的索引在内存中逐批扩展；磁盘上只追加这一批的卡片，其他worker据此重建索引。
+        同一结果集只应由执行该搜索的线程追加。
+        """
+        cards = ResultIndex.from_articles(articles).cards
+        blobs = [_encode_article(article) for article in articles]
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT total, created_at FROM search_result_sets WHERE session_id = ?',
+                               (session_id,)).fetchone()
+            offset, created_at = row if row is not None else (0, time.time())
+            conn.execute(
+                'INSERT OR REPLACE INTO search_result_sets (session_id, search_id, search_params, total, created_at, complete) '
+                'VALUES (?, ?, ?, ?, ?, 0)',
+                (session_id, search_id, json.dumps(search_params, ensure_ascii=False), offset + len(blobs),
+                 created_at)
+            )
+            conn.executemany(
+                'INSERT OR REPLACE INTO search_result_articles (session_id, position, article) VALUES (?, ?, ?)',
+                ((session_id, offset + i, blob) for i, blob in enumerate(blobs))
+            )
+            conn.execute('INSERT OR REPLACE INTO search_result_card_batches (session_id, position, cards) VALUES (?, ?, ?)',
+                         (session_id, offset, _encode_article(cards)))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        meta = {
+            'search_id': search_id,
+            'search_params': search_params,
+            'total': offset + len(blobs),
+            'created_at': created_at,
+            'complete': False
+        }
+        with self._cache_lock:
+            previous = self._index_cache.get(session_id)
+        size = sum(len(blob) for blob in blobs) * 4
+        entry = self._cache_get(session_id)
+        if offset == 0:
+            self._cache_put(session_id, meta, list(articles), size)
+        elif entry is not None and len(entry['articles']) == offset:
+            self._cache_put(session_id, meta, entry['articles'] + list(articles), entry['bytes'] + size)
+        else:
+            # 之前的部分已被淘汰出内存缓存，之后从磁盘读取
+            self._cache_pop(session_id)
+        if offset == 0:
+            self._index_put(session_id, ResultIndex(cards))
+        elif previous is not None and len(previous.cards) == offset:
+            self._index_put(session_id, previous.extended(cards))
+        else:
+            # 内存中没有之前的索引，下次读取时由get_index从各批卡片重建
+            with self._cache_lock:
+                self._index_cache.pop(session_id, None)
+        return meta['total']
+
+    def finish(self, session_id, search_params, search_id=None):
+        """
+        把逐批追加的结果集标记为完成；一批都没有追加时保存一个空结果集
+
+        完整索引在这里写入一次，各批的卡片随之清除
+        """
+        index = self.get_index(session_id)
+        if index is None:
+            self.save(session_id, search_params, [], search_id=search_id)
+            return
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'UPDATE search_result_sets SET search_params = ?, complete = 1 WHERE session_id = ?',
+                (json.dumps(search_params, ensure_ascii=False), session_id)
+            )
+            conn.execute('INSERT OR REPLACE INTO search_result_index (session_id, payload) VALUES (?, ?)',
+                         (session_id, index.to_payload()))
+            conn.execute('DELETE FROM search_result_card_batches WHERE session_id = ?', (session_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._cache_lock:
+            entry = self._cache.get(session_id)
+            if entry is not None:
+                entry['meta'] = dict(entry['meta'], search_params=search_params, complete=True)
+
+    def get_meta(self, session_id):
+        """结果集的search_params、search_id、文章总数、是否已完成，不存在或已过期时返回None"""
+        entry = self._cache_get(session_id)
+        if entry is not None:
+            return dict(entry['meta'])
+        row = self._connect().execute(
+            'SELECT search_id, search_params, total, created_at, complete FROM search_result_sets '
+            'WHERE session_id = ?',
+            (session_id,)
+        ).fetchone()
+        if row is None or self._expired(row[3]):
+            return None
+        return {
+            'search_id': row[0],
+            'search_params': json.loads(row[1]),
+            'total': row[2],
+            'created_at': row[3],
+            'complete': bool(row[4])
+        }
+
+    def get_articles(self, session_id, offset=0, limit=None):
+        """按位置读取文章切片"""
+        entry = self._cache_get(session_id)
+        if entry is not None:
+            end = None if limit is None else offset + limit
+            return entry['articles'][offset:end]
+        rows = self._connect().execute(
+            'SELECT article FROM search_result_articles WHERE session_id = ? AND position >= ? '
+            'ORDER BY position LIMIT ?',
+            (session_id, offset, -1 if limit is None else limit)
+        ).fetchall()
+        return [_decode_article(row[0]) for row in rows]
+
+    def get_index(self, session_id):
+        """
+        结果集的ResultIndex，不存在或已过期时返回None
+
+        结果集可能正由其他worker逐批追加：缓存的索引文章数与当前total不一致时从磁盘重新读取，
+        未完成的结果集由各批的卡片重建
+        """
+        meta = self.get_meta(session_id)
+        if meta is None:
+            return None
+        with self._cache_lock:
+            index = self._index_cache.get(session_id)
+            if index is not None and len(index.cards) != meta['total']:
+                del self._index_cache[session_id]
+                index = None
+            if index is not None:
+                self._index_cache.move_to_end(session_id)
+        CACHE_REQUESTS.inc(cache='result_index', result='miss' if index is None else 'hit')
+        if index is not None:
+            return index
+        conn = self._connect()
+        if not meta['complete']:
+            cards = [card for (blob,) in conn.execute(
+                'SELECT cards FROM search_result_card_batches WHERE session_id = ? ORDER BY position', (session_id,)
+            ) for card in _decode_article(blob)]
+            # 读取前finish()已清除了各批卡片时改读完整索引
+            if cards:
+                index = ResultIndex(cards)
+        if index is None:
+            row = conn.execute(
+                'SELECT payload FROM search_result_index WHERE session_id = ?', (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            index = ResultIndex.from_payload(row[0])
+        self._index_put(session_id, index)
+        return index
+
+    def get_articles_at(self, session_id, positions):
+        """按给定位置（顺序保持不变）读取文章"""
+        positions = list(positions)
+        entry = self._cache_get(session_id)
+        if entry is not None:
+            return [entry['articles'][position] for position in positions]
+        by_position = {}
+        conn = self._connect()
+        for start in range(0, len(positions), 500):
+            chunk = positions[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for position, blob in conn.execute(
+                f'SELECT position, article FROM search_result_articles '
+                f'WHERE session_id = ? AND position IN ({placeholders})',
+                [session_id, *chunk]
+            ):
+                by_position[position] = _decode_article(blob)
+        return [by_position[position] for position in positions if position in by_position]
+
+    def get_ranked_articles(self, session_id, offset=0, limit=None):
+        """按评分降序读取文章切片（文章位置是到达顺序，排序来自索引）"""
+        index = self.get_index(session_id)
+        if index is None:
+            return []
+        end = None if limit is None else offset + limit
+        return self.get_articles_at(session_id, index.orders['score'][offset:end])
+
+    def iter_articles(self, session_id, batch_size=500):
+        """按评分降序分批产出全部文章，不一次性载入整个结果集"""
+        index = self.get_index(session_id)
+        if index is None:
+            return
+        ranked = index.orders['score']
+        for start in range(0, len(ranked), batch_size):
+            yield from self.get_articles_at(session_id, ranked[start:start + batch_size])
+
+    def load(self, session_id):
+        """读取完整结果集 {'articles', 'search_params', 'search_id'}，不存在时返回None"""
+        meta = self.get_meta(session_id)
+        if meta is None:
+            return None
+        return {
+            'articles': self.get_ranked_articles(session_id),
+            'search_params': meta['search_params'],
+            'search_id': meta['search_id']
+        }
+
+    def delete(self, session_id):
+        self._cache_pop(session_id)
+        self._delete_rows(self._connect(), session_id)
+
+    def _delete_rows(self, conn, session_id):
+        conn.execute('DELETE FROM search_result_articles WHERE session_id = ?', (session_id,))
+        conn.execute('DELETE FROM search_result_index WHERE session_id = ?', (session_id,))
+        conn.execute('DELETE FROM search_result_card_batches WHERE session_id = ?', (session_id,))
+        conn.execute('DELETE FROM search_result_sets WHERE session_id = ?', (session_id,))
+
+    def purge_expired(self):
+        """删除超过保留时间的结果集，返回删除数"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._cache_lock:
+            for session_id in [sid for sid, entry in self._cache.items()
+                               if entry['meta']['created_at'] < cutoff]:
+                self._cache_bytes -= self._cache.pop(session_id)['bytes']
+                self._index_cache.pop(session_id, None)
+
+        conn = self._connect()
+        expired = [row[0] for row in conn.execute(
+            'SELECT session_id FROM search_result_sets WHERE created_at < ?', (cutoff,)
+        )]
+        for session_id in expired:
+            self._delete_rows(conn, session_id)
+        return len(expired)
+
+    def _expired(self, created_at):
+        return self.ttl_seconds > 0 and created_at < time.time() - self.ttl_seconds
+
+    def _cache_put(self, session_id, meta, articles, size):
+        with self._cache_lock:
+            if session_id in self._cache:
+                self._cache_bytes -= self._cache.pop(session_id)['bytes']
+            if size > self.cache_max_bytes:
+                return
+            self._cache[session_id] = {'meta': meta, 'articles': articles, 'bytes': size}
+            self._cache_bytes += size
+            while self._cache_bytes > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted['bytes']
+
+    def _cache_get(self, session_id):
+        with self._cache_lock:
+            entry = self._cache.get(session_id)
+            if entry is not None and self._expired(entry['meta']['created_at']):
+                self._cache_bytes -= self._cache.pop(session_id)['bytes']
+                entry = None
+            if entry is not None:
+                self._cache.move_to_end(session_id)
+        CACHE_REQUESTS.inc(cache='result_set', result='miss' if entry is None else 'hit')
+        return entry
+
+    def _index_put(self, session_id, index):
+        with self._cache_lock:
+            self._index_cache[session_id] = index
+            self._index_cache.move_to_end(session_id)
+            while len(self._index_cache) > RESULT_INDEX_CACHE_SIZE:
+                self._index_cache.popitem(last=False)
+
+    def _cache_pop(self, session_id):
+        with self._cache_lock:
+            self._index_cache.pop(session_id, None)
+            entry = self._cache.pop(session_id, None)
+            if entry is not None:
+                self._cache_bytes -= entry['bytes']
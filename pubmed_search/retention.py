@@ -0,0 +1,211 @@
+# retention.py
+# 搜索历史保留策略：按时间、条数、数据库体积淘汰最旧的搜索，并逐步回收空闲页
+
+import argparse
+import os
+import threading
+import time
+
+try:
+    from .pubmed_search_core import get_db_connection, init_database
+except ImportError:
+    from pubmed_search_core import get_db_connection, init_database
+
+# 保留策略配置（0 表示不启用该项限制）；默认都不启用，不会在升级后自动删除用户的搜索历史
+RETENTION_MAX_AGE_DAYS = int(os.environ.get("RETENTION_MAX_AGE_DAYS", "0"))
+RETENTION_MAX_SEARCHES = int(os.environ.get("RETENTION_MAX_SEARCHES", "0"))
+RETENTION_MAX_DB_MB = float(os.environ.get("RETENTION_MAX_DB_MB", "0"))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "20"))        # 每批淘汰的搜索数
+RETENTION_MAX_BATCHES = int(os.environ.get("RETENTION_MAX_BATCHES", "50"))      # 单次运行最多批数
+RETENTION_VACUUM_PAGES = int(os.environ.get("RETENTION_VACUUM_PAGES", "500"))   # 每批回收的页数
+RETENTION_INTERVAL_SECONDS = int(os.environ.get("RETENTION_INTERVAL_SECONDS", "3600"))
+
+_worker_thread = None
+_worker_lock = threading.Lock()
+
+
+def get_database_usage(conn):
+    """返回数据库页使用情况（字节）"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return {
+        'file_bytes': page_count * page_size,
+        'used_bytes': (page_count - freelist_count) * page_size,
+        'free_pages': freelist_count
+    }
+
+
+def _oldest_search_ids(conn, limit, max_age_days=0):
+    """按ID（即写入顺序）取最旧的一批搜索"""
+    if max_age_days:
+        rows = conn.execute('''
+            SELECT id FROM search_history
+            WHERE created_at < datetime('now', ?)
+            ORDER BY id LIMIT ?
+        ''', (f'-{max_age_days} days', limit)).fetchall()
+    else:
+        rows = conn.execute(
+            'SELECT id FROM search_history ORDER BY id LIMIT ?', (limit,)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _next_eviction_batch(conn, batch_size, max_age_days, max_searches, max_bytes):
+    """确定下一批要淘汰的搜索：遗留的预留记录和过期的优先，其次超出条数的，最后超出体积的"""
+    # 进程崩溃时未写入结果的预留记录（见write_queue.py）
+    rows = conn.execute('''
+        SELECT id FROM search_history
+        WHERE status = 'pending' AND created_at < datetime('now', '-1 day')
+        ORDER BY id LIMIT ?
+    ''', (batch_size,)).fetchall()
+    if rows:
+        return [row[0] for row in rows]
+    if max_age_days:
+        search_ids = _oldest_search_ids(conn, batch_size, max_age_days)
+        if search_ids:
+            return search_ids
+    if max_searches:
+        count = conn.execute('SELECT COUNT(*) FROM search_history').fetchone()[0]
+        if count > max_searches:
+            return _oldest_search_ids(conn, min(batch_size, count - max_searches))
+    if max_bytes and get_database_usage(conn)['used_bytes'] > max_bytes:
+        return _oldest_search_ids(conn, batch_size)
+    return []
+
+
+def evict_searches(conn, search_ids):
+    """删除指定搜索及其文章，单独提交一个短事务"""
+    if not search_ids:
+        return 0
+    placeholders = ",".join("?" * len(search_ids))
+    cursor = conn.cursor()
+    cursor.execute(f'DELETE FROM articles WHERE search_id IN ({placeholders})', search_ids)
+    deleted_articles = cursor.rowcount
+    cursor.execute(f'DELETE FROM search_history WHERE id IN ({placeholders})', search_ids)
+    conn.commit()
+    return deleted_articles
+
+
+def delete_orphan_articles(conn, batch_size=1000):
+    """删除search_history中已不存在的搜索所遗留的文章"""
+    total = 0
+    while True:
+        cursor = conn.execute('''
+            DELETE FROM articles WHERE id IN (
+                SELECT a.id FROM articles a
+                LEFT JOIN search_history h ON a.search_id = h.id
+                WHERE h.id IS NULL
+                LIMIT ?
+            )
+        ''', (batch_size,))
+        conn.commit()
+        total += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return total
+
+
+def incremental_vacuum(conn, pages=RETENTION_VACUUM_PAGES):
+    """回收最多pages个空闲页（需要auto_vacuum=INCREMENTAL）"""
+    # execute()只会执行一步（回收一页），executescript会执行到底
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+
+
+def enforce_retention(max_age_days=None, max_searches=None, max_db_mb=None,
+                      batch_size=None, max_batches=None, vacuum_pages=None):
+    """
+    执行一次保留策略
+
+    依次按时间、条数、体积分批淘汰最旧的搜索，每批之后回收一部分空闲页，
+    避免长时间持有写锁。
+
+    Returns:
+        dict: 淘汰的搜索数、文章数以及执行前后的数据库体积
+    """
+    max_age_days = RETENTION_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_searches = RETENTION_MAX_SEARCHES if max_searches is None else max_searches
+    max_db_mb = RETENTION_MAX_DB_MB if max_db_mb is None else max_db_mb
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    max_batches = max_batches or RETENTION_MAX_BATCHES
+    vacuum_pages = RETENTION_VACUUM_PAGES if vacuum_pages is None else vacuum_pages
+    max_bytes = int(max_db_mb * 1024 * 1024)
+
+    conn = get_db_connection()
+    try:
+        before = get_database_usage(conn)
+        summary = {'evicted_searches': 0, 'evicted_articles': 0, 'orphan_articles': 0,
+                   'bytes_before': before['file_bytes']}
+        batches = 0
+
+        while batches < max_batches:
+            search_ids = _next_eviction_batch(conn, batch_size, max_age_days, max_searches, max_bytes)
+            if not search_ids:
+                break
+
+            summary['evicted_articles'] += evict_searches(conn, search_ids)
+            summary['evicted_searches'] += len(search_ids)
+            if vacuum_pages:
+                incremental_vacuum(conn, vacuum_pages)
+            batches += 1
+
+        summary['orphan_articles'] = delete_orphan_articles(conn)
+        if vacuum_pages:
+            incremental_vacuum(conn, vacuum_pages)
+
+        summary['bytes_after'] = get_database_usage(conn)['file_bytes']
+    finally:
+        conn.close()
+
+    if summary['evicted_searches'] or summary['orphan_articles']:
+        print(f"🧹 保留策略: 淘汰 {summary['evicted_searches']} 次搜索, "
+              f"{summary['evicted_articles'] + summary['orphan_articles']} 篇文章, "
+              f"数据库 {summary['bytes_before'] / 1024:.0f}KB -> {summary['bytes_after'] / 1024:.0f}KB")
+    return summary
+
+
+def _retention_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            enforce_retention()
+        except Exception as e:
+            print(f"❌ 保留策略执行失败: {e}")
+
+
+def start_retention_worker(interval=None):
+    """启动后台保留策略线程（每个进程只启动一次），interval为0时不启动"""
+    global _worker_thread
+    interval = RETENTION_INTERVAL_SECONDS if interval is None else interval
+    if interval <= 0:
+        return None
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_retention_loop, args=(interval,), daemon=True)
+            _worker_thread.start()
+    return _worker_thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="清理搜索历史并回收数据库空间")
+    parser.add_argument("--max-age-days", type=int, default=RETENTION_MAX_AGE_DAYS, help="保留天数，0为不限")
+    parser.add_argument("--max-searches", type=int, default=RETENTION_MAX_SEARCHES, help="最多保留的搜索数，0为不限")
+    parser.add_argument("--max-db-mb", type=float, default=RETENTION_MAX_DB_MB, help="数据库体积上限(MB)，0为不限")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE, help="每批淘汰的搜索数")
+    parser.add_argument("--max-batches", type=int, default=RETENTION_MAX_BATCHES, help="单次运行最多批数")
+    parser.add_argument("--vacuum-pages", type=int, default=RETENTION_VACUUM_PAGES, help="每批回收的页数，0为不回收")
+    args = parser.parse_args()
+
+    init_database()
+    summary = enforce_retention(
+        max_age_days=args.max_age_days,
+        max_searches=args.max_searches,
+        max_db_mb=args.max_db_mb,
+        batch_size=args.batch_size,
+        max_batches=args.max_batches,
+        vacuum_pages=args.vacuum_pages
+    )
+    print(f"✅ 清理完成: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# search_executor.py
+# 固定并发的搜索执行器：有界等待队列、满时拒绝，并估算排队任务的开始时间
+# 小搜索（缩小范围、命中数少）走单独的通道，不排在大批量获取的搜索后面
+
+import heapq
+import os
+import threading
+import time
+from collections import deque
+
+# 以下上限是整个服务的合计，按gunicorn worker数（WEB_CONCURRENCY）平均分到每个进程
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+SEARCH_CONCURRENCY = int(os.environ.get("SEARCH_CONCURRENCY", "2"))   # 同时执行的搜索数
+SEARCH_QUEUE_SIZE = int(os.environ.get("SEARCH_QUEUE_SIZE", "10"))    # 最多排队的搜索数
+SEARCH_INTERACTIVE_CONCURRENCY = int(os.environ.get("SEARCH_INTERACTIVE_CONCURRENCY", "1"))  # 只执行小搜索的额外线程
+DEFAULT_JOB_SECONDS = 60.0   # 还没有完成过任务时假定的单次搜索耗时
+
+
+def per_process(total):
+    """服务合计的上限分到每个worker进程（向上取整，0仍为0）"""
+    return -(-total // WEB_CONCURRENCY) if total > 0 else 0
+
+
+class SearchQueueFull(Exception):
+    """等待队列已满"""
+
+
+class SearchExecutor:
+    """
+    固定数量的工作线程执行搜索任务
+
+    小搜索（submit时interactive=True）排在单独的队列中：普通工作线程优先取小搜索，
+    另有interactive_concurrency个线程只执行小搜索，所以小搜索不会等大搜索执行完。
+    NCBI请求的公平调度（ncbi_scheduler）只在已开始执行的搜索之间起作用。
+
+    Args:
+        concurrency: 工作线程数
+        max_queue: 等待队列长度上限（两个队列合计），超出时submit抛出SearchQueueFull
+        on_queue_change: 队列变化时的回调 on_queue_change([(job_id, 位置, 预计等待秒数), ...])
+        interactive_concurrency: 只执行小搜索的线程数
+    """
+
+    def __init__(self, concurrency=None, max_queue=None, on_queue_change=None, interactive_concurrency=None):
+        self.concurrency = max(1, per_process(SEARCH_CONCURRENCY) if concurrency is None else concurrency)
+        self.max_queue = per_process(SEARCH_QUEUE_SIZE) if max_queue is None else max_queue
+        self.interactive_concurrency = max(0, per_process(SEARCH_INTERACTIVE_CONCURRENCY)
+                                           if interactive_concurrency is None else interactive_concurrency)
+        self.on_queue_change = on_queue_change
+        self._pending = deque()          # [(job_id, fn, args)]
+        self._interactive = deque()      # 小搜索，先于_pending执行
+        self._running = {}               # job_id -> (开始时间, 是否在小搜索专用线程上)
+        self._cond = threading.Condition()
+        self._avg_duration = DEFAULT_JOB_SECONDS
+        self._workers = []
+        self._interactive_workers = []
+
+    def submit(self, job_id, fn, *args, interactive=False):
+        """提交任务，返回排队位置（0表示会立即开始）；interactive=True为小搜索"""
+        with self._cond:
+            if len(self._pending) + len(self._interactive) >= self.max_queue:
+                raise SearchQueueFull(f"搜索队列已满 ({self.max_queue})")
+            self._ensure_workers()
+            idle_general, idle_interactive = self._idle_locked()
+            if interactive:
+                self._interactive.append((job_id, fn, args))
+                position = max(0, len(self._interactive) - idle_general - idle_interactive)
+            else:
+                self._pending.append((job_id, fn, args))
+                position = max(0, len(self._interactive) + len(self._pending) - idle_general)
+            # 两种线程等待的条件不同，需要全部唤醒
+            self._cond.notify_all()
+        self._publish_queue()
+        return position
+
+    def cancel(self, job_id):
+        """从等待队列中移除尚未开始的任务，返回是否移除"""
+        with self._cond:
+            queue, item = next(((queue, item) for queue in (self._interactive, self._pending)
+                                for item in queue if item[0] == job_id), (None, None))
+            if queue is None:
+                return False
+            queue.remove(item)
+        self._publish_queue()
+        return True
+
+    def queue_snapshot(self):
+        """[(job_id, 位置, 预计等待秒数)]，位置从1开始"""
+        with self._cond:
+            return self._snapshot_locked()
+
+    def queue_position(self, job_id):
+        """排队位置：None表示不在本执行器中，0表示正在执行"""
+        with self._cond:
+            if job_id in self._running:
+                return 0
+            for position, item in enumerate(self._queued_locked(), 1):
+                if item[0] == job_id:
+                    return position
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'running': len(self._running),
+                'queued': len(self._pending) + len(self._interactive),
+                'queued_interactive': len(self._interactive),
+                'concurrency': self.concurrency,
+                'interactive_concurrency': self.interactive_concurrency,
+                'max_queue': self.max_queue,
+                'avg_job_seconds': round(self._avg_duration, 1)
+            }
+
+    def _queued_locked(self):
+        return list(self._interactive) + list(self._pending)
+
+    def _idle_locked(self):
+        busy_interactive = sum(1 for _, dedicated in self._running.values() if dedicated)
+        return (self.concurrency - (len(self._running) - busy_interactive),
+                self.interactive_concurrency - busy_interactive)
+
+    def _snapshot_locked(self):
+        # 用各工作线程预计空闲的时间点模拟排队任务依次开始：小搜索可用两种线程，普通搜索只用普通线程
+        now = time.monotonic()
+        general, dedicated = [], []
+        for started, on_dedicated in self._running.values():
+            (dedicated if on_dedicated else general).append(max(0.0, self._avg_duration - (now - started)))
+        general += [0.0] * (self.concurrency - len(general))
+        dedicated += [0.0] * (self.interactive_concurrency - len(dedicated))
+        heapq.heapify(general)
+        heapq.heapify(dedicated)
+        snapshot = []
+        for position, (job_id, _, _) in enumerate(self._queued_locked(), 1):
+            slots = general
+            if position <= len(self._interactive) and dedicated and dedicated[0] < general[0]:
+                slots = dedicated
+            start = heapq.heappop(slots)
+            heapq.heappush(slots, start + self._avg_duration)
+            snapshot.append((job_id, position, round(start)))
+        return snapshot
+
+    def _publish_queue(self):
+        if self.on_queue_change is None:
+            return
+        try:
+            self.on_queue_change(self.queue_snapshot())
+        except Exception as e:
+            print(f"❌ 发布排队状态失败: {e}")
+
+    def _ensure_workers(self):
+        for workers, count, dedicated, prefix in ((self._workers, self.concurrency, False, "search-worker"),
+                                                  (self._interactive_workers, self.interactive_concurrency, True,
+                                                   "search-worker-small")):
+            workers[:] = [w for w in workers if w.is_alive()]
+            while len(workers) < count:
+                worker = threading.Thread(target=self._worker_loop, args=(dedicated,),
+                                          name=f"{prefix}-{len(workers)}", daemon=True)
+                worker.start()
+                workers.append(worker)
+
+    def _worker_loop(self, dedicated=False):
+        while True:
+            with self._cond:
+                while not (self._interactive or (self._pending and not dedicated)):
+                    self._cond.wait()
+                job_id, fn, args = (self._interactive or self._pending).popleft()
+                started = time.monotonic()
+                self._running[job_id] = (started, dedicated)
+            self._publish_queue()
+
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"❌ 搜索任务 {job_id} 异常退出: {e}")
+            finally:
+                with self._cond:
+                    self._running.pop(job_id, None)
+                    # 指数平滑的平均耗时，用于估算排队时间
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - started)
+                self._publish_queue()
@@ -0,0 +1,216 @@
+# search_trace.py
+# 单次搜索的结构化耗时记录：阶段、每批efetch、请求字节数、重试次数和结果漏斗，随搜索历史一起保存
+# 可选的深度分析模式会附带cProfile热点函数和tracemalloc内存分配位置
+
+import cProfile
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+SEARCH_PROFILE = os.environ.get("SEARCH_PROFILE", "").strip().lower()          # 所有搜索默认的深度分析模式
+SEARCH_PROFILE_ALLOW_REQUEST = os.environ.get("SEARCH_PROFILE_ALLOW_REQUEST", "") == "1"  # 允许单次搜索请求开启深度分析
+PROFILE_MODES = ('cprofile', 'tracemalloc', 'all')
+PROFILE_TOP_N = 25
+TRACE_VERSION = 1
+
+# 结果漏斗：找到 → 获取 → 主刊 → 分数过滤 → 类型过滤
+FUNNEL_STAGES = ('found', 'fetched', 'main_journal', 'score_filtered', 'type_filtered')
+
+_local = threading.local()
+
+# tracemalloc是进程级的，多个搜索同时开启时只在最后一个结束后停止
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+# 同一时刻只允许一个搜索开启cProfile：Python 3.12起分析器基于sys.monitoring，
+# 第二个enable()会抛出"Another profiling tool is already active"
+_cprofile_lock = threading.Lock()
+
+
+def current_trace():
+    """当前线程正在记录的SearchTrace，没有时返回None"""
+    return getattr(_local, 'trace', None)
+
+
+def profile_mode(requested=None):
+    """本次搜索使用的深度分析模式：请求中指定（需SEARCH_PROFILE_ALLOW_REQUEST）或SEARCH_PROFILE"""
+    mode = (requested or '').strip().lower() if SEARCH_PROFILE_ALLOW_REQUEST else ''
+    mode = mode or SEARCH_PROFILE
+    return mode if mode in PROFILE_MODES else None
+
+
+class SearchTrace:
+    """
+    一次搜索的执行记录
+
+    在activate()块内，本线程的E-utilities请求、efetch批次和解析结果会自动记入；
+    之后写入线程可以继续追加db_save阶段，最终由to_dict()序列化保存。
+    """
+
+    def __init__(self, kind='web', profile=None):
+        self.kind = kind
+        self.profile_mode = profile if profile in PROFILE_MODES else None
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.queue_seconds = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+        self.batches = []
+        self.funnel = {}
+        self.requests = {}      # endpoint -> {'count', 'seconds', 'wait_seconds', 'bytes'}
+        self.retries = 0
+        self.profile = None
+        self._profiler = None
+        self._profiling = False
+        self._cprofile_skipped = None
+
+    @contextmanager
+    def activate(self):
+        """
+        在with块内把本trace设为当前线程的记录目标
+
+        深度分析由调用方在自己的异常处理范围内调用start_profiling()开启，离开with块时自动结束
+        """
+        previous = current_trace()
+        _local.trace = self
+        try:
+            yield self
+        finally:
+            self.stop_profiling()
+            _local.trace = previous
+
+    @contextmanager
+    def span(self, name, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter() - start, **fields)
+
+    def add_span(self, name, start, seconds, **fields):
+        with self._lock:
+            self.spans.append({'name': name, 'start': round(start - self._start, 4),
+                               'seconds': round(seconds, 4), **fields})
+
+    def add_batch(self, **fields):
+        with self._lock:
+            self.batches.append({'batch': len(self.batches) + 1, **fields})
+
+    def annotate_batch(self, **fields):
+        """补充最近一批的信息（评分、过滤、保存耗时等）"""
+        with self._lock:
+            if self.batches:
+                self.batches[-1].update(fields)
+
+    def record_request(self, endpoint, seconds, wait_seconds, size):
+        with self._lock:
+            entry = self.requests.setdefault(endpoint, {'count': 0, 'seconds': 0.0, 'wait_seconds': 0.0, 'bytes': 0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['wait_seconds'] += wait_seconds
+            entry['bytes'] += size
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def add_funnel(self, stage, count):
+        with self._lock:
+            self.funnel[stage] = self.funnel.get(stage, 0) + count
+
+    def set_funnel(self, stage, count):
+        with self._lock:
+            self.funnel[stage] = count
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'version': TRACE_VERSION,
+                'kind': self.kind,
+                'started_at': self.started_at,
+                'total_seconds': round(time.perf_counter() - self._start, 4),
+                'queue_seconds': self.queue_seconds,
+                'spans': [dict(span) for span in self.spans],
+                'batches': [dict(batch) for batch in self.batches],
+                'requests': {endpoint: {key: round(value, 4) if isinstance(value, float) else value
+                                        for key, value in entry.items()}
+                             for endpoint, entry in self.requests.items()},
+                'bytes': sum(entry['bytes'] for entry in self.requests.values()),
+                'retries': self.retries,
+                'funnel': {stage: self.funnel[stage] for stage in FUNNEL_STAGES if stage in self.funnel},
+                'profile_mode': self.profile_mode,
+                'profile': self.profile
+            }
+
+    def start_profiling(self):
+        """按profile_mode开启深度分析（在执行搜索的线程中调用）；无法开启时跳过，不会抛出异常"""
+        global _tracemalloc_users
+        if self.profile_mode is None or self._profiling:
+            return
+        self._profiling = True
+        if self.profile_mode in ('tracemalloc', 'all'):
+            with _tracemalloc_lock:
+                if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                _tracemalloc_users += 1
+                tracemalloc.reset_peak()
+        if self.profile_mode in ('cprofile', 'all'):
+            if not _cprofile_lock.acquire(blocking=False):
+                self._cprofile_skipped = '其他搜索正在进行cProfile分析'
+                print(f"⚠️ 跳过cProfile: {self._cprofile_skipped}")
+                return
+            # cProfile只记录调用enable()的线程，即执行搜索的线程
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except Exception as e:     # 调试器、覆盖率等其他分析工具已占用
+                _cprofile_lock.release()
+                self._cprofile_skipped = str(e)
+                print(f"⚠️ 跳过cProfile: {e}")
+                return
+            self._profiler = profiler
+
+    def stop_profiling(self):
+        """结束深度分析并记录结果；需要在交给其他线程保存前调用，重复调用无影响"""
+        global _tracemalloc_users
+        if not self._profiling:
+            return
+        self._profiling = False
+        profile = {}
+        if self._profiler is not None:
+            self._profiler.disable()
+            _cprofile_lock.release()
+            profile['cprofile'] = _top_functions(self._profiler)
+            self._profiler = None
+        elif self._cprofile_skipped:
+            profile['cprofile_skipped'] = self._cprofile_skipped
+        if self.profile_mode in ('tracemalloc', 'all'):
+            with _tracemalloc_lock:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                _tracemalloc_users -= 1
+                if _tracemalloc_users == 0:
+                    tracemalloc.stop()
+            profile['tracemalloc'] = {
+                'peak_bytes': peak,
+                'top': [{'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                         'size_bytes': stat.size, 'count': stat.count}
+                        for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]]
+            }
+        if profile:
+            with self._lock:
+                self.profile = profile
+
+
+def _top_functions(profiler):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, lineno, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({'function': f'{os.path.basename(filename)}:{lineno}({function})', 'calls': calls,
+                     'total_seconds': round(total, 4), 'cumulative_seconds': round(cumulative, 4)})
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:PROFILE_TOP_N]
@@ -260,3 +260,112 @@ style.textContent = `
     }
 `;
 document.head.appendChild(style);
+
+
+// ---- 结果排序/筛选/分页（/api/results/<id>，只请求精简卡片） ----
+function escapeHtml(value) {
+    return String(value === null || value === undefined ? '' : value)
+        .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
+function renderArticleCard(card) {
+    const authors = card.authors.join(', ') +
+        (card.author_count > 3 ? `, et al. (${card.author_count} total)` : '');
+    return `
+        <article class="article-card">
+            <div class="article-header">
+                <h3 class="article-title">${escapeHtml(card.title)}</h3>
+                <div class="article-meta">
+                    <span class="journal-badge">${escapeHtml(card.journal)}</span>
+                    <span class="year-badge">${escapeHtml(card.year)}</span>
+                    <span class="score-badge">评分: ${Number(card.score).toFixed(1)}</span>
+                </div>
+            </div>
+            <div class="article-content">
+                <div class="article-info">
+                    <div class="info-row"><strong>作者:</strong> ${escapeHtml(authors)}</div>
+                    ${card.impact_factor ? `<div class="info-row"><strong>影响因子:</strong> ${escapeHtml(card.impact_factor)}</div>` : ''}
+                    ${card.article_types.length ? `<div class="info-row"><strong>文章类型:</strong> ${escapeHtml(card.article_types.join(', '))}</div>` : ''}
+                </div>
+                <div class="article-abstract">
+                    <strong>摘要:</strong>
+                    <p>${escapeHtml(card.abstract_preview)}${card.abstract_truncated ? '...' : ''}</p>
+                </div>
+                <div class="article-links">
+                    <a href="${escapeHtml(card.pubmed_url)}" target="_blank" class="btn btn-sm btn-primary">
+                        <i class="fas fa-external-link-alt"></i> PubMed
+                    </a>
+                    ${card.doi ? `<a href="https://doi.org/${escapeHtml(card.doi)}" target="_blank" class="btn btn-sm btn-secondary"><i class="fas fa-link"></i> DOI</a>` : ''}
+                </div>
+            </div>
+        </article>`;
+}
+
+function initResultsBrowser(form) {
+    const resultId = form.dataset.resultId;
+    const list = document.querySelector('.articles-list');
+    const loadMore = document.getElementById('loadMoreResults');
+    const pagination = document.querySelector('.pagination');
+    let nextCursor = null;
+    let query = '';
+
+    async function loadPage(append, quiet) {
+        const params = new URLSearchParams(query);
+        if (append && nextCursor) {
+            params.set('cursor', nextCursor);
+        }
+        try {
+            const response = await fetch(`/api/results/${resultId}?${params}`);
+            const data = await response.json();
+            if (!data.success) {
+                showToast(data.error || '加载结果失败', 'error');
+                return;
+            }
+            const html = data.items.map(renderArticleCard).join('');
+            if (append) {
+                list.insertAdjacentHTML('beforeend', html);
+            } else {
+                list.innerHTML = html || '<p class="empty-results">没有符合条件的文章</p>';
+                if (!quiet) {
+                    showToast(`共 ${data.total} 篇符合条件的文章`, 'info');
+                }
+            }
+            nextCursor = data.next_cursor;
+            loadMore.style.display = nextCursor ? '' : 'none';
+        } catch (error) {
+            showToast('加载结果失败，请稍后重试', 'error');
+        }
+    }
+
+    form.addEventListener('submit', event => {
+        event.preventDefault();
+        const params = new URLSearchParams();
+        for (const [key, value] of new FormData(form)) {
+            if (value) params.set(key, value);
+        }
+        query = params.toString();
+        nextCursor = null;
+        // 切换为API分页后，服务器渲染的页码不再适用
+        if (pagination) pagination.style.display = 'none';
+        loadPage(false);
+    });
+
+    loadMore.querySelector('button').addEventListener('click', () => loadPage(true));
+
+    return {
+        // 用当前排序和筛选条件重新加载第一页（新结果到达后重新排序）
+        refresh() {
+            nextCursor = null;
+            if (pagination) pagination.style.display = 'none';
+            return loadPage(false, true);
+        }
+    };
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('resultsBrowser');
+    if (form) {
+        window.resultsBrowser = initResultsBrowser(form);
+    }
+});
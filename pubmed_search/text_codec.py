@@ -0,0 +1,185 @@
+# text_codec.py
+# 数据库大文本列（摘要、作者、引用）的透明压缩编解码
+
+import json
+import re
+import struct
+import zlib
+from collections import Counter
+
+# 编解码版本标记，写在压缩值的第一个字节
+CODEC_ZLIB = 1          # 普通zlib
+CODEC_ZLIB_DICT = 2     # zlib + 共享字典，后接2字节字典ID
+
+# 压缩模式（对应环境变量 DB_COMPRESSION）
+COMPRESSION_MODES = ("", "zlib", "zlib_dict")
+
+# 参与压缩的列
+COMPRESSED_COLUMNS = ("abstract", "authors", "citation")
+
+MIN_COMPRESS_LENGTH = 128         # 太短的文本压缩后反而更大
+DICTIONARY_MAX_SIZE = 32 * 1024   # zlib窗口上限为32KB，字典超出部分无效
+ZLIB_LEVEL = 6
+
+# 已加载的共享字典 {字典ID: bytes}
+_dictionaries = {}
+_dictionary_loader = None
+
+
+def set_dictionary_loader(loader):
+    """设置按ID加载共享字典的回调（由数据库模块提供）"""
+    global _dictionary_loader
+    _dictionary_loader = loader
+
+
+def register_dictionary(dictionary_id, dictionary):
+    """注册一个共享字典，供编解码使用"""
+    _dictionaries[dictionary_id] = dictionary
+
+
+def get_dictionary(dictionary_id):
+    """获取共享字典，未加载时通过回调从数据库读取"""
+    dictionary = _dictionaries.get(dictionary_id)
+    if dictionary is None and _dictionary_loader is not None:
+        dictionary = _dictionary_loader(dictionary_id)
+        if dictionary is not None:
+            _dictionaries[dictionary_id] = dictionary
+    if dictionary is None:
+        raise ValueError(f"压缩字典 {dictionary_id} 不存在")
+    return dictionary
+
+
+def compress_text(text, mode="zlib", dictionary_id=None):
+    """
+    压缩文本列的值
+
+    Args:
+        text: 待写入数据库的文本
+        mode: 压缩模式，"" 表示不压缩
+        dictionary_id: zlib_dict 模式使用的字典ID，为空时退化为普通zlib
+
+    Returns:
+        str 或 bytes: 不值得压缩时原样返回文本，否则返回带版本标记的bytes
+    """
+    if not mode or not text or len(text) < MIN_COMPRESS_LENGTH:
+        return text
+
+    raw = text.encode("utf-8")
+    if mode == "zlib_dict" and dictionary_id is not None:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zdict=get_dictionary(dictionary_id))
+        header = struct.pack(">BH", CODEC_ZLIB_DICT, dictionary_id)
+    else:
+        compressor = zlib.compressobj(ZLIB_LEVEL)
+        header = struct.pack(">B", CODEC_ZLIB)
+
+    encoded = header + compressor.compress(raw) + compressor.flush()
+    # 压缩后没有变小就保留明文，读取时也省去解压
+    if len(encoded) >= len(raw):
+        return text
+    return encoded
+
+
+def decompress_text(value):
+    """解压数据库中的值；明文（str/None）原样返回"""
+    if not isinstance(value, (bytes, memoryview)):
+        return value
+
+    value = bytes(value)
+    version = value[0]
+    if version == CODEC_ZLIB:
+        return zlib.decompress(value[1:]).decode("utf-8")
+    if version == CODEC_ZLIB_DICT:
+        (dictionary_id,) = struct.unpack(">H", value[1:3])
+        decompressor = zlib.decompressobj(zdict=get_dictionary(dictionary_id))
+        return (decompressor.decompress(value[3:]) + decompressor.flush()).decode("utf-8")
+    raise ValueError(f"未知的压缩版本标记: {version}")
+
+
+def decode_authors(value):
+    """作者列存储为JSON数组（可能被压缩）"""
+    if isinstance(value, list):
+        return value
+    text = decompress_text(value)
+    return json.loads(text) if text else []
+
+
+# 各列的延迟解码函数
+_FIELD_DECODERS = {
+    "abstract": decompress_text,
+    "citation": decompress_text,
+    "authors": decode_authors,
+}
+
+
+def _needs_decode(key, value):
+    if key == "authors":
+        return not isinstance(value, list)
+    return isinstance(value, (bytes, memoryview))
+
+
+class LazyArticle(dict):
+    """从数据库读取的文章记录，压缩列在第一次被读取时才解压"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if key in _FIELD_DECODERS and _needs_decode(key, value):
+            value = _FIELD_DECODERS[key](value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __iter__(self):
+        # 覆盖__iter__后，dict(article)、{**article}、dict.update不再直接复制底层存储，
+        # 而是逐个键调用__getitem__，得到的是解压后的值
+        return dict.__iter__(self)
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def copy(self):
+        return dict(self.items())
+
+
+def build_dictionary(samples, max_size=DICTIONARY_MAX_SIZE):
+    """
+    从摘要样本中训练共享字典
+
+    统计样本中高频的1-3词短语，按 出现次数×长度 估算收益，
+    收益最高的放在字典末尾（zlib对距离越近的匹配编码越短）。
+    """
+    counter = Counter()
+    for sample in samples:
+        if not sample:
+            continue
+        words = re.findall(r"\S+", sample)
+        for n in (1, 2, 3):
+            for i in range(len(words) - n + 1):
+                counter[" ".join(words[i:i + n])] += 1
+
+    candidates = [
+        (count * len(phrase), phrase)
+        for phrase, count in counter.items()
+        if count > 1 and len(phrase) > 3
+    ]
+    candidates.sort(reverse=True)
+
+    selected = []
+    size = 0
+    for _, phrase in candidates:
+        encoded = (phrase + " ").encode("utf-8")
+        if size + len(encoded) > max_size:
+            continue
+        selected.append(encoded)
+        size += len(encoded)
+
+    selected.reverse()
+    return b"".join(selected)
@@ -0,0 +1,171 @@
+# write_queue.py
+# 搜索结果的后台写入队列：搜索完成后立即返回，由专用线程批量写入数据库
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+try:
+    from .pubmed_search_core import get_db_connection, save_search_traces, write_search_results
+    from .metrics import STAGE_SECONDS
+except ImportError:
+    from pubmed_search_core import get_db_connection, save_search_traces, write_search_results
+    from metrics import STAGE_SECONDS
+
+WRITE_BATCH_MAX_ARTICLES = int(os.environ.get("WRITE_BATCH_MAX_ARTICLES", "5000"))  # 一次组提交的文章上限
+WRITE_BATCH_WAIT_SECONDS = float(os.environ.get("WRITE_BATCH_WAIT_SECONDS", "0.2"))  # 等待更多任务合并的时间
+WRITE_MAX_RETRIES = int(os.environ.get("WRITE_MAX_RETRIES", "8"))
+
+
+def _is_lock_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class SearchWriteQueue:
+    """把多个搜索的结果合并成一次事务写入，遇到锁冲突时退避重试"""
+
+    def __init__(self, max_batch_articles=WRITE_BATCH_MAX_ARTICLES,
+                 batch_wait=WRITE_BATCH_WAIT_SECONDS, max_retries=WRITE_MAX_RETRIES):
+        self.max_batch_articles = max_batch_articles
+        self.batch_wait = batch_wait
+        self.max_retries = max_retries
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, search_id, search_params, articles, on_done=None, trace=None):
+        """
+        提交一个搜索的结果，立即返回
+
+        Args:
+            search_id: reserve_search_id预留的ID
+            on_done: 写入结束后回调 on_done(search_id, error)，成功时error为None
+            trace: 本次搜索的SearchTrace，写入成功后追加排队和db_save阶段并保存
+        """
+        self._ensure_started()
+        with self._pending_cond:
+            self._pending += 1
+        self._queue.put((search_id, search_params, articles, on_done, trace, time.perf_counter()))
+
+    def flush(self, timeout=None):
+        """等待队列中已提交的结果全部写完，返回是否在超时前完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending_cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_cond.wait(remaining)
+        return True
+
+    def qsize(self):
+        return self._pending
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="search-writer", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        """阻塞取出第一个任务，再在batch_wait内尽量合并后续任务"""
+        batch = [self._queue.get()]
+        article_count = len(batch[0][2])
+        deadline = time.monotonic() + self.batch_wait
+        while article_count < self.max_batch_articles:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(job)
+            article_count += len(job[2])
+        return batch, article_count
+
+    def _write_with_retry(self, conn, jobs):
+        delay = 0.05
+        for attempt in range(self.max_retries + 1):
+            try:
+                write_search_results(conn, jobs)
+                return
+            except sqlite3.OperationalError as e:
+                if not _is_lock_error(e) or attempt == self.max_retries:
+                    raise
+                print(f"⚠️ 数据库被锁定，{delay:.2f}秒后重试写入 ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+
+    def _save_traces(self, conn, batch, start, elapsed, article_count):
+        """结果已提交后再单独写入执行记录，记录失败不影响搜索结果"""
+        traces = []
+        for search_id, _, _, _, trace, submitted_at in batch:
+            if trace is None:
+                continue
+            trace.add_span('write_queue', submitted_at, start - submitted_at)
+            trace.add_span('db_save', start, elapsed, group_searches=len(batch), group_articles=article_count)
+            traces.append((search_id, trace.to_dict()))
+        if not traces:
+            return
+        try:
+            save_search_traces(conn, traces)
+        except Exception as e:
+            print(f"⚠️ 保存搜索执行记录失败 (搜索ID: {[search_id for search_id, _ in traces]}): {e}")
+
+    def _write_batch(self, conn, batch, article_count):
+        """
+        组提交一批搜索，返回 {search_id: error}（成功的搜索不在其中）
+
+        组提交失败且不是锁冲突（如某个搜索的数据有问题）时，逐个重新写入，
+        一个搜索的错误不会让同批其他搜索一起丢失
+        """
+        jobs = [(search_id, params, articles) for search_id, params, articles, *_ in batch]
+        try:
+            start = time.perf_counter()
+            self._write_with_retry(conn, jobs)
+            elapsed = time.perf_counter() - start
+            STAGE_SECONDS.observe(elapsed, stage='db_save')
+            print(f"✅ 批量写入 {len(jobs)} 次搜索, {article_count} 篇文章 "
+                  f"({elapsed * 1000:.0f} ms)")
+        except Exception as e:
+            print(f"❌ 批量写入失败 (搜索ID: {[job[0] for job in jobs]}): {e}")
+            if len(batch) == 1 or (isinstance(e, sqlite3.OperationalError) and _is_lock_error(e)):
+                return {job[0]: e for job in jobs}
+            print(f"🔄 逐个重新写入这 {len(batch)} 次搜索")
+            errors = {}
+            for job in batch:
+                errors.update(self._write_batch(conn, [job], len(job[2])))
+            return errors
+
+        self._save_traces(conn, batch, start, elapsed, article_count)
+        return {}
+
+    def _run(self):
+        conn = get_db_connection(timeout=5, check_same_thread=False)
+        while True:
+            batch, article_count = self._next_batch()
+            errors = self._write_batch(conn, batch, article_count)
+
+            for search_id, _, _, on_done, *_ in batch:
+                if on_done:
+                    try:
+                        on_done(search_id, errors.get(search_id))
+                    except Exception as e:
+                        print(f"❌ 写入回调出错 (搜索ID: {search_id}): {e}")
+            with self._pending_cond:
+                self._pending -= len(batch)
+                self._pending_cond.notify_all()
+
+
+# 进程级共享的写入队列
+search_write_queue = SearchWriteQueue()
+
+# 进程退出前尽量把队列写完
+atexit.register(search_write_queue.flush, 10)
@@ -0,0 +1,84 @@
+"""
+导出吞吐量基准：向临时数据库写入一次包含N篇文章的搜索，再按各格式流式导出
+
+用法:
+    python scripts/bench_export.py [--records 50000] [--formats ris,bibtex,csl] [--memory]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+parser = argparse.ArgumentParser(description="导出吞吐量基准")
+parser.add_argument("--records", type=int, default=50000)
+parser.add_argument("--formats", default="ris,bibtex,csl,json,ndjson,csv,markdown")
+parser.add_argument("--compression", default="zlib", choices=["", "zlib"], help="文本列压缩模式")
+parser.add_argument("--memory", action="store_true", help="额外用tracemalloc测量峰值内存（较慢）")
+args = parser.parse_args()
+
+tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_PATH"] = os.path.join(tmp.name, "bench.db")
+os.environ["DB_COMPRESSION"] = args.compression
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pubmed_search"))
+
+from exporters import EXPORT_FORMATS, export_chunks  # noqa: E402
+from pubmed_search_core import (  # noqa: E402
+    iter_search_article_rows, iter_search_articles, save_search_to_database
+)
+
+WORDS = ("telomere length aging cohort randomized trial association mortality risk analysis "
+         "patients outcome cancer cell expression mechanism clinical study").split()
+
+
+def make_article(i):
+    rng = random.Random(i)
+    title = " ".join(rng.choice(WORDS) for _ in range(12)).capitalize()
+    authors = [f"{rng.choice('ABCDEFGH')}{rng.choice('abcdef')} {rng.choice(WORDS).capitalize()}"
+               for _ in range(rng.randint(1, 8))]
+    return {
+        'pmid': str(30000000 + i), 'title': title, 'journal': 'Nature Medicine', 'journal_abbr': 'Nat Med',
+        'year': str(rng.randint(2000, 2025)), 'volume': str(rng.randint(1, 40)), 'issue': str(rng.randint(1, 12)),
+        'pages': f"{rng.randint(1, 900)}-{rng.randint(1, 99)}", 'doi': f"10.1038/s41591-{i}",
+        'abstract': " ".join(rng.choice(WORDS) for _ in range(rng.randint(120, 300))),
+        'authors': authors, 'article_types': ['Journal Article'], 'keywords': rng.sample(WORDS, 4),
+        'citation': f"{', '.join(authors[:3])}. {title}. Nat Med.", 'pubmed_url': f"https://pubmed.ncbi.nlm.nih.gov/{30000000 + i}/",
+        'impact_factor': 58.7, 'score': rng.random() * 100
+    }
+
+
+def run_export(fmt, open_articles):
+    total_bytes = 0
+    first_byte = None
+    start = time.perf_counter()
+    for chunk in export_chunks(fmt, open_articles, {'final_query': 'bench'}, args.records):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total_bytes += len(chunk)
+    return time.perf_counter() - start, first_byte, total_bytes
+
+
+start = time.perf_counter()
+search_id = save_search_to_database({'user_topic': 'bench', 'final_query': 'bench'},
+                                    [make_article(i) for i in range(args.records)])
+print(f"写入 {args.records} 篇文章: {time.perf_counter() - start:.1f} s (搜索ID {search_id})\n")
+
+for fmt in args.formats.split(","):
+    sources = [("dict", lambda: iter_search_articles(search_id))]
+    if EXPORT_FORMATS[fmt].reads_rows:
+        sources.insert(0, ("row", lambda: iter_search_article_rows(search_id)))
+
+    for source, open_articles in sources:
+        elapsed, first_byte, total_bytes = run_export(fmt, open_articles)
+        line = (f"{fmt:>9} [{source:>4}]: {args.records / elapsed:9.0f} 篇/s | {elapsed:6.2f} s | "
+                f"首字节 {first_byte * 1000:6.1f} ms | {total_bytes / 1024 / 1024:7.1f} MB")
+        if args.memory:
+            tracemalloc.start()
+            run_export(fmt, open_articles)
+            line += f" | 峰值内存 {tracemalloc.get_traced_memory()[1] / 1024 / 1024:6.1f} MB"
+            tracemalloc.stop()
+        print(line)
+
+tmp.cleanup()
@@ -0,0 +1,67 @@
+"""
+测量worker冷启动耗时：导入app模块、首次数据库访问、数据库已是最新版本时的启动
+
+用法:
+    python scripts/bench_startup.py [--runs 5] [--parallel 4]
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pubmed_search")
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+from pubmed_search_core import get_db_connection
+get_db_connection().close()
+print(f"{(imported - start) * 1000:.1f} {(time.perf_counter() - imported) * 1000:.1f}")
+"""
+
+
+def run_worker(db_path):
+    env = dict(os.environ, DATABASE_PATH=db_path, RETENTION_INTERVAL_SECONDS="0")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=APP_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    total_ms = (time.perf_counter() - start) * 1000
+    import_ms, first_db_ms = (float(x) for x in result.stdout.strip().splitlines()[-1].split())
+    return total_ms, import_ms, first_db_ms
+
+
+def report(label, samples):
+    totals, imports, first_dbs = zip(*samples)
+    print(f"{label:<24} 进程总耗时 {sum(totals) / len(totals):7.1f} ms | "
+          f"导入app {sum(imports) / len(imports):6.1f} ms | 首次数据库访问 {sum(first_dbs) / len(first_dbs):6.1f} ms")
+
+
+parser = argparse.ArgumentParser(description="worker启动耗时基准")
+parser.add_argument("--runs", type=int, default=5)
+parser.add_argument("--parallel", type=int, default=4, help="并发启动的worker数（检查迁移是否互斥）")
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmp:
+    cold = []
+    for i in range(args.runs):
+        cold.append(run_worker(os.path.join(tmp, f"cold_{i}.db")))
+    report("空数据库（执行迁移）", cold)
+
+    warm_db = os.path.join(tmp, "warm.db")
+    run_worker(warm_db)
+    report("已是最新版本（跳过DDL）", [run_worker(warm_db) for _ in range(args.runs)])
+
+    # 多个worker同时对同一个空数据库启动
+    parallel_db = os.path.join(tmp, "parallel.db")
+    env = dict(os.environ, DATABASE_PATH=parallel_db, RETENTION_INTERVAL_SECONDS="0")
+    procs = [subprocess.Popen([sys.executable, "-c", IMPORT_SNIPPET], cwd=APP_DIR, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+             for _ in range(args.parallel)]
+    failures = [p for p in procs if p.wait() != 0 or "失败" in p.communicate()[0]]
+    version = sqlite3.connect(parallel_db).execute("PRAGMA user_version").fetchone()[0]
+    print(f"并发启动 {args.parallel} 个worker: 失败 {len(failures)} 个, 数据库版本 {version}")
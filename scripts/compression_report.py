@@ -0,0 +1,44 @@
+"""
+统计数据库大文本列的压缩效果（体积和读写耗时）
+
+用法:
+    python scripts/compression_report.py                # 仅输出报告
+    python scripts/compression_report.py --train        # 先用已保存摘要训练共享字典
+    python scripts/compression_report.py --apply zlib   # 按指定模式重写已有文章
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pubmed_search"))
+
+from pubmed_search_core import (  # noqa: E402
+    DATABASE_PATH, compression_report, init_database, recompress_articles,
+    train_compression_dictionary
+)
+
+parser = argparse.ArgumentParser(description="数据库文本列压缩报告")
+parser.add_argument("--sample", type=int, default=1000, help="参与统计的文章数")
+parser.add_argument("--train", action="store_true", help="训练新的共享字典")
+parser.add_argument("--apply", choices=["none", "zlib", "zlib_dict"], help="按指定模式重写已有文章")
+args = parser.parse_args()
+
+init_database()
+print(f"数据库: {DATABASE_PATH} ({os.path.getsize(DATABASE_PATH) / 1024:.1f} KB)")
+
+if args.train:
+    train_compression_dictionary()
+
+report = compression_report(sample_size=args.sample)
+print(json.dumps(report, ensure_ascii=False, indent=2))
+
+for mode, stats in report["modes"].items():
+    per_article_write = stats["write_ms"] / max(report["samples"], 1)
+    per_article_read = stats["read_ms"] / max(report["samples"], 1)
+    print(f"{mode:>10}: 体积 {stats['ratio'] * 100:.1f}% | "
+          f"写入 {per_article_write:.3f} ms/篇 | 读取 {per_article_read:.3f} ms/篇")
+
+if args.apply:
+    recompress_articles(mode="" if args.apply == "none" else args.apply)
+    print(f"重写后数据库大小: {os.path.getsize(DATABASE_PATH) / 1024:.1f} KB (需VACUUM后才会缩小文件)")
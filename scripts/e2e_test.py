@@ -94,8 +94,9 @@ for idx, topic in enumerate(TOPICS, 1):
         try:
             r = sess.get(f"{BASE}/api/export_history/{search_id}/json", timeout=60)
             edata = r.json()
-            if edata.get("success"):
-                articles = edata["data"].get("articles", [])
+            if r.status_code == 200:
+                # 导出接口直接返回文件内容 {"search_parameters": ..., "articles": [...]}
+                articles = edata.get("articles", [])
                 print(f"完成：共 {len(articles)} 篇")
                 SUMMARY.append({"topic": topic, "status": "ok", "count": len(articles)})
             else:
@@ -0,0 +1,84 @@
+"""
+本地假OpenRouter服务：模拟chat/completions的普通和流式（SSE）响应，用于测试AI查询生成
+
+用法:
+    python scripts/fake_openrouter.py [--port 8765] [--token-delay 0.05] [--first-token-delay 0] [--fence] [--fail]
+    OPENROUTER_API_URL=http://127.0.0.1:8765/api/v1/chat/completions python pubmed_search/app.py
+"""
+import argparse
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+parser = argparse.ArgumentParser(description="本地假OpenRouter服务")
+parser.add_argument("--port", type=int, default=8765)
+parser.add_argument("--token-delay", type=float, default=0.05, help="流式响应每段之间的间隔（秒）")
+parser.add_argument("--first-token-delay", type=float, default=0.0, help="第一段之前的等待（秒），用于测试时间预算")
+parser.add_argument("--fence", action="store_true", help="把查询包在```pubmed代码块中返回")
+parser.add_argument("--fail", action="store_true", help="所有请求返回HTTP 500")
+args = parser.parse_args()
+
+
+def fake_query(prompt):
+    """根据提示词中的<user_topic>拼出一个查询"""
+    match = re.search(r"<user_topic>\s*(.*?)\s*</user_topic>", prompt, re.S)
+    words = re.findall(r"\w+", match.group(1) if match else "topic") or ["topic"]
+    groups = [f'({word}[tiab] OR "{word}s"[tiab])' for word in words[:4]]
+    query = " AND ".join(groups)
+    return f"```pubmed\n{query}\n```" if args.fence else query
+
+
+def chunks(text, size=6):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if args.fail:
+            self._send_json(500, {"error": {"message": "fake failure", "code": 500}})
+            return
+        content = fake_query(body["messages"][-1]["content"])
+        if not body.get("stream"):
+            time.sleep(args.first_token_delay)
+            self._send_json(200, {"id": "fake", "model": body.get("model"),
+                                  "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+        self.wfile.flush()
+        time.sleep(args.first_token_delay)
+        for part in chunks(content):
+            event = {"id": "fake", "model": body.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(args.token_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *log_args):
+        print(f"📡 {self.address_string()} {format % log_args}")
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"🤖 假OpenRouter服务运行在 http://127.0.0.1:{args.port}/api/v1/chat/completions")
+    server.serve_forever()
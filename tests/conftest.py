@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模块按pubmed_search目录内的平铺方式导入（与run.py、scripts/相同）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pubmed_search"))
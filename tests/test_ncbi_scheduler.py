@@ -0,0 +1,68 @@
+import threading
+import time
+
+import ncbi_scheduler
+from ncbi_scheduler import FairShareScheduler
+
+
+def test_over_quota_waiters_sleep_until_window_expires(monkeypatch):
+    monkeypatch.setattr(ncbi_scheduler, 'QUOTA_WINDOW_SECONDS', 1.0)
+    scheduler = FairShareScheduler(rate=5, quota_per_minute=2, weights={})
+    dispatches = []
+    original = scheduler._dispatch_locked
+
+    def counting_dispatch():
+        wait = original()
+        dispatches.append(wait)
+        return wait
+
+    monkeypatch.setattr(scheduler, '_dispatch_locked', counting_dispatch)
+
+    assert scheduler.acquire('alice')
+    assert scheduler.acquire('alice')
+    start = time.monotonic()
+    assert scheduler.acquire('alice')
+    elapsed = time.monotonic() - start
+
+    # 第三次要等最早的一次机会移出配额窗口，期间不能在锁上空转
+    assert 0.8 <= elapsed < 2.0
+    assert all(wait > 0 for wait in dispatches)
+    assert len(dispatches) < 20
+
+
+def test_over_quota_user_does_not_block_others(monkeypatch):
+    monkeypatch.setattr(ncbi_scheduler, 'QUOTA_WINDOW_SECONDS', 30.0)
+    scheduler = FairShareScheduler(rate=5, quota_per_minute=1, weights={})
+    assert scheduler.acquire('alice')
+
+    cancel = threading.Event()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(scheduler.acquire('alice', cancel_event=cancel)))
+    waiter.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    assert scheduler.acquire('bob')
+    assert time.monotonic() - start < 0.5
+
+    cancel.set()
+    waiter.join(timeout=2)
+    assert result == [False]
+    assert scheduler.stats()['waiting_bulk'] == 0
+
+
+def test_cancel_is_checked_outside_scheduler_lock():
+    scheduler = FairShareScheduler(rate=1, quota_per_minute=0, weights={})
+    assert scheduler.acquire('alice')      # 用掉唯一的令牌
+
+    class LockCheckingEvent:
+        held_lock = False
+
+        def is_set(self):
+            # CancelToken.is_set()可能查询SQLite，调用时不能持有调度锁
+            if scheduler._cond._is_owned():
+                LockCheckingEvent.held_lock = True
+            return True
+
+    assert scheduler.acquire('alice', cancel_event=LockCheckingEvent()) is False
+    assert not LockCheckingEvent.held_lock
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from query_parser import (Group, QuerySyntaxError, RangeTerm, Term, canonical_query, encoded_size,
+                          parse_query, shard_query, to_query)
+
+# 高级检索、AI生成和build_search_term产生的真实查询写法
+PUBMED_QUERIES = [
+    '(telomere[tiab] OR "telomere length"[tiab]) AND ("2020/01/01"[Date - Publication] : "3000"[Date - Publication])',
+    '("2020"[dp] : "2024"[dp])',
+    '"breast neoplasms"[MeSH Terms] AND ("2019/01/01"[PDAT]:"2023/12/31"[PDAT]) AND english[la]',
+    '(aging OR senescence) AND 2015[dp]:2020[dp] AND review[pt]',
+    '(diabetes[mh] OR "insulin resistance"[tiab]) AND ("Nature"[journal] OR "Science"[journal])',
+    'cancer[tiab] NOT (mice[mh] OR rats[mh])',
+    'crispr AND ("Nature"[journal] OR "Cell"[journal]) AND 2020:2025[pdat]',
+    'gut microbiota depression AND 2020:[pdat]',
+    'cancer AND :2024[pdat]',
+]
+
+RANGE = '("2020/01/01"[Date - Publication] : "3000"[Date - Publication])'
+
+
+@pytest.mark.parametrize('query', PUBMED_QUERIES)
+def test_round_trip(query):
+    assert to_query(parse_query(query)) == query
+
+
+def test_range_is_one_term():
+    node = parse_query(f'telomere[tiab] AND {RANGE}')
+    assert isinstance(node, Group) and node.op == 'AND'
+    assert isinstance(node.children[1], RangeTerm)
+    assert node.children[1].text == RANGE
+
+
+def test_canonical_range_ignores_wrapping_parentheses():
+    assert canonical_query(f'a AND {RANGE}') == canonical_query(f'{RANGE[1:-1]} AND A')
+
+
+@pytest.mark.parametrize('query', ['cancer[tiab] :', 'cancer[tiab] : AND aging', '"2020"[dp] : )'])
+def test_incomplete_range_is_syntax_error(query):
+    with pytest.raises(QuerySyntaxError):
+        parse_query(query)
+
+
+def _matches(node, documents):
+    """在一组合成文档上求值：每个检索词随机命中一部分文档"""
+    if isinstance(node, Term):
+        rng = random.Random(to_query(node))
+        return {doc for doc in documents if rng.random() < 0.3}
+    results = [_matches(child, documents) for child in node.children]
+    if node.op == 'AND':
+        return set.intersection(*results)
+    if node.op == 'OR':
+        return set.union(*results)
+    return results[0] - results[1]
+
+
+@pytest.mark.parametrize('template', [
+    '({terms}) AND ' + RANGE,
+    RANGE + ' AND ({terms}) NOT review[pt]',
+    '"breast neoplasms"[mh] AND ({terms}) AND 2015[dp]:2020[dp]',
+])
+def test_shard_union_equals_original(template):
+    terms = ' OR '.join(f'"gene{i} expression"[tiab]' for i in range(60))
+    query = template.format(terms=terms)
+    shards = shard_query(query, 400)
+    assert len(shards) > 1
+    documents = range(500)
+    union = set()
+    for shard in shards:
+        assert encoded_size(shard) <= 400
+        union |= _matches(parse_query(shard), documents)
+    assert union == _matches(parse_query(query), documents)
+    # 范围在每个子查询中原样保留
+    range_text = RANGE if RANGE in query else '2015[dp]:2020[dp]'
+    assert all(range_text in shard for shard in shards)
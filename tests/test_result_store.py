@@ -0,0 +1,47 @@
+import random
+
+from result_index import ResultIndex
+from result_store import ResultStore
+
+
+def make_article(i):
+    rng = random.Random(i)
+    return {
+        'pmid': str(i), 'title': f'Article {i}', 'journal': 'Nature Medicine', 'journal_abbr': 'Nat Med',
+        'year': str(rng.randint(2000, 2025)), 'authors': ['A Author'], 'doi': None,
+        'pubmed_url': f'https://pubmed.ncbi.nlm.nih.gov/{i}/', 'article_types': ['Journal Article'],
+        'abstract': 'text', 'impact_factor': rng.choice([None, 3.5, 58.7]), 'score': rng.randint(0, 5)
+    }
+
+
+def index_rows(store):
+    return store._connect().execute('SELECT COUNT(*) FROM search_result_index').fetchone()[0]
+
+
+def test_append_extends_index_and_writes_full_index_once(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    writer, reader = ResultStore(path), ResultStore(path)
+    articles = [make_article(i) for i in range(250)]
+
+    for start in range(0, 250, 100):
+        writer.append('s1', {}, articles[start:start + 100])
+        # 追加期间不重写完整索引；其他worker从各批卡片重建
+        assert index_rows(writer) == 0
+        expected = ResultIndex.from_articles(articles[:start + 100]).orders
+        assert writer.get_index('s1').orders == expected
+        assert reader.get_index('s1').orders == expected
+
+    writer.finish('s1', {'done': True})
+    assert index_rows(writer) == 1
+    assert writer._connect().execute('SELECT COUNT(*) FROM search_result_card_batches').fetchone()[0] == 0
+    other = ResultStore(path)
+    assert other.get_index('s1').orders == ResultIndex.from_articles(articles).orders
+    assert [a['pmid'] for a in other.get_ranked_articles('s1', 0, 5)] == \
+        [a['pmid'] for a in writer.get_ranked_articles('s1', 0, 5)]
+
+
+def test_finish_without_batches_saves_empty_result_set(tmp_path):
+    store = ResultStore(str(tmp_path / 'jobs.db'))
+    store.finish('s2', {})
+    assert store.get_meta('s2')['total'] == 0
+    assert store.get_index('s2').cards == []
@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+import search_executor
+from search_executor import SearchExecutor, SearchQueueFull
+
+
+def test_small_search_does_not_wait_behind_bulk_searches():
+    release = threading.Event()
+    started = threading.Event()
+    small_done = threading.Event()
+    executor = SearchExecutor(concurrency=1, max_queue=5, interactive_concurrency=1)
+
+    executor.submit('bulk-1', lambda: started.set() or release.wait())
+    assert started.wait(2)
+    assert executor.submit('bulk-2', release.wait) == 1
+    assert executor.submit('small', small_done.set, interactive=True) == 0
+
+    # 大搜索占满普通线程时，小搜索由专用线程立即执行
+    assert small_done.wait(2)
+    assert executor.queue_position('bulk-2') == 1
+    release.set()
+
+
+def test_small_searches_queue_ahead_of_bulk_searches():
+    release = threading.Event()
+    started = threading.Event()
+    executor = SearchExecutor(concurrency=1, max_queue=5, interactive_concurrency=0)
+
+    executor.submit('bulk-1', lambda: started.set() or release.wait())
+    assert started.wait(2)
+    executor.submit('bulk-2', release.wait)
+    executor.submit('small', release.wait, interactive=True)
+
+    assert [job_id for job_id, _, _ in executor.queue_snapshot()] == ['small', 'bulk-2']
+    with pytest.raises(SearchQueueFull):
+        for i in range(5):
+            executor.submit(f'more-{i}', release.wait)
+    release.set()
+
+
+def test_limits_are_split_across_workers(monkeypatch):
+    monkeypatch.setattr(search_executor, 'WEB_CONCURRENCY', 2)
+    monkeypatch.setattr(search_executor, 'SEARCH_CONCURRENCY', 3)
+    monkeypatch.setattr(search_executor, 'SEARCH_QUEUE_SIZE', 20)
+    monkeypatch.setattr(search_executor, 'SEARCH_INTERACTIVE_CONCURRENCY', 0)
+
+    executor = SearchExecutor()
+    assert (executor.concurrency, executor.max_queue, executor.interactive_concurrency) == (2, 10, 0)